@@ -1,166 +1,164 @@
-import statistics
 import time
 
+import numpy as np
+from scipy import stats
+
+# per sample sums of the fio results of a group, one column per metric
+_METRICS = (
+    "read-iops",
+    "write-iops",
+    "read-bw",
+    "write-bw",
+    "read-lat-sum",
+    "read-ios",
+    "write-lat-sum",
+    "write-ios",
+)
+_COLUMN = {metric: column for column, metric in enumerate(_METRICS)}
+
 
 class Fio_Analyzer:
     """
-    Fio Analyzer - this class will consume processed fio json results and calculate the average
-    total iops for x number of samples.results are analyzed based on operation and io size,
-    this is a static evaluation and future enhancements could evalute results based on
-    other properties dynamically.
+    Fio Analyzer - this class will consume processed fio json results and calculate statistics of
+    iops, bandwidth and latency across samples. results are grouped by operation and io size, the
+    results of each sample are summed over hosts and the samples of each group are stored in an
+    array indexed by sample so statistics are computed with NumPy.
     """
 
-    def __init__(self, uuid, user, cluster_name):
+    def __init__(self, uuid, user, cluster_name, confidence=0.95):
         self.uuid = uuid
         self.user = user
-        self.fio_processed_results_list = []
-        self.sample_list = []
-        self.operation_list = []
-        self.io_size_list = []
-        self.sumdoc = {}
         self.cluster_name = cluster_name
+        # confidence level of the confidence interval of the mean across samples
+        self.confidence = confidence
+        # (operation, io size) -> {sample: row of per sample sums}
+        self.groups = {}
+        # (operation, io size) -> earliest start time in ms
+        self.starttimes = {}
 
     def add_fio_result_documents(self, document_list, starttime):
         """
-        for each new document add it to the results list with its starttime
+        add the results of each document to the sums of its sample, operation and io size
         """
         for document in document_list:
-            fio_result = {}
-            fio_result["document"] = document
-            fio_result["starttime"] = starttime
-            self.fio_processed_results_list.append(fio_result)
+            fio = document["fio"]
+            if fio["jobname"] == "All clients":
+                continue
+            options = fio.get("job options", {})
+            global_options = document.get("global_options", {})
+            # the options of the job section override the global ones
+            bs_value = (
+                options.get("bs")
+                or options.get("bsrange")
+                or global_options.get("bs")
+                or global_options.get("bsrange")
+            )
+            key = (options["rw"], bs_value)
+            samples = self.groups.setdefault(key, {})
+            row = samples.get(document["sample"])
+            if row is None:
+                row = samples[document["sample"]] = np.zeros(len(_METRICS))
+            for direction in ("read", "write"):
+                direction_stats = fio.get(direction, {})
+                ios = float(direction_stats.get("total_ios", 0))
+                row[_COLUMN[direction + "-iops"]] += float(direction_stats.get("iops", 0))
+                row[_COLUMN[direction + "-bw"]] += float(direction_stats.get("bw", 0))
+                row[_COLUMN[direction + "-lat-sum"]] += (
+                    float(direction_stats.get("lat_ns", {}).get("mean", 0)) * ios
+                )
+                row[_COLUMN[direction + "-ios"]] += ios
+            self.starttimes[key] = min(self.starttimes.get(key, starttime), starttime)
 
-    def calculate_iops_sum(self):
+    def _statistics(self, values):
         """
-        will loop through all documents and will populate parameter lists and sum
-        total iops across all host for a specific operation and io size
+        mean, stdev, coefficient of variation (in percent), min, max and confidence interval of the
+        mean of each column of values, one row per sample
         """
-
-        for fio_result in self.fio_processed_results_list:
-            if fio_result["document"]["fio"]["jobname"] != "All clients":
-                sample = fio_result["document"]["sample"]
-
-                if fio_result["document"]["global_options"].get("bs"):
-                    bs_value = fio_result["document"]["global_options"]["bs"]
-                elif fio_result["document"]["global_options"].get("bsrange"):
-                    bs_value = fio_result["document"]["global_options"]["bsrange"]
-
-                rw = fio_result["document"]["fio"]["job options"]["rw"]
-
-                if sample not in self.sample_list:
-                    self.sample_list.append(sample)
-                if rw not in self.operation_list:
-                    self.operation_list.append(rw)
-                if bs_value not in self.io_size_list:
-                    self.io_size_list.append(bs_value)
-
-        for sample in self.sample_list:
-            self.sumdoc[sample] = {}
-            for rw in self.operation_list:
-                self.sumdoc[sample][rw] = {}
-                for bs_value in self.io_size_list:
-                    self.sumdoc[sample][rw][bs_value] = {}
-
-            # get measurements
-
-        for fio_result in self.fio_processed_results_list:
-            if fio_result["document"]["fio"]["jobname"] != "All clients":
-                sample = fio_result["document"]["sample"]
-
-                if fio_result["document"]["global_options"].get("bs"):
-                    bs_value = fio_result["document"]["global_options"]["bs"]
-                elif fio_result["document"]["global_options"].get("bsrange"):
-                    bs_value = fio_result["document"]["global_options"]["bsrange"]
-
-                rw = fio_result["document"]["fio"]["job options"]["rw"]
-
-                if not self.sumdoc[sample][rw][bs_value]:
-                    time_s = fio_result["starttime"] / 1000.0
-                    self.sumdoc[sample][rw][bs_value]["date"] = time.strftime(
-                        "%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(time_s)
-                    )
-                    self.sumdoc[sample][rw][bs_value]["write"] = 0
-                    self.sumdoc[sample][rw][bs_value]["read"] = 0
-
-                self.sumdoc[sample][rw][bs_value]["write"] += float(
-                    fio_result["document"]["fio"]["write"]["iops"]
-                )
-                self.sumdoc[sample][rw][bs_value]["read"] += float(
-                    fio_result["document"]["fio"]["read"]["iops"]
-                )
+        count = len(values)
+        mean = values.mean(axis=0)
+        if count > 1:
+            stdev = values.std(axis=0, ddof=1)
+            margin = stats.t.ppf((1 + self.confidence) / 2, count - 1) * stdev / np.sqrt(count)
+        else:
+            stdev = np.zeros_like(mean)
+            margin = np.full_like(mean, np.nan)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cv = np.where(mean != 0, stdev / mean * 100, 0.0)
+        return {
+            "mean": mean,
+            "stdev": stdev,
+            "cv": cv,
+            "min": values.min(axis=0),
+            "max": values.max(axis=0),
+            "ci_low": mean - margin,
+            "ci_high": mean + margin,
+        }
 
     def emit_actions(self):
         """
-        Will calculate the average iops across multiple samples and return list containing items
-        for each result based on operation/io size
+        Will calculate the statistics across samples of each operation/io size and yield a document
+        for each of them
         """
-
-        importdoc = {"ceph_benchmark_test": {"test_data": {}}, "uuid": self.uuid, "user": self.user}
-
-        self.calculate_iops_sum()
-
-        for oper in self.operation_list:
-            for io_size in self.io_size_list:
-                average_write_result_list = []
-                average_read_result_list = []
-                tmp_doc = {}
-                tmp_doc["object_size"] = io_size  # set document's object size
-                tmp_doc["operation"] = oper  # set documents operation
-                firstrecord = True
-                calcuate_percent_std_dev = False
-
-                for itera in self.sample_list:  #
-                    average_write_result_list.append(self.sumdoc[itera][oper][io_size]["write"])
-                    average_read_result_list.append(self.sumdoc[itera][oper][io_size]["read"])
-
-                    if firstrecord:
-                        importdoc["date"] = self.sumdoc[itera][oper][io_size]["date"]
-                        firstrecord = True
-
-                read_average = sum(average_read_result_list) / len(average_read_result_list)
-                if read_average > 0.0:
-                    tmp_doc["read-iops"] = read_average
-                    if len(average_read_result_list) > 1:
-                        calcuate_percent_std_dev = True
-                else:
-                    tmp_doc["read-iops"] = 0
-
-                write_average = sum(average_write_result_list) / len(average_write_result_list)
-                if write_average > 0.0:
-                    tmp_doc["write-iops"] = write_average
-                    if len(average_write_result_list) > 1:
-                        calcuate_percent_std_dev = True
+        for (oper, io_size), samples in self.groups.items():
+            sums = np.array([samples[sample] for sample in sorted(samples)])
+            # metrics of each sample, latency is the mean over all I/Os of the sample in ns
+            columns = {
+                "read-iops": sums[:, _COLUMN["read-iops"]],
+                "write-iops": sums[:, _COLUMN["write-iops"]],
+                "total-iops": sums[:, _COLUMN["read-iops"]] + sums[:, _COLUMN["write-iops"]],
+                "read-bw": sums[:, _COLUMN["read-bw"]],
+                "write-bw": sums[:, _COLUMN["write-bw"]],
+            }
+            with np.errstate(divide="ignore", invalid="ignore"):
+                for direction in ("read", "write"):
+                    ios = sums[:, _COLUMN[direction + "-ios"]]
+                    columns[direction + "-lat-mean-ns"] = np.where(
+                        ios > 0, sums[:, _COLUMN[direction + "-lat-sum"]] / ios, 0.0
+                    )
+            names = list(columns)
+            statistics = self._statistics(np.column_stack([columns[name] for name in names]))
+
+            tmp_doc = {
+                "object_size": io_size,  # set document's object size
+                "operation": oper,  # set documents operation
+                "samples": len(sums),
+                # the confidence interval is null with a single sample
+                "statistics": {
+                    name: {
+                        field: None if np.isnan(values[i]) else float(values[i])
+                        for field, values in statistics.items()
+                    }
+                    for i, name in enumerate(names)
+                },
+            }
+            for name in ("read-iops", "write-iops", "total-iops"):
+                tmp_doc[name] = tmp_doc["statistics"][name]["mean"]
+
+            # percent std-dev of the iops of the operation, as in previous versions
+            if len(sums) > 1 and tmp_doc["total-iops"] > 0:
+                iops_stdev = {
+                    name: tmp_doc["statistics"][name]["stdev"] for name in ("read-iops", "write-iops")
+                }
+                if "read" in oper and tmp_doc["read-iops"] > 0:
+                    std_dev = iops_stdev["read-iops"] / tmp_doc["read-iops"]
+                elif "write" in oper and tmp_doc["write-iops"] > 0:
+                    std_dev = iops_stdev["write-iops"] / tmp_doc["write-iops"]
+                elif "randrw" in oper:
+                    std_dev = (iops_stdev["read-iops"] + iops_stdev["write-iops"]) / tmp_doc["total-iops"]
                 else:
-                    tmp_doc["write-iops"] = 0
-
-                tmp_doc["total-iops"] = tmp_doc["write-iops"] + tmp_doc["read-iops"]
-
-                if calcuate_percent_std_dev:
-                    if "read" in oper:
-                        tmp_doc["std-dev-%s" % io_size] = round(
-                            ((statistics.stdev(average_read_result_list) / read_average) * 100), 3
-                        )
-                    elif "write" in oper:
-                        tmp_doc["std-dev-%s" % io_size] = round(
-                            ((statistics.stdev(average_write_result_list) / write_average) * 100), 3
-                        )
-                    elif "randrw" in oper:
-                        tmp_doc["std-dev-%s" % io_size] = round(
-                            (
-                                (
-                                    (
-                                        statistics.stdev(average_read_result_list)
-                                        + statistics.stdev(average_write_result_list)
-                                    )
-                                    / tmp_doc["total-iops"]
-                                )
-                                * 100
-                            ),
-                            3,
-                        )
-
-                importdoc["ceph_benchmark_test"]["test_data"] = tmp_doc
-                importdoc["cluster_name"] = self.cluster_name
-                # TODO add ID to document
-                index = "analyzed-result"
-                yield importdoc, index
+                    std_dev = None
+                if std_dev is not None:
+                    tmp_doc["std-dev-%s" % io_size] = round(std_dev * 100, 3)
+
+            importdoc = {
+                "ceph_benchmark_test": {"test_data": tmp_doc},
+                "uuid": self.uuid,
+                "user": self.user,
+                "cluster_name": self.cluster_name,
+                "date": time.strftime(
+                    "%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(self.starttimes[(oper, io_size)] / 1000.0)
+                ),
+            }
+            # TODO add ID to document
+            index = "analyzed-result"
+            yield importdoc, index
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Exact latency percentiles across fio clients and jobs from ``json+`` completion latency bins.
+
+With ``--output-format=json+``, fio adds to the ``clat_ns`` stats of every job and data direction a
+``bins`` map of latency in nsec to number of I/Os. Percentiles of several clients cannot be combined, but
+their bins can: the bins of every client and job are merged into one sparse histogram, and percentiles
+are computed from its cumulative counts the way fio computes the percentiles of a single job.
+"""
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+DIRECTIONS = ("read", "write", "trim")
+ALL_CLIENTS = "All clients"
+
+
+class ClatHistogram:
+    """Sparse histogram of completion latencies in nsec, merged from fio ``clat_ns`` bins."""
+
+    def __init__(self):
+        self._values: List[np.ndarray] = []
+        self._counts: List[np.ndarray] = []
+        # number of client jobs merged into the histogram
+        self.sources = 0
+
+    def add_bins(self, bins: Mapping[str, int]):
+        """Add the ``clat_ns.bins`` map of one client job."""
+        self.sources += 1
+        if bins:
+            self._values.append(np.fromiter((int(value) for value in bins), dtype=np.int64, count=len(bins)))
+            self._counts.append(np.fromiter(bins.values(), dtype=np.int64, count=len(bins)))
+
+    def update(self, other: "ClatHistogram"):
+        """Add the bins of another histogram."""
+        self.sources += other.sources
+        if other.samples:
+            self._values.append(other.values)
+            self._counts.append(other.counts)
+
+    def _consolidate(self):
+        if len(self._values) == 1:
+            return
+        values = np.concatenate(self._values) if self._values else np.zeros(0, dtype=np.int64)
+        counts = np.concatenate(self._counts) if self._counts else np.zeros(0, dtype=np.int64)
+        values, inverse = np.unique(values, return_inverse=True)
+        merged = np.zeros(len(values), dtype=np.int64)
+        np.add.at(merged, inverse, counts)
+        nonzero = merged > 0
+        self._values, self._counts = [values[nonzero]], [merged[nonzero]]
+
+    @property
+    def values(self) -> np.ndarray:
+        """Sorted latencies in nsec of the non-empty bins."""
+        self._consolidate()
+        return self._values[0]
+
+    @property
+    def counts(self) -> np.ndarray:
+        """Number of I/Os of each bin."""
+        self._consolidate()
+        return self._counts[0]
+
+    @property
+    def samples(self) -> int:
+        return int(sum(counts.sum() for counts in self._counts))
+
+    def mean(self) -> float:
+        return float((self.values * self.counts).sum() / self.samples)
+
+    def percentiles(self, wanted: Iterable[float]) -> np.ndarray:
+        """
+        Return the latency of each wanted percentile, like fio: the first bin where the cumulative count
+        reaches the percentile of the total count.
+        """
+        cumulative = np.cumsum(self.counts)
+        thresholds = np.asarray(list(wanted), dtype=float) / 100.0 * cumulative[-1]
+        found = np.searchsorted(cumulative, thresholds, side="left")
+        return self.values[np.clip(found, 0, len(cumulative) - 1)]
+
+
+def pop_clat_histograms(
+    client_stats: Iterable[Dict],
+    directions: Iterable[str] = DIRECTIONS,
+    histograms: Optional[Dict[Tuple[str, str], ClatHistogram]] = None,
+) -> Dict[Tuple[str, str], ClatHistogram]:
+    """
+    Remove the ``clat_ns`` bins from fio ``json+`` client stats and merge them per job and direction.
+
+    The bins of every client running a job are merged in the histogram of ``(jobname, direction)``. The
+    bins of the ``All clients`` entries are removed without being merged, they are already counted in the
+    clients. Directions without I/O are left out.
+
+    Parameters
+    ----------
+    client_stats : iterable of dict
+        ``client_stats`` of fio ``json+`` output, modified in place.
+    directions : iterable of str, optional
+        Data directions whose bins are merged.
+    histograms : dict, optional
+        Histograms to which the bins are added, modified in place, to merge client stats read one entry
+        at a time.
+    """
+    directions = tuple(directions)
+    if histograms is None:
+        histograms = {}
+    for result in client_stats:
+        for direction in directions:
+            bins = result.get(direction, {}).get("clat_ns", {}).pop("bins", None)
+            if bins is None or result.get("jobname") == ALL_CLIENTS:
+                continue
+            key = (result["jobname"], direction)
+            histograms.setdefault(key, ClatHistogram()).add_bins(bins)
+    return {key: histogram for key, histogram in histograms.items() if histogram.samples}
@@ -13,7 +13,6 @@
 #  100 - max latency
 
 # TO-DO:
-#   separate read and write stats for randrw mixed workload
 #   report average latency if needed
 #   prove that it works (partially done with unit tests)
 
@@ -21,11 +20,19 @@
 # if you do this, don't pass normal CLI parameters to it
 # otherwise it runs the CLI
 
+import heapq
 import math
 import os
 import sys
 import time
+import warnings
 from copy import deepcopy
+from functools import reduce
+from itertools import islice
+
+import numpy as np
+
+from snafu.utils.parallel import ordered_map
 
 unittest2_imported = True
 try:
@@ -386,6 +393,7 @@ def compute_percentiles_from_logs(
     log_hist_msec=None,
     output_unit="usec",
     output_csv_file_header=False,
+    workers=1,
 ):
     # default changes based on fio version
     if fio_version == 2:
@@ -418,14 +426,18 @@ def compute_percentiles_from_logs(
     # (exception: if randrw workload, then there is a read and a write
     # record for the same time interval)
 
+    # with more than one worker, log files are parsed and aligned by a pool of processes
+    # results are merged in file_list order so the output does not depend on the worker count
+
     test_start_time = 0
     test_end_time = 1.0e18
     hist_files = {}
+    parsed_files = ordered_map(
+        parse_hist_file, [(fn, buckets_per_interval, log_hist_msec) for fn in file_list], workers=workers
+    )
     for fn in file_list:
         try:
-            (hist_files[fn], log_start_time, log_end_time) = parse_hist_file(
-                fn, buckets_per_interval, log_hist_msec
-            )
+            (hist_files[fn], log_start_time, log_end_time) = next(parsed_files)
         except FioHistoLogExc as e:
             myabort(str(e))
         # we consider the test started when all threads have started logging
@@ -446,10 +458,15 @@ def compute_percentiles_from_logs(
         ((j * time_quantum * msec_per_sec), deepcopy(zeroed_buckets)) for j in range(0, time_interval_count)
     ]
 
-    for logfn in hist_files.keys():
-        aligned_per_thread = align_histo_log(
-            hist_files[logfn], time_quantum, buckets_per_interval, test_start_time, test_end_time
-        )
+    aligned_logs = ordered_map(
+        align_histo_log,
+        [
+            (hist_files[logfn], time_quantum, buckets_per_interval, test_start_time, test_end_time)
+            for logfn in hist_files.keys()
+        ],
+        workers=workers,
+    )
+    for aligned_per_thread in aligned_logs:
         for t in range(0, time_interval_count):
             (_, all_threads_histo_t) = all_threads_histograms[t]
             (_, log_histo_t) = aligned_per_thread[t]
@@ -497,6 +514,494 @@ def compute_percentiles_from_logs(
 # end of MAIN PROGRAM
 
 
+# --------- NumPy engine ------------
+# same computation as compute_percentiles_from_logs, with each histogram log held in a 2-D array
+# of (records, buckets) so parsing, alignment, merging and percentiles are vectorized
+
+
+# load a histogram log file into arrays, raises FioHistoLogExc like parse_hist_file
+# returns (times_ms, directions, buckets, start_time, end_time) where buckets is a
+# (records, buckets_per_interval) array
+
+
+def load_hist_file(logfn, buckets_per_interval, log_hist_msec):
+    with open(logfn) as f:
+        records = [line for line in (line.strip() for line in f) if line]
+    columns = 3 + buckets_per_interval
+    with warnings.catch_warnings():
+        # malformed input is detected below from the number of parsed values
+        warnings.simplefilter("ignore", DeprecationWarning)
+        values = np.fromstring(",".join(records), dtype=np.int64, sep=",")
+    if (
+        not records
+        or values.size != len(records) * columns
+        or any(record.count(",") != columns - 1 for record in records)
+    ):
+        # let the line by line parser report what is wrong with the file
+        (intervals, start_time, end_time) = parse_hist_file(logfn, buckets_per_interval, log_hist_msec)
+        values = np.array([[t, d, bsz] + buckets for (t, d, bsz, buckets) in intervals], dtype=np.int64)
+        return (values[:, 0], values[:, 1], values[:, 3:], start_time, end_time)
+    values = values.reshape(len(records), columns)
+    times, directions = values[:, 0], values[:, 1]
+    if (
+        (values < 0).any()
+        or ((directions != direction_read) & (directions != direction_write)).any()
+        or (values[:, 2] > (1 << 24)).any()
+        or any((np.diff(times[directions == d]) < 0).any() for d in (direction_read, direction_write))
+    ):
+        parse_hist_file(logfn, buckets_per_interval, log_hist_msec)
+
+    # filter out records with the same timestamp and direction as the previous record
+    keep = np.ones(len(values), dtype=bool)
+    keep[1:] = (times[1:] != times[:-1]) | (directions[1:] != directions[:-1])
+    values = values[keep]
+    times, directions = values[:, 0], values[:, 1]
+
+    first_timestamp = int(times[0])
+    if first_timestamp < 1000000:
+        start_time = 0  # assume log_unix_epoch = 0
+    elif log_hist_msec is not None:
+        start_time = first_timestamp - int(log_hist_msec)
+    elif len(times) > 1:
+        start_time = first_timestamp - (int(times[1]) - first_timestamp)
+    else:
+        raise FioHistoLogExc("no way to estimate test start time")
+    return (times, directions, values[:, 3:], start_time, int(times[-1]))
+
+
+# align a histogram log loaded by load_hist_file to the time quantum, see align_histo_log
+# each record is weighted by the fraction of its time interval overlapping each quantum
+# returns a (time_interval_count, buckets) array, or a (time_interval_count, 2, buckets) array
+# of read and write histograms if by_direction is set
+# quanta before min_timestamp_ms are dropped
+
+
+def align_histo_array(
+    times,
+    directions,
+    buckets,
+    time_quantum,
+    min_timestamp_ms,
+    max_timestamp_ms,
+    block=1024,
+    by_direction=False,
+):
+    (end_time, time_interval_count) = get_time_intervals(time_quantum, min_timestamp_ms, max_timestamp_ms)
+    time_qtm_ms = time_quantum * msec_per_sec
+    if by_direction:
+        aligned = np.zeros((time_interval_count, 2, buckets.shape[1]))
+    else:
+        aligned = np.zeros((time_interval_count, buckets.shape[1]))
+
+    # a record ends when the next record of the same direction starts
+    ends = np.full(len(times), end_time * msec_per_sec, dtype=np.int64)
+    for direction in (direction_read, direction_write):
+        indices = np.flatnonzero(directions == direction)
+        ends[indices[:-1]] = times[indices[1:]]
+    durations = ends - times
+    valid = durations > 0
+
+    # expand every record into the quanta it overlaps
+    first_qtm = (times - min_timestamp_ms) // time_qtm_ms
+    last_qtm = (ends - min_timestamp_ms - 1) // time_qtm_ms
+    qtm_counts = np.where(valid, np.maximum(last_qtm - first_qtm + 1, 0), 0)
+    for begin in range(0, len(times), block):
+        end = min(begin + block, len(times))
+        counts = qtm_counts[begin:end]
+        record = np.repeat(np.arange(begin, end), counts)
+        offsets = np.arange(len(record)) - np.repeat(np.cumsum(counts) - counts, counts)
+        qtm_index = first_qtm[record] + offsets
+        qtm_start = min_timestamp_ms + qtm_index * time_qtm_ms
+        overlap = np.minimum(qtm_start + time_qtm_ms, ends[record]) - np.maximum(qtm_start, times[record])
+        weight = overlap / durations[record]
+        inside = (qtm_index >= 0) & (qtm_index < time_interval_count)
+        record, qtm_index, weight = record[inside], qtm_index[inside], weight[inside]
+        if by_direction:
+            target = (qtm_index, directions[record])
+        else:
+            target = qtm_index
+        np.add.at(aligned, target, buckets[record] * weight[:, np.newaxis])
+    return aligned
+
+
+# compute the wanted percentiles of every histogram row in one pass
+# rows are turned into cumulative percentages, offset so that the flattened array is sorted,
+# and a single searchsorted finds the first bucket exceeding each wanted percentile of each row
+# like get_pctiles, the max is the first bucket reaching 99.9999%
+# returns (samples, pctiles) arrays, pctiles rows are NaN when no I/O was done
+
+
+def get_pctiles_array(histograms, wanted, bucket_times):
+    bucket_times = np.asarray(bucket_times, dtype=float)
+    wanted = np.asarray(wanted, dtype=float)
+    rows, bucket_count = histograms.shape
+    cumulative = np.cumsum(histograms, axis=1)
+    samples = cumulative[:, -1]
+    has_io = samples > 0
+    pct = 100.0 * cumulative / np.where(has_io, samples, 1.0)[:, np.newaxis]
+
+    # searching right of the value just below 99.9999 is searching left of 99.9999
+    almost_100 = 99.9999
+    targets = np.where(wanted == 100.0, np.nextafter(almost_100, 0.0), wanted)
+    row_offset = 200.0 * np.arange(rows)[:, np.newaxis]
+    found = np.searchsorted((pct + row_offset).ravel(), (targets + row_offset).ravel(), side="right")
+    b = np.clip(
+        found.reshape(rows, len(wanted)) - np.arange(rows)[:, np.newaxis] * bucket_count, 0, bucket_count - 1
+    )
+    row_index = np.arange(rows)[:, np.newaxis]
+    pct_b = pct[row_index, b]
+    last_pct = np.where(b > 0, pct[row_index, b - 1], 0.0)
+    offset_frac = (wanted - last_pct) / np.where(pct_b > last_pct, pct_b - last_pct, 1.0)
+    pctiles = bucket_times[b, 0] + offset_frac * (bucket_times[b, 1] - bucket_times[b, 0])
+    pctiles[~has_io] = np.nan
+    return samples, pctiles
+
+
+# NumPy version of compute_percentiles_from_logs which returns the results instead of only writing them
+# returns (msec_since_start, samples, pctiles) arrays, one row per time quantum after the first one
+# pctiles columns follow pctiles_wanted and are NaN when no I/O was done during the time quantum
+# with by_direction, reads and writes are aggregated separately instead of in the same buckets, and
+# samples and pctiles get a direction axis after the time axis, indexed by direction_read/direction_write
+# the CSV output of compute_percentiles_from_logs is still written if output_csv_file is set,
+# with a direction column after msec-since-start with by_direction
+
+
+def compute_percentiles_from_logs_numpy(
+    file_list,
+    output_csv_file=None,
+    fio_version=3,
+    bucket_groups=29,
+    bucket_bits=6,
+    pctiles_wanted=[0.0, 50.0, 95.0, 99.0, 100.0],
+    time_quantum=1,
+    log_hist_msec=None,
+    output_unit="usec",
+    output_csv_file_header=False,
+    workers=1,
+    by_direction=False,
+):
+    if fio_version == 2:
+        bucket_groups = 19
+    buckets_per_interval = (1 << bucket_bits) * bucket_groups
+    if time_quantum == 0:
+        raise FioHistoLogExc("time-quantum must be a positive number of seconds")
+    time_divisor = float(msec_per_sec) if output_unit == "msec" else 1.0
+    bucket_times = time_ranges(bucket_groups, 1 << bucket_bits, fio_version=fio_version)
+
+    hist_files = list(
+        ordered_map(
+            load_hist_file, [(fn, buckets_per_interval, log_hist_msec) for fn in file_list], workers=workers
+        )
+    )
+    # we consider the test started when all threads have started logging
+    # and over when one of the logs has ended
+    test_start_time = max([0] + [start for (_, _, _, start, _) in hist_files])
+    test_end_time = min([1.0e18] + [end for (_, _, _, _, end) in hist_files])
+    if test_start_time >= test_end_time:
+        raise FioHistoLogExc("no time interval when all threads logs overlapped")
+
+    # merge the threads by adding their aligned histograms
+    (_, time_interval_count) = get_time_intervals(time_quantum, test_start_time, test_end_time)
+    all_threads_histograms = 0.0
+    for (times, directions, buckets, _, _) in hist_files:
+        all_threads_histograms = all_threads_histograms + align_histo_array(
+            times,
+            directions,
+            buckets,
+            time_quantum,
+            test_start_time,
+            test_end_time,
+            by_direction=by_direction,
+        )
+
+    # like compute_percentiles_from_logs, the first time quantum is not reported
+    msec_since_start = np.arange(time_interval_count, dtype=np.int64) * time_quantum * msec_per_sec
+    histograms = all_threads_histograms[1:]
+    samples, pctiles = get_pctiles_array(
+        histograms.reshape(-1, buckets_per_interval), pctiles_wanted, bucket_times
+    )
+    samples = samples.reshape(histograms.shape[:-1])
+    pctiles = pctiles.reshape(histograms.shape[:-1] + (len(pctiles_wanted),)) / time_divisor
+    results = (msec_since_start[1:], samples, pctiles)
+    if output_csv_file is not None:
+        write_percentiles_csv(
+            output_csv_file, results, pctiles_wanted, output_csv_file_header, by_direction=by_direction
+        )
+    return results
+
+
+# write results of compute_percentiles_from_logs_numpy in the CSV format of compute_percentiles_from_logs
+
+
+def write_percentiles_csv(
+    output_csv_file, results, pctiles_wanted, output_csv_file_header=False, by_direction=False
+):
+    with open(output_csv_file, "w") as csv_out:
+        if output_csv_file_header:
+            csv_out.write(percentiles_csv_header(pctiles_wanted, by_direction) + "\n")
+        for row in zip(*results):
+            for record in percentiles_csv_records(*row):
+                csv_out.write(record + "\n")
+
+
+def percentiles_csv_header(pctiles_wanted, by_direction=False):
+    header = "msec-since-start, direction, samples" if by_direction else "msec-since-start, samples"
+    for p in pctiles_wanted:
+        if p == 0.0:
+            header += ", min"
+        elif p == 100.0:
+            header += ", max"
+        elif p == 50.0:
+            header += ", median"
+        else:
+            header += ", %3.1f" % p
+    return header
+
+
+# CSV records of a time quantum, one per direction if samples has a direction axis
+
+
+def percentiles_csv_records(t_msec, samples, pctiles):
+    if np.ndim(samples) == 0:
+        prefixes = ["%d, %d" % (t_msec, samples)]
+        pctiles = [pctiles]
+    else:
+        prefixes = ["%d, %d, %d" % (t_msec, direction, n) for (direction, n) in enumerate(samples)]
+    for record, values in zip(prefixes, pctiles):
+        if np.isnan(values).any():
+            yield record + ", " * len(values)
+        else:
+            yield record + ", " + ", ".join(str(float(value)) for value in values)
+
+
+# --------- streaming engine ------------
+# same results as compute_percentiles_from_logs_numpy, but the per-thread logs are read incrementally
+# and merged in timestamp order, and a time quantum is reported as soon as no thread can add to it
+# anymore, so memory depends on the number of threads and not on the duration of the test
+
+
+# find the start and end time of a histogram log like parse_hist_file without reading the whole file:
+# the start time comes from the first records and the end time from the last line of the file
+
+
+def hist_file_bounds(logfn, log_hist_msec, tail_bytes=1 << 20):
+    first_records = []
+    with open(logfn, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            (timestamp, direction) = (int(token) for token in line.split(b",", 2)[:2])
+            if not first_records or (timestamp, direction) != first_records[-1]:
+                first_records.append((timestamp, direction))
+            if len(first_records) == 2 or log_hist_msec is not None:
+                break
+        if not first_records:
+            raise FioHistoLogExc("no records in %s" % logfn)
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        offset = size
+        tail = b""
+        while offset > 0 and not tail.strip().count(b"\n"):
+            # read backwards until the last record is complete
+            offset = max(0, offset - tail_bytes)
+            f.seek(offset)
+            tail = f.read(size - offset)
+        last_record = tail.strip().rsplit(b"\n", 1)[-1]
+        end_timestamp = int(last_record.split(b",", 1)[0])
+
+    (first_timestamp, _) = first_records[0]
+    if first_timestamp < 1000000:
+        start_time = 0  # assume log_unix_epoch = 0
+    elif log_hist_msec is not None:
+        start_time = first_timestamp - log_hist_msec
+    elif len(first_records) > 1:
+        (second_timestamp, _) = first_records[1]
+        start_time = first_timestamp - (second_timestamp - first_timestamp)
+    else:
+        raise FioHistoLogExc("no way to estimate test start time")
+    return (start_time, end_timestamp)
+
+
+# yield the records of a histogram log as (time_ms, direction, buckets) tuples, chunk_lines at a time
+# records with the same timestamp and direction as the previous record are skipped like in parse_hist_file
+# invalid files raise the FioHistoLogExc of parse_hist_file
+
+
+def iter_hist_records(logfn, buckets_per_interval, chunk_lines=128):
+    columns = 3 + buckets_per_interval
+    last_time_ms = {direction_read: -1, direction_write: -1}
+    previous = (-1, -1)
+    with open(logfn) as f:
+        while True:
+            lines = list(islice(f, chunk_lines))
+            if not lines:
+                return
+            records = [line for line in (line.strip() for line in lines) if line]
+            if not records:
+                continue
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", DeprecationWarning)
+                values = np.fromstring(",".join(records), dtype=np.int64, sep=",")
+            if (
+                values.size != len(records) * columns
+                or any(record.count(",") != columns - 1 for record in records)
+                or (values < 0).any()
+            ):
+                parse_hist_file(logfn, buckets_per_interval, None)
+            values = values.reshape(len(records), columns)
+            directions = values[:, 1]
+            if ((directions != direction_read) & (directions != direction_write)).any() or (
+                values[:, 2] > (1 << 24)
+            ).any():
+                parse_hist_file(logfn, buckets_per_interval, None)
+            for time_ms, direction, record in zip(values[:, 0].tolist(), directions.tolist(), values):
+                if time_ms < last_time_ms[direction]:
+                    parse_hist_file(logfn, buckets_per_interval, None)
+                last_time_ms[direction] = time_ms
+                if (time_ms, direction) == previous:
+                    continue
+                previous = (time_ms, direction)
+                yield time_ms, direction, record[3:]
+
+
+def _tag_records(records, thread):
+    time_ms = None
+    for (time_ms, direction, buckets) in records:
+        yield time_ms, thread, direction, buckets
+    # end of the log, ordered after its last record
+    if time_ms is not None:
+        yield time_ms, thread, None, None
+
+
+# streaming version of compute_percentiles_from_logs_numpy
+# yields (msec_since_start, samples, pctiles) per time quantum after the first one, in time order
+# each row is yielded, and written to output_csv_file if set, as soon as its time quantum is complete
+# a record ends when the next record of the same direction in the same log starts, so a time quantum
+# is complete once the pending record of every thread and direction starts after it
+# records of a direction starting before an already complete time quantum are dropped, fio logs
+# both directions at the same times so this does not happen with fio logs
+# by_direction gives samples and pctiles a direction axis like in compute_percentiles_from_logs_numpy
+
+
+def stream_percentiles_from_logs(
+    file_list,
+    output_csv_file=None,
+    fio_version=3,
+    bucket_groups=29,
+    bucket_bits=6,
+    pctiles_wanted=[0.0, 50.0, 95.0, 99.0, 100.0],
+    time_quantum=1,
+    log_hist_msec=None,
+    output_unit="usec",
+    output_csv_file_header=False,
+    chunk_lines=128,
+    by_direction=False,
+):
+    if fio_version == 2:
+        bucket_groups = 19
+    buckets_per_interval = (1 << bucket_bits) * bucket_groups
+    if time_quantum == 0:
+        raise FioHistoLogExc("time-quantum must be a positive number of seconds")
+    time_divisor = float(msec_per_sec) if output_unit == "msec" else 1.0
+    bucket_times = np.asarray(time_ranges(bucket_groups, 1 << bucket_bits, fio_version=fio_version))
+
+    bounds = [hist_file_bounds(fn, log_hist_msec) for fn in file_list]
+    test_start_time = max([0] + [start for (start, _) in bounds])
+    test_end_time = min([1.0e18] + [end for (_, end) in bounds])
+    if test_start_time >= test_end_time:
+        raise FioHistoLogExc("no time interval when all threads logs overlapped")
+    (end_time, time_interval_count) = get_time_intervals(time_quantum, test_start_time, test_end_time)
+    end_time_ms = end_time * msec_per_sec
+    time_qtm_ms = time_quantum * msec_per_sec
+    histogram_shape = (2 if by_direction else 1, buckets_per_interval)
+
+    # time quantum index -> histograms per direction, only for the time quanta which are not complete yet
+    active = {}
+    # first time quantum which is not complete
+    next_qtm = 0
+
+    def add_record(start_ms, stop_ms, direction, buckets):
+        slot = direction if by_direction else 0
+        duration = stop_ms - start_ms
+        if duration <= 0:
+            return
+        qtm_index = max((start_ms - test_start_time) // time_qtm_ms, 0)
+        qtm_start = test_start_time + qtm_index * time_qtm_ms
+        while qtm_start < stop_ms and qtm_index < time_interval_count:
+            if qtm_index >= next_qtm:
+                overlap = min(qtm_start + time_qtm_ms, stop_ms) - max(qtm_start, start_ms)
+                histograms = active.get(qtm_index)
+                if histograms is None:
+                    histograms = active[qtm_index] = np.zeros(histogram_shape)
+                histograms[slot] += buckets * (overlap / duration)
+            qtm_index += 1
+            qtm_start += time_qtm_ms
+
+    csv_out = None
+    if output_csv_file is not None:
+        csv_out = open(output_csv_file, "w")
+        if output_csv_file_header:
+            csv_out.write(percentiles_csv_header(pctiles_wanted, by_direction) + "\n")
+
+    def complete_quanta(first_qtm, stop_qtm):
+        qtm_indexes = range(first_qtm, stop_qtm)
+        if not qtm_indexes:
+            return
+        histograms = np.array(
+            [active.pop(j) if j in active else np.zeros(histogram_shape) for j in qtm_indexes]
+        )
+        samples, pctiles = get_pctiles_array(
+            histograms.reshape(-1, buckets_per_interval), pctiles_wanted, bucket_times
+        )
+        samples = samples.reshape(len(qtm_indexes), -1)
+        pctiles = pctiles.reshape(len(qtm_indexes), -1, len(pctiles_wanted)) / time_divisor
+        if not by_direction:
+            samples, pctiles = samples[:, 0], pctiles[:, 0]
+        for j, n, p in zip(qtm_indexes, samples, pctiles):
+            # like compute_percentiles_from_logs, the first time quantum is not reported
+            if j == 0:
+                continue
+            row = (j * time_qtm_ms, n, p)
+            if csv_out is not None:
+                for record in percentiles_csv_records(*row):
+                    csv_out.write(record + "\n")
+            yield row
+
+    try:
+        # (thread, direction) -> (time_ms, buckets) of the last record, whose end is not known yet
+        pending = {}
+        records = heapq.merge(
+            *[
+                _tag_records(iter_hist_records(fn, buckets_per_interval, chunk_lines), thread)
+                for (thread, fn) in enumerate(file_list)
+            ],
+            key=lambda record: record[0]
+        )
+        for (time_ms, thread, direction, buckets) in records:
+            if direction is None:
+                # the last records of a log end with the last time quantum
+                for key in [key for key in pending if key[0] == thread]:
+                    (start_ms, last_buckets) = pending.pop(key)
+                    add_record(start_ms, end_time_ms, key[1], last_buckets)
+            else:
+                previous = pending.get((thread, direction))
+                if previous is not None:
+                    add_record(previous[0], time_ms, direction, previous[1])
+                pending[(thread, direction)] = (time_ms, buckets)
+                if (time_ms - test_start_time) // time_qtm_ms <= next_qtm:
+                    # still in the first time quantum which is not complete
+                    continue
+            watermark = min([time_ms] + [start_ms for (start_ms, _) in pending.values()])
+            complete_qtm = min((watermark - test_start_time) // time_qtm_ms, time_interval_count)
+            if complete_qtm > next_qtm:
+                yield from complete_quanta(next_qtm, complete_qtm)
+                next_qtm = complete_qtm
+        yield from complete_quanta(next_qtm, time_interval_count)
+    finally:
+        if csv_out is not None:
+            csv_out.close()
+
+
 # --------- below are unit tests ------------
 
 if unittest2_imported:
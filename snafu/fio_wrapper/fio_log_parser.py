@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Bulk loading of fio per-job logs (write_bw_log, write_iops_log, write_lat_log) into NumPy arrays.
+
+Each line of a fio log is ``time (msec), value, data direction, block size, offset``. Logs are read in
+chunks of lines which are parsed with a single NumPy call, so converting the values and computing the
+document dates is vectorized and memory stays bounded by the chunk size.
+"""
+import os
+import warnings
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+LOG_COLUMNS = 5
+TIME, VALUE, DIRECTION, BLOCK_SIZE, OFFSET = range(LOG_COLUMNS)
+SUMMARY_PERCENTILES = (50, 90, 95, 99)
+# log-linear buckets of the summary percentiles: values below 256 have their own bucket, larger values
+# share buckets of 128 per power of two, so percentiles are within 1/256 of the value
+_SUB_BUCKET_BITS = 7
+_SUB_BUCKETS = 1 << _SUB_BUCKET_BITS
+_BUCKETS = _SUB_BUCKETS * (64 - _SUB_BUCKET_BITS)
+
+
+def _parse_lines(lines: List[str]) -> np.ndarray:
+    text = "".join(lines).strip().replace("\n", ",")
+    with warnings.catch_warnings():
+        # malformed input is detected below from the number of parsed values
+        warnings.simplefilter("ignore", DeprecationWarning)
+        values = np.fromstring(text, dtype=np.int64, sep=",")
+    if values.size == LOG_COLUMNS * len(lines):
+        return values.reshape(-1, LOG_COLUMNS)
+    # blank lines or lines with another number of columns, only keep complete lines like before
+    rows = [line.split(", ") for line in lines]
+    return np.array(
+        [[int(value) for value in row] for row in rows if len(row) == LOG_COLUMNS], dtype=np.int64
+    ).reshape(-1, LOG_COLUMNS)
+
+
+def read_fio_log(log_file: Iterable[str], chunk_lines: int = 65536) -> Iterator[np.ndarray]:
+    """
+    Yield the lines of a fio log as int64 arrays of shape ``(lines, 5)``.
+
+    Parameters
+    ----------
+    log_file : iterable of str
+        Open fio log file.
+    chunk_lines : int, optional
+        Number of lines parsed at once.
+    """
+    log_file = iter(log_file)
+    while True:
+        lines = list(islice(log_file, chunk_lines))
+        if not lines:
+            return
+        columns = _parse_lines(lines)
+        if len(columns):
+            yield columns
+
+
+def fio_dates(timestamps_ms: np.ndarray) -> List[str]:
+    """Format epoch timestamps in msec like ``%Y-%m-%dT%H:%M:%S.%fZ``."""
+    dates = np.datetime_as_string(timestamps_ms.astype("datetime64[ms]"), unit="us")
+    return np.char.add(dates, "Z").tolist()
+
+
+def _bucket_index(values: np.ndarray) -> np.ndarray:
+    values = np.maximum(values, 0)
+    index = values.copy()
+    large = values >= _SUB_BUCKETS
+    if large.any():
+        large_values = values[large]
+        power = np.floor(np.log2(large_values.astype(float))).astype(np.int64)
+        # correct the float rounding of log2 next to powers of two
+        power -= (large_values >> power) == 0
+        power += (large_values >> (power + 1)) > 0
+        shift = power - _SUB_BUCKET_BITS
+        index[large] = shift * _SUB_BUCKETS + (large_values >> shift)
+    return index
+
+
+def _bucket_values() -> np.ndarray:
+    # middle of each bucket
+    index = np.arange(_BUCKETS, dtype=np.int64)
+    shift = np.maximum(index // _SUB_BUCKETS - 1, 0)
+    lower = np.where(index < 2 * _SUB_BUCKETS, index, (_SUB_BUCKETS + index % _SUB_BUCKETS) << shift)
+    return lower + ((1 << shift) - 1) / 2.0
+
+
+_BUCKET_VALUES = _bucket_values()
+
+
+class FioLogSummary:
+    """
+    Summarize the values of a fio log per data direction, in memory independent of the log length.
+
+    Count, mean, stddev, min and max are exact. Percentiles are interpolated between ranks like
+    np.percentile, from a histogram of about 7300 log-linear buckets (57KB) per data direction: they are
+    exact for values below 256 and within 1/256 of the value above.
+    """
+
+    def __init__(self):
+        self._counts: Dict[int, np.ndarray] = {}
+        # samples, mean and sum of squared differences to the mean, merged chunk by chunk
+        self._moments: Dict[int, Tuple[int, float, float]] = {}
+        self._min: Dict[int, int] = {}
+        self._max: Dict[int, int] = {}
+        self._first: Dict[int, int] = {}
+        self._last: Dict[int, int] = {}
+
+    def add(self, columns: np.ndarray, timestamps_ms: np.ndarray):
+        for direction in np.unique(columns[:, DIRECTION]).tolist():
+            selected = columns[:, DIRECTION] == direction
+            values = columns[selected, VALUE]
+            counts = np.bincount(_bucket_index(values), minlength=_BUCKETS)
+            if direction in self._counts:
+                self._counts[direction] += counts
+                self._min[direction] = min(self._min[direction], int(values.min()))
+                self._max[direction] = max(self._max[direction], int(values.max()))
+            else:
+                self._counts[direction] = counts
+                self._min[direction] = int(values.min())
+                self._max[direction] = int(values.max())
+            count, mean = values.size, float(values.mean())
+            m2 = float(((values - mean) ** 2).sum())
+            total, total_mean, total_m2 = self._moments.get(direction, (0, 0.0, 0.0))
+            delta = mean - total_mean
+            merged = total + count
+            self._moments[direction] = (
+                merged,
+                total_mean + delta * count / merged,
+                total_m2 + m2 + delta**2 * total * count / merged,
+            )
+            times = timestamps_ms[selected]
+            self._first.setdefault(direction, int(times[0]))
+            self._last[direction] = int(times[-1])
+
+    def _percentiles(self, counts: np.ndarray, samples: int) -> np.ndarray:
+        cumulative = np.cumsum(counts)
+        position = (samples - 1) * np.asarray(SUMMARY_PERCENTILES, dtype=float) / 100.0
+        low, high = np.floor(position), np.ceil(position)
+        low_values = _BUCKET_VALUES[np.searchsorted(cumulative, low, side="right")]
+        high_values = _BUCKET_VALUES[np.searchsorted(cumulative, high, side="right")]
+        return low_values + (high_values - low_values) * (position - low)
+
+    def summaries(self) -> Iterator[Dict]:
+        """Yield count, mean, stddev, min, max and percentiles of the values of each data direction."""
+        for direction in sorted(self._counts):
+            samples, mean, m2 = self._moments[direction]
+            summary = {
+                "data_direction": direction,
+                "samples": samples,
+                "mean": mean,
+                "stddev": float(np.sqrt(m2 / samples)),
+                "min": self._min[direction],
+                "max": self._max[direction],
+                "timestamp_start": self._first[direction],
+                "timestamp_end": self._last[direction],
+            }
+            percentiles = self._percentiles(self._counts[direction], samples)
+            for percentile, value in zip(SUMMARY_PERCENTILES, percentiles.tolist()):
+                summary["p%d" % percentile] = value
+            yield summary
+
+
+class FioLogWindows:
+    """
+    Roll the values of a fio log up into fixed time windows per data direction.
+
+    Chunks must be added in time order. The last window of a chunk may go on in the next chunk, so its
+    lines are held back until a later window starts or the log ends.
+
+    Parameters
+    ----------
+    window_ms : int
+        Length of the windows in msec, windows are aligned on multiples of it.
+    percentiles : tuple of float, optional
+        Percentiles of the values computed in every window.
+    """
+
+    def __init__(self, window_ms: int, percentiles: Tuple[float, ...] = SUMMARY_PERCENTILES):
+        self.window_ms = int(window_ms)
+        self.percentiles = tuple(percentiles)
+        self._pending: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+    def add(self, columns: np.ndarray, timestamps_ms: np.ndarray) -> List[Dict]:
+        """Add a chunk of a log and return the summaries of the windows completed by it."""
+        if self._pending is not None:
+            columns = np.concatenate([self._pending[0], columns])
+            timestamps_ms = np.concatenate([self._pending[1], timestamps_ms])
+        windows = timestamps_ms // self.window_ms
+        complete = windows < windows[-1]
+        self._pending = (columns[~complete], timestamps_ms[~complete])
+        return self._summarize(columns[complete], windows[complete])
+
+    def flush(self) -> List[Dict]:
+        """Return the summaries of the windows held back, at the end of the log."""
+        if self._pending is None:
+            return []
+        columns, timestamps_ms = self._pending
+        self._pending = None
+        return self._summarize(columns, timestamps_ms // self.window_ms)
+
+    def _summarize(self, columns: np.ndarray, windows: np.ndarray) -> List[Dict]:
+        if not len(columns):
+            return []
+        # sort values by window and direction, each group of lines is then a sorted slice
+        order = np.lexsort((columns[:, VALUE], columns[:, DIRECTION], windows))
+        values, directions, windows = columns[order, VALUE], columns[order, DIRECTION], windows[order]
+        new_group = np.ones(len(values), dtype=bool)
+        new_group[1:] = (windows[1:] != windows[:-1]) | (directions[1:] != directions[:-1])
+        starts = np.flatnonzero(new_group)
+        counts = np.diff(np.append(starts, len(values)))
+        fields = {
+            "timestamp": (windows[starts] * self.window_ms).tolist(),
+            "data_direction": directions[starts].tolist(),
+            "samples": counts.tolist(),
+            "mean": (np.add.reduceat(values, starts) / counts).tolist(),
+            "min": values[starts].tolist(),
+            "max": values[starts + counts - 1].tolist(),
+        }
+        for percentile in self.percentiles:
+            # linear interpolation between the closest ranks, like np.percentile
+            position = (counts - 1) * (percentile / 100.0)
+            low = np.floor(position).astype(np.int64)
+            high = np.ceil(position).astype(np.int64)
+            low_values, high_values = values[starts + low], values[starts + high]
+            fields["p%d" % percentile] = (low_values + (high_values - low_values) * (position - low)).tolist()
+        return [dict(zip(fields, group)) for group in zip(*fields.values())]
+
+
+def iter_fio_log(
+    log_file_name: str, start_ms: int, summary: Optional[FioLogSummary] = None, chunk_lines: int = 65536
+) -> Iterator[Tuple[np.ndarray, np.ndarray, List[str]]]:
+    """
+    Yield (columns, timestamps, dates) per chunk of a fio log, adding the chunks to a summary if given.
+
+    Parameters
+    ----------
+    log_file_name : str
+        Path of the fio log.
+    start_ms : int
+        Epoch time in msec at which fio started logging, fio log times are relative to it.
+    summary : FioLogSummary, optional
+        Summary to which every chunk is added.
+    chunk_lines : int, optional
+        Number of lines parsed at once.
+    """
+    with open(log_file_name) as log_file:
+        for columns in read_fio_log(log_file, chunk_lines):
+            timestamps = columns[:, TIME] + start_ms
+            if summary is not None:
+                summary.add(columns, timestamps)
+            yield columns, timestamps, fio_dates(timestamps)
+
+
+def log_chunk_ranges(log_file_name: str, chunk_bytes: int = 2 * 1024**2) -> List[Tuple[int, int]]:
+    """
+    Split a fio log in ``(start, end)`` byte ranges of about ``chunk_bytes``, each made of whole lines.
+
+    An empty log gives a single empty range.
+    """
+    ranges = []
+    with open(log_file_name, "rb") as log_file:
+        size = os.fstat(log_file.fileno()).st_size
+        start = 0
+        while start < size:
+            log_file.seek(min(start + chunk_bytes, size))
+            log_file.readline()
+            end = min(log_file.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return ranges or [(0, 0)]
+
+
+def parse_fio_log_range(
+    log_file_name: str, start_ms: int, start: int, end: int
+) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """
+    Parse the lines of a byte range of a fio log, returns (columns, timestamps, dates) like
+    :py:func:`iter_fio_log`. Used by worker processes, so the results sent back stay bounded by the size
+    of the range.
+    """
+    with open(log_file_name, "rb") as log_file:
+        log_file.seek(start)
+        lines = log_file.read(end - start).decode().splitlines(keepends=True)
+    columns = _parse_lines(lines) if lines else np.zeros((0, LOG_COLUMNS), dtype=np.int64)
+    timestamps = columns[:, TIME] + start_ms
+    return columns, timestamps, fio_dates(timestamps)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Parsing of fio JSON output in-process.
+
+fio may print warnings and client messages before its JSON output, and with ``--status-interval`` it
+prints a JSON status block at every interval followed by the final results. The JSON objects are
+pretty printed, each starting with a ``{`` line and ending with a ``}`` line, which is used to find the
+end of every block without trying to decode incomplete ones.
+"""
+import json
+import os
+import re
+import shutil
+from typing import IO, Any, Dict, Iterable, Iterator, Tuple
+
+_WHITESPACE = re.compile(r"\s*")
+
+
+def iter_json_blocks(lines: Iterable[str]) -> Iterator[Tuple[Dict[str, Any], str]]:
+    """
+    Yield ``(document, text)`` for every top level JSON object of fio output as soon as it is complete.
+
+    Lines outside of JSON objects are skipped.
+
+    >>> [document for document, _ in iter_json_blocks(["fio: warning\\n", "{\\n", '  "a" : 1\\n', "}\\n"])]
+    [{'a': 1}]
+    """
+    decoder = json.JSONDecoder()
+    block = []
+    for line in lines:
+        if not block and not line.startswith("{"):
+            continue
+        block.append(line)
+        stripped = line.rstrip()
+        if stripped == "}" or (len(block) == 1 and stripped.endswith("}")):
+            text = "".join(block)
+            try:
+                document, end = decoder.raw_decode(text)
+            except ValueError:
+                # closing brace of a nested object, the block goes on
+                continue
+            block = []
+            yield document, text[:end] + "\n"
+
+
+class _JsonStream:
+    """Buffer of a file from which JSON values are decoded one at a time."""
+
+    def __init__(self, fio_file: IO[str], chunk_size: int):
+        self._file = fio_file
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._position = 0
+
+    def _read(self) -> bool:
+        chunk = self._file.read(self._chunk_size)
+        if not chunk:
+            return False
+        position = self._position
+        self._buffer = self._buffer[position:] + chunk
+        self._position = 0
+        return True
+
+    def peek(self) -> str:
+        """Return the next character which is not whitespace, empty at the end of the file."""
+        while True:
+            self._position = _WHITESPACE.match(self._buffer, self._position).end()
+            if self._position < len(self._buffer) or not self._read():
+                position, end = self._position, self._position + 1
+                return self._buffer[position:end]
+
+    def expect(self, character: str):
+        if self.peek() != character:
+            position, end = self._position, self._position + 20
+            raise ValueError("expected %r at %r" % (character, self._buffer[position:end]))
+        self._position += 1
+
+    def value(self) -> Any:
+        """Decode the next JSON value, reading more of the file until it is complete."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._position)
+            except ValueError:
+                if not self._read():
+                    raise
+                continue
+            if end == len(self._buffer) and self._read():
+                # a number may go on in the next chunk
+                continue
+            self._position = end
+            return value
+
+
+def read_fio_result(fio_file: IO[str], chunk_size: int = 1 << 20) -> Tuple[Dict[str, Any], Iterator[Dict]]:
+    """
+    Read a fio JSON result file incrementally.
+
+    Return the top level members before ``client_stats``, such as ``fio version`` and ``timestamp``,
+    and an iterator decoding the ``client_stats`` entries one at a time, so memory does not depend on the
+    number of clients. Members after ``client_stats`` are not read.
+
+    >>> from io import StringIO
+    >>> headers, results = read_fio_result(StringIO('{"timestamp": 1, "client_stats": [{"a": 1}, {"a": 2}]}'))
+    >>> headers, list(results)
+    ({'timestamp': 1}, [{'a': 1}, {'a': 2}])
+
+    Parameters
+    ----------
+    fio_file : file
+        Open fio output file, starting with its JSON result.
+    chunk_size : int, optional
+        Number of characters read at once.
+    """
+    stream = _JsonStream(fio_file, chunk_size)
+    stream.expect("{")
+    headers: Dict[str, Any] = {}
+    while stream.peek() not in ("}", ""):
+        if headers:
+            stream.expect(",")
+        key = stream.value()
+        stream.expect(":")
+        if key == "client_stats":
+            return headers, _iter_array(stream)
+        headers[key] = stream.value()
+    return headers, iter(())
+
+
+def _iter_array(stream: _JsonStream) -> Iterator[Any]:
+    stream.expect("[")
+    first = True
+    while stream.peek() != "]":
+        if not first:
+            stream.expect(",")
+        first = False
+        yield stream.value()
+
+
+def clean_fio_output(fio_output_file: str):
+    """Remove the lines before the first line containing ``{`` from a fio output file, in place."""
+    cleaned_file = fio_output_file + ".tmp"
+    with open(fio_output_file) as output, open(cleaned_file, "w") as cleaned:
+        for line in output:
+            if "{" in line:
+                cleaned.write(line)
+                break
+        shutil.copyfileobj(output, cleaned)
+    os.replace(cleaned_file, fio_output_file)
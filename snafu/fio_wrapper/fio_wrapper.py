@@ -15,6 +15,7 @@ import argparse
 import configparser
 import logging
 import os
+from distutils.util import strtobool
 
 import requests
 
@@ -24,6 +25,17 @@ from .fio_analyzer import Fio_Analyzer
 logger = logging.getLogger("snafu")
 
 
+def _percentiles(value):
+    """Parse a comma separated list of percentiles, e.g. ``50,99,99.9,99.99``."""
+    try:
+        percentiles = [float(p) for p in value.split(",") if p.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid percentile list %r" % value)
+    if not percentiles or any(p < 0 or p > 100 for p in percentiles):
+        raise argparse.ArgumentTypeError("percentiles must be between 0 and 100, got %r" % value)
+    return sorted(set(percentiles))
+
+
 class fio_wrapper:
     def __init__(self, parent_parser):
         # collect arguments
@@ -43,7 +55,73 @@ class fio_wrapper:
             "-d", "--dir", help="output parent directory", default=os.path.dirname(os.getcwd())
         )
         parser.add_argument(
-            "-hp", "--histogramprocess", help="Process and index histogram results", default=False
+            "-hp",
+            "--histogramprocess",
+            type=strtobool,
+            help="Process and index histogram results (true/false)",
+            default=False,
+        )
+        parser.add_argument(
+            "-lp",
+            "--log-progress",
+            type=int,
+            default=0,
+            help="log progress every N documents read from each fio log file, 0 disables it",
+        )
+        parser.add_argument(
+            "--histogram-csv",
+            action="store_true",
+            help="also write the processed histogram percentiles to a CSV file in the job directory",
+        )
+        parser.add_argument(
+            "--histogram-percentiles",
+            type=_percentiles,
+            default="0,50,95,99,100",
+            help="comma separated percentiles of clat_hist and merged-latency documents",
+        )
+        parser.add_argument(
+            "--json-plus",
+            action="store_true",
+            help="run fio with json+ output and index exact latency percentiles merged across clients",
+        )
+        parser.add_argument(
+            "--status-interval",
+            type=int,
+            default=0,
+            help="index interim fio results every N seconds while jobs run, 0 disables it",
+        )
+        parser.add_argument(
+            "--log-window-ms",
+            type=int,
+            default=0,
+            help="roll fio log lines up into log-rollup documents per window of N msec, 0 disables it",
+        )
+        parser.add_argument(
+            "--raw-logs-archive-only",
+            action="store_true",
+            help="only write the documents of raw fio log lines to the archive, see --create-archive",
+        )
+        parser.add_argument(
+            "--stream-results",
+            action="store_true",
+            help="decode the results of fio clients one at a time, for large fio-result.json files",
+        )
+        parser.add_argument(
+            "--pipeline-jobs",
+            action="store_true",
+            help="run the next fio job while the logs and histograms of the previous one are processed",
+        )
+        parser.add_argument(
+            "--histogram-streaming",
+            action="store_true",
+            help="aggregate histogram logs as they are read, with memory bounded by the number of threads",
+        )
+        parser.add_argument(
+            "-w",
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="number of processes parsing fio log and histogram files, 1 parses them serially",
         )
         self.args = parser_object.parse_args()
 
@@ -81,16 +159,27 @@ class fio_wrapper:
                 else:
                     logger.error("Request to drop Ceph OSD cache failed")
             trigger_fio_generator = trigger_fio._trigger_fio(
-                self.fio_job_names,
-                self.args.cluster_name,
-                sample_dir,
-                self.fio_jobs_dict,
-                self.host_file_path,
-                self.user,
-                self.uuid,
-                i,
-                fio_analyzer_obj,
-                self.args.histogramprocess,
+                fio_jobs=self.fio_job_names,
+                cluster_name=self.args.cluster_name,
+                working_dir=sample_dir,
+                fio_jobs_dict=self.fio_jobs_dict,
+                host_file=self.host_file_path,
+                user=self.user,
+                uuid=self.uuid,
+                sample=i,
+                fio_analyzer_obj=fio_analyzer_obj,
+                process_histogram=self.args.histogramprocess,
+                log_progress=self.args.log_progress,
+                workers=self.args.workers,
+                histogram_csv=self.args.histogram_csv,
+                histogram_streaming=self.args.histogram_streaming,
+                histogram_percentiles=self.args.histogram_percentiles,
+                json_plus=self.args.json_plus,
+                status_interval=self.args.status_interval,
+                log_window_ms=self.args.log_window_ms,
+                raw_logs_archive_only=self.args.raw_logs_archive_only,
+                pipeline_jobs=self.args.pipeline_jobs,
+                stream_results=self.args.stream_results,
             )
             yield trigger_fio_generator
 
@@ -3,13 +3,49 @@ import json
 import logging
 import os
 import subprocess
+import threading
 from copy import deepcopy
 from datetime import datetime
-
-from .fio_hist_parser import compute_percentiles_from_logs
+from itertools import groupby
+from operator import itemgetter
+
+import numpy as np
+
+from snafu.utils.archive import ArchiveOnly
+from snafu.utils.envelope import Envelope, EnvelopeDocument
+from snafu.utils.parallel import ordered_map
+
+from .fio_clat_bins import ClatHistogram, pop_clat_histograms
+from .fio_hist_parser import compute_percentiles_from_logs_numpy, stream_percentiles_from_logs
+from .fio_log_parser import (
+    BLOCK_SIZE,
+    DIRECTION,
+    OFFSET,
+    VALUE,
+    FioLogSummary,
+    FioLogWindows,
+    fio_dates,
+    iter_fio_log,
+    log_chunk_ranges,
+    parse_fio_log_range,
+)
+from .fio_output import clean_fio_output, iter_json_blocks, read_fio_result
 
 logger = logging.getLogger("snafu")
 
+
+def _log_chunk_ranges(log_file_name):
+    try:
+        return log_chunk_ranges(log_file_name)
+    except OSError:
+        # the missing file is reported when its turn comes, by the worker failing to open it
+        return [(0, 0)]
+
+
+def _parse_log_range(position, log_file_name, start_ms, start, end):
+    return position, parse_fio_log_range(log_file_name, start_ms, start, end)
+
+
 _log_files = {
     "bw": {"metric": "bandwidth"},
     "iops": {"metric": "iops"},
@@ -20,6 +56,50 @@ _log_files = {
 _data_direction = {0: "read", 1: "write", 2: "trim"}
 
 
+def _percentile_field(percentile):
+    """Document field of a histogram percentile: min, median, max, p95, p99_9..."""
+    if percentile == 0.0:
+        return "min"
+    if percentile == 50.0:
+        return "median"
+    if percentile == 100.0:
+        return "max"
+    return "p" + ("%g" % percentile).replace(".", "_")
+
+
+def _tee(lines, output):
+    for line in lines:
+        output.write(line)
+        yield line
+
+
+class _FioRun:
+    """
+    fio process of a pipelined job, a thread records its end time as soon as it exits, while the
+    documents of the previous job may still be produced
+    """
+
+    def __init__(self, process):
+        self.process = process
+        self.endtime = None
+        self._waiter = threading.Thread(target=self._wait, name="snafu-fio-waiter", daemon=True)
+        self._waiter.start()
+
+    def _wait(self):
+        self.process.wait()
+        self.endtime = datetime.utcnow().strftime("%s")
+
+    def wait(self):
+        """Wait for fio to exit, returns its return code."""
+        self._waiter.join()
+        return self.process.returncode
+
+    def terminate(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+        self._waiter.join()
+
+
 class _trigger_fio:
     """
     Will execute fio with the provided arguments and return normalized results for indexing
@@ -38,6 +118,17 @@ class _trigger_fio:
         fio_analyzer_obj,
         numjob=1,
         process_histogram=False,
+        log_progress=0,
+        workers=1,
+        histogram_csv=False,
+        histogram_streaming=False,
+        histogram_percentiles=(0.0, 50.0, 95.0, 99.0, 100.0),
+        json_plus=False,
+        status_interval=0,
+        log_window_ms=0,
+        raw_logs_archive_only=False,
+        pipeline_jobs=False,
+        stream_results=False,
     ):
         self.fio_jobs = fio_jobs
         self.working_dir = working_dir
@@ -49,15 +140,38 @@ class _trigger_fio:
         self.fio_analyzer_obj = fio_analyzer_obj
         self.numjob = numjob
         self.histogram_process = process_histogram
+        # log a progress line every log_progress documents of each fio log file, 0 disables it
+        self.log_progress = log_progress
+        # number of processes parsing log and histogram files, 1 parses them in this process
+        self.workers = workers
+        # also write the processed histogram percentiles to a CSV file in the job directory
+        self.histogram_csv = histogram_csv
+        # aggregate histogram logs while reading them instead of loading them whole
+        self.histogram_streaming = histogram_streaming
+        # percentiles of each clat_hist and merged-latency document, computed separately per direction
+        self.histogram_percentiles = list(histogram_percentiles)
+        # run fio with json+ output and merge the completion latency bins of all clients
+        self.json_plus = json_plus
+        # run fio with --status-interval and index its status blocks as interim documents, 0 disables it
+        self.status_interval = status_interval
+        # roll fio log lines up into log-rollup documents per window of log_window_ms, 0 disables it
+        self.log_window_ms = log_window_ms
+        # write the documents of raw fio log lines to the archive only, without indexing them
+        self.raw_logs_archive_only = raw_logs_archive_only
+        # start the fio run of the next job while the documents of the previous one are produced
+        self.pipeline_jobs = pipeline_jobs
+        # decode the client_stats of fio results one at a time instead of loading the whole file
+        self.stream_results = stream_results
         self.cluster_name = cluster_name
         self.fio_version = ""
         self.hosts = ""
 
-    def _document_payload(self, data, end_time):  # pod_details,
-        processed = []
-        fio_starttime = {}
-        earliest_starttime = float("inf")
-        for result in data["client_stats"]:
+    def _document_payload(self, client_stats, end_time, fio_starttime):  # pod_details,
+        """
+        Yield (document, start time in ms) for each client_stats entry, the start time is None for the
+        All clients entries. The logging start time of each host is set in fio_starttime
+        """
+        for result in client_stats:
             document = {
                 "uuid": self.uuid,
                 "user": self.user,
@@ -71,7 +185,7 @@ class _trigger_fio:
             }
             if "global" in self.fio_jobs_dict.keys():
                 document["global_options"] = self.fio_jobs_dict["global"]
-            processed.append(document)
+            start_time = None
             if result["jobname"] != "All clients":
 
                 ramp_time = 0
@@ -91,14 +205,12 @@ class _trigger_fio:
                 # The only external method that uses fio_starttime is _log_payload,
                 # so we can set time to logging_start_time
                 fio_starttime[result["hostname"]] = logging_start_time
+            yield document, start_time
 
-                if start_time < earliest_starttime:
-                    earliest_starttime = start_time
-
-        return processed, fio_starttime, earliest_starttime
-
-    def _log_payload(self, directory, fio_starttime, job, fio_output_file):  # pod_details
-        logs = []
+    def _log_files(self, directory, job):
+        """
+        Return the (log, host, numjob, log file name) of every fio log file of the job
+        """
         _current_log_files = deepcopy(_log_files)
         job_options = self.fio_jobs_dict[job]
         if "gtod_reduce" in job_options:
@@ -119,6 +231,7 @@ class _trigger_fio:
         else:
             numjob_list = self.fio_jobs_dict["global"]["numjobs"]
 
+        log_files = []
         for log in _current_log_files.keys():
             for host in self.hosts:
                 for numjob in range(int(numjob_list)):
@@ -150,95 +263,287 @@ class _trigger_fio:
 
                         except:  # noqa
                             logger.info("Error setting log_file_name")
-                    log_file_name = os.path.join(directory, log_file_name)
-                    try:
-                        with open(log_file_name) as log_file:
-                            for log_line in log_file:
-                                log_line_values = str(log_line).split(", ")
-                                if len(log_line_values) == 5:
-                                    timestamp_ms = int(fio_starttime[host]) + int(log_line_values[0])
-                                    newtime = datetime.utcfromtimestamp(timestamp_ms / 1000.0)
-                                    log_dict = {
-                                        "uuid": self.uuid,
-                                        "user": self.user,
-                                        "host": host,
-                                        "cluster_name": self.cluster_name,
-                                        "job_number": numjob,
-                                        "fio-version": self.fio_version,
-                                        "job_options": job_options,
-                                        "job_name": str(job),
-                                        "log_file": log_file_name,
-                                        "sample": int(self.sample),
-                                        "log_name": str(log),
-                                        "timestamp": timestamp_ms,  # this is in ms
-                                        "date": newtime.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
-                                        str(_current_log_files[log]["metric"]): int(log_line_values[1]),
-                                        # "nodeName": pod_details["hostname"],
-                                        "data_direction": _data_direction[int(log_line_values[2])],
-                                        "block_size": int(log_line_values[3]),
-                                        "offset": int(log_line_values[4]),
-                                    }
-                                    if "global" in self.fio_jobs_dict.keys():
-                                        log_dict["global_options"] = self.fio_jobs_dict["global"]
-                                    logs.append(log_dict)
-                    except OSError:
-                        # In certain situations Fio return code is 0 even after a failed execution, so we have
-                        # to check the log file existence to verify this
-                        logger.error("Log file %s not found" % log_file_name)
-                        exit(1)
-        return logs
-
-    def _histogram_payload(
-        self, processed_histogram_file, longest_fio_startime, job, numjob=1
-    ):  # pod_details
-        logs = []
-        with open(processed_histogram_file) as log_file:
-            for log_line in log_file:
-                log_line_values = str(log_line).split(", ")
-                if len(log_line_values) == 7 and not (any(len(str(x)) <= 0 for x in log_line_values)):
-                    logger.debug(log_line_values)
-                    timestamp_ms = int(longest_fio_startime) + int(log_line_values[0])
-                    newtime = datetime.utcfromtimestamp(timestamp_ms / 1000.0)
-                    log_dict = {
-                        "uuid": self.uuid,
-                        "user": self.user,
-                        "hosts": self.hosts,
-                        "cluster_name": self.cluster_name,
-                        "fio-version": self.fio_version,
-                        "job_options": self.fio_jobs_dict[job],
-                        "job_name": str(job),
-                        "sample": int(self.sample),
-                        "log_name": "clat_hist",
-                        "timestamp": timestamp_ms,  # this is in ms
-                        "date": newtime.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
-                        "number_samples_histogram": int(log_line_values[1]),
-                        "min": float(log_line_values[2]),
-                        "median": float(log_line_values[3]),
-                        "p95": float(log_line_values[4]),
-                        "p99": float(log_line_values[5]),
-                        "max": float(log_line_values[6]),
+                    log_files.append((log, host, numjob, os.path.join(directory, log_file_name)))
+        return log_files
+
+    def _log_payload(self, directory, fio_starttime, job, fio_output_file):  # pod_details
+        """
+        Yield a (document, index) per line of the job's fio log files, reading the files as they are
+        consumed, followed by a log-summary document per log file and data direction.
+        With a log window, a log-rollup document summarizes the lines of each window and data direction,
+        and the documents of the lines are only archived if raw_logs_archive_only is set.
+        With more than one worker, the next chunks of the log files are parsed by worker processes while
+        the documents of the current one are yielded, in the same order as the serial mode. A bounded
+        number of chunks is pending, so memory does not depend on the size of the log files.
+        """
+        job_options = self.fio_jobs_dict[job]
+        log_files = self._log_files(directory, job)
+        raw_index = ArchiveOnly("log") if self.raw_logs_archive_only else "log"
+        if self.workers > 1:
+            parsed_chunks = groupby(
+                ordered_map(
+                    _parse_log_range,
+                    (
+                        (position, log_file_name, int(fio_starttime[host]), start, end)
+                        for position, (_, host, _, log_file_name) in enumerate(log_files)
+                        for start, end in _log_chunk_ranges(log_file_name)
+                    ),
+                    workers=self.workers,
+                ),
+                key=itemgetter(0),
+            )
+        else:
+            parsed_chunks = None
+
+        for log, host, numjob, log_file_name in log_files:
+            # metadata shared by every line of the log file, merged in when documents are serialized
+            envelope_fields = {
+                "uuid": self.uuid,
+                "user": self.user,
+                "host": host,
+                "cluster_name": self.cluster_name,
+                "job_number": numjob,
+                "fio-version": self.fio_version,
+                "job_options": job_options,
+                "job_name": str(job),
+                "log_file": log_file_name,
+                "sample": int(self.sample),
+                "log_name": str(log),
+            }
+            if "global" in self.fio_jobs_dict.keys():
+                envelope_fields["global_options"] = self.fio_jobs_dict["global"]
+            envelope = Envelope(envelope_fields)
+            metric = str(_log_files[log]["metric"])
+            windows = FioLogWindows(self.log_window_ms) if self.log_window_ms else None
+            documents = 0
+            summary = FioLogSummary()
+            try:
+                if parsed_chunks is not None:
+                    _, file_chunks = next(parsed_chunks)
+                    chunks = (chunk for _, chunk in file_chunks)
+                else:
+                    chunks = iter_fio_log(log_file_name, int(fio_starttime[host]))
+                # each chunk of lines was parsed at once, documents are built from the arrays
+                for columns, timestamps, dates in chunks:
+                    if not len(columns):
+                        continue
+                    summary.add(columns, timestamps)
+                    for timestamp_ms, date, value, direction, block_size, offset in zip(
+                        timestamps.tolist(),
+                        dates,
+                        columns[:, VALUE].tolist(),
+                        columns[:, DIRECTION].tolist(),
+                        columns[:, BLOCK_SIZE].tolist(),
+                        columns[:, OFFSET].tolist(),
+                    ):
+                        log_dict = {
+                            "timestamp": timestamp_ms,  # this is in ms
+                            "date": date,
+                            metric: value,
+                            # "nodeName": pod_details["hostname"],
+                            "data_direction": _data_direction[direction],
+                            "block_size": block_size,
+                            "offset": offset,
+                        }
+                        yield EnvelopeDocument(envelope, log_dict), raw_index
+                    if windows is not None:
+                        for window in windows.add(columns, timestamps):
+                            yield self._log_window_document(envelope, metric, window), "log-rollup"
+                    previous, documents = documents, documents + len(columns)
+                    if self.log_progress and documents // self.log_progress > previous // self.log_progress:
+                        logger.info("%s: %d documents" % (log_file_name, documents))
+            except OSError:
+                # In certain situations Fio return code is 0 even after a failed execution, so we have
+                # to check the log file existence to verify this
+                logger.error("Log file %s not found" % log_file_name)
+                exit(1)
+            if windows is not None:
+                for window in windows.flush():
+                    yield self._log_window_document(envelope, metric, window), "log-rollup"
+            if self.log_progress:
+                logger.info("%s: done, %d documents" % (log_file_name, documents))
+            # per direction summary of the log, computed from the same arrays
+            for log_summary in summary.summaries():
+                log_summary["metric"] = metric
+                log_summary["data_direction"] = _data_direction[log_summary["data_direction"]]
+                log_summary["date"] = fio_dates(np.array([log_summary["timestamp_start"]]))[0]
+                yield EnvelopeDocument(envelope, log_summary), "log-summary"
+
+    def _log_window_document(self, envelope, metric, window):
+        window["metric"] = metric
+        window["window_ms"] = self.log_window_ms
+        window["data_direction"] = _data_direction[window["data_direction"]]
+        window["date"] = fio_dates(np.array([window["timestamp"]]))[0]
+        return EnvelopeDocument(envelope, window)
+
+    def _histogram_payload(self, histogram_rows, longest_fio_startime, job, numjob=1):  # pod_details
+        """
+        Yield a clat_hist document per time quantum and data direction with I/O, from the rows of
+        _process_histogram
+        """
+        fields = [_percentile_field(p) for p in self.histogram_percentiles]
+        for msec_since_start, direction_samples, direction_pctiles in histogram_rows:
+            timestamp_ms = int(msec_since_start) + int(longest_fio_startime)
+            date = None
+            for direction, (number_samples, pctiles) in enumerate(zip(direction_samples, direction_pctiles)):
+                if np.isnan(pctiles).any():
+                    # no I/O was done in this direction during this time quantum
+                    continue
+                if date is None:
+                    date = fio_dates(np.array([timestamp_ms]))[0]
+                log_dict = {
+                    "uuid": self.uuid,
+                    "user": self.user,
+                    "hosts": self.hosts,
+                    "cluster_name": self.cluster_name,
+                    "fio-version": self.fio_version,
+                    "job_options": self.fio_jobs_dict[job],
+                    "job_name": str(job),
+                    "sample": int(self.sample),
+                    "log_name": "clat_hist",
+                    "timestamp": timestamp_ms,  # this is in ms
+                    "date": date,
+                    "data_direction": _data_direction[direction],
+                    "number_samples_histogram": int(number_samples),
+                }
+                log_dict.update(zip(fields, pctiles.tolist()))
+                if "global" in self.fio_jobs_dict.keys():
+                    log_dict["global_options"] = self.fio_jobs_dict["global"]
+                yield log_dict
+
+    def _merged_latency_payload(self, clat_histograms, end_time, job):
+        """
+        Yield a merged-latency document per fio job and data direction, and one per data direction
+        for all the fio jobs, with exact percentiles of the latency bins merged across clients
+        """
+        fields = [_percentile_field(p) for p in self.histogram_percentiles]
+        all_jobs = {}
+        for (_, direction), histogram in clat_histograms.items():
+            all_jobs.setdefault(("All jobs", direction), ClatHistogram()).update(histogram)
+        for (fio_jobname, direction), histogram in list(clat_histograms.items()) + list(all_jobs.items()):
+            document = {
+                "uuid": self.uuid,
+                "user": self.user,
+                "cluster_name": self.cluster_name,
+                "hosts": self.hosts,
+                "fio-version": self.fio_version,
+                "timestamp_end": int(end_time) * 1000,  # this is in ms
+                "sample": int(self.sample),
+                "job_name": str(job),
+                "fio_jobname": fio_jobname,
+                "data_direction": direction,
+                "clients": histogram.sources,
+                "samples": histogram.samples,
+                "unit": "ns",
+                "mean": histogram.mean(),
+            }
+            document.update(zip(fields, histogram.percentiles(self.histogram_percentiles).tolist()))
+            if "global" in self.fio_jobs_dict.keys():
+                document["global_options"] = self.fio_jobs_dict["global"]
+            yield document
+
+    def _interim_payload(self, data, job):
+        """
+        Yield an interim document per client job of a fio status block, while the job is running
+        """
+        timestamp_ms = int(data.get("timestamp_ms", int(data["timestamp"]) * 1000))
+        date = fio_dates(np.array([timestamp_ms]))[0]
+        for result in data.get("client_stats", []):
+            if result.get("jobname") == "All clients":
+                continue
+            document = {
+                "uuid": self.uuid,
+                "user": self.user,
+                "cluster_name": self.cluster_name,
+                "fio-version": data.get("fio version", self.fio_version),
+                "sample": int(self.sample),
+                "job_name": str(job),
+                "jobname": result.get("jobname"),
+                "hostname": result.get("hostname"),
+                "timestamp": timestamp_ms,  # this is in ms
+                "date": date,
+                "elapsed": result.get("elapsed"),
+            }
+            for direction in ("read", "write", "trim"):
+                if direction in result:
+                    stats = result[direction]
+                    document[direction] = {
+                        "bw": stats.get("bw"),
+                        "iops": stats.get("iops"),
+                        "total_ios": stats.get("total_ios"),
+                        "lat_ns_mean": stats.get("lat_ns", {}).get("mean"),
+                        "clat_ns_mean": stats.get("clat_ns", {}).get("mean"),
                     }
-                    if "global" in self.fio_jobs_dict.keys():
-                        log_dict["global_options"] = self.fio_jobs_dict["global"]
-                    logs.append(log_dict)
-        return logs
+            yield document
 
     def _clean_output(self, fio_output_file):
-        cmd = ["sed", "-i", "/{/,$!d", fio_output_file]
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = process.communicate()
-        return stdout.strip(), stderr, process.returncode
-
-    def _run_fiod(self, fiojob_file, output_dir, fio_output_file):
+        # drop what fio printed before its JSON output
+        try:
+            clean_fio_output(fio_output_file)
+        except OSError as err:
+            return "", str(err), 1
+        return "", "", 0
+
+    def _fiod_command(self, fiojob_file, fio_output_file):
         cmd = ["fio", "--client=", "path_file", "--output-format=json", "--output="]
+        if self.json_plus:
+            cmd[3] = "--output-format=json+"
         cmd[1] = "--client=" + self.host_file
         cmd[2] = fiojob_file
         cmd[4] = "--output=" + fio_output_file
+        return cmd
+
+    def _run_fiod(self, fiojob_file, output_dir, fio_output_file):
+        cmd = self._fiod_command(fiojob_file, fio_output_file)
         logger.info("Executing %s" % " ".join(map(str, cmd)))
         process = subprocess.Popen(cmd, stdout=subprocess.PIPE, cwd=output_dir)
         stdout, stderr = process.communicate()
         return stdout.strip(), stderr, process.returncode
 
+    def _start_fiod(self, fiojob_file, output_dir, fio_output_file):
+        # fio runs while nothing reads its stdout, so it goes to a file instead of a pipe
+        cmd = self._fiod_command(fiojob_file, fio_output_file)
+        logger.info("Executing %s" % " ".join(map(str, cmd)))
+        with open(os.path.join(output_dir, "fio-stdout.log"), "w") as stdout:
+            return subprocess.Popen(cmd, stdout=stdout, cwd=output_dir)
+
+    def _run_fiod_status(self, fiojob_file, output_dir, fio_output_file, job):
+        """
+        Run fio with --status-interval, yielding interim documents from its status blocks as they are
+        printed. The last block is the final result, it is written to fio_output_file. fio is terminated
+        if the documents are not consumed to the end.
+        """
+        output_format = "--output-format=json+" if self.json_plus else "--output-format=json"
+        cmd = [
+            "fio",
+            "--client=" + self.host_file,
+            fiojob_file,
+            output_format,
+            "--status-interval=%d" % self.status_interval,
+        ]
+        logger.info("Executing %s" % " ".join(map(str, cmd)))
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, cwd=output_dir, universal_newlines=True)
+        final = None
+        try:
+            # everything fio prints is kept in the output file until the final result is known
+            with open(fio_output_file, "w") as output:
+                for data, text in iter_json_blocks(_tee(process.stdout, output)):
+                    if final is not None:
+                        for document in self._interim_payload(final[0], job):
+                            yield document, "interim"
+                    final = (data, text)
+            process.wait()
+        finally:
+            if process.poll() is None:
+                logger.warning("Terminating fio")
+                process.terminate()
+                process.wait()
+            process.stdout.close()
+        if process.returncode == 0 and final is not None:
+            with open(fio_output_file, "w") as output:
+                output.write(final[1])
+        return "", None, process.returncode
+
     def _process_histogram(
         self, job, working_dir, processed_histogram_prefix, histogram_output_file, numjob=1
     ):
@@ -260,11 +565,26 @@ class _trigger_fio:
                 _log_hist_msec = self.fio_jobs_dict["global"]["log_hist_msec"]
         else:
             _log_hist_msec = self.fio_jobs_dict[job]["log_hist_msec"]
-        compute_percentiles_from_logs(
-            output_csv_file=histogram_output_file,
+        # the processed CSV file is only written on request
+        output_csv_file = histogram_output_file if self.histogram_csv else None
+        if self.histogram_streaming:
+            # rows are yielded as the logs are read, memory does not grow with the test duration
+            return stream_percentiles_from_logs(
+                file_list=histogram_input_file_list,
+                output_csv_file=output_csv_file,
+                pctiles_wanted=self.histogram_percentiles,
+                log_hist_msec=int(_log_hist_msec),
+                by_direction=True,
+            )
+        results = compute_percentiles_from_logs_numpy(
             file_list=histogram_input_file_list,
-            log_hist_msec=_log_hist_msec,
+            output_csv_file=output_csv_file,
+            pctiles_wanted=self.histogram_percentiles,
+            log_hist_msec=int(_log_hist_msec),
+            workers=min(self.workers, len(histogram_input_file_list)),
+            by_direction=True,
         )
+        return zip(*results)
 
     def _build_fio_job(self, job_name, parent_dir, fio_job_file_name):
         config = configparser.ConfigParser()
@@ -286,102 +606,162 @@ class _trigger_fio:
         with open(self.host_file) as f:
             self.hosts = f.read().splitlines()
 
-        # execute for each job in the user specified job file
-        for job in self.fio_jobs:
-
-            job_dir = os.path.join(self.working_dir, job)
-            os.makedirs(job_dir, exist_ok=True)
-            fio_output_file = os.path.join(job_dir, "fio-result.json")
-            fio_job_file = os.path.join(job_dir, "fiojob")
-            self._build_fio_job(job, job_dir, fio_job_file)
-
-            # capture sample start time, used for prom data collection
-            sample_starttime = datetime.utcnow().strftime("%s")
-            stdout, stderr, rc = self._run_fiod(fio_job_file, job_dir, fio_output_file)
-
-            if rc != 0:
-                logger.error("Fio failed to execute")
-                with open(fio_output_file) as output:
-                    logger.error("Output file: %s" % output.read())
-                    exit(1)
-            stdout, stderr, rc = self._clean_output(fio_output_file)
-            if rc != 0:
-                logger.error("failed to parse the output file")
+        pipelined = self.pipeline_jobs and not self.status_interval
+        if self.pipeline_jobs and self.status_interval:
+            logger.warning("Jobs are not pipelined when interim results are collected")
+        if not pipelined:
+            # execute for each job in the user specified job file
+            for job in self.fio_jobs:
+                job_dir, fio_output_file, fio_job_file = self._prepare_job(job)
+
+                # capture sample start time, used for prom data collection
+                sample_starttime = datetime.utcnow().strftime("%s")
+                if self.status_interval:
+                    stdout, stderr, rc = yield from self._run_fiod_status(
+                        fio_job_file, job_dir, fio_output_file, job
+                    )
+                else:
+                    stdout, stderr, rc = self._run_fiod(fio_job_file, job_dir, fio_output_file)
+                # capture sample end time, used for prom data collection
+                sample_endtime = datetime.utcnow().strftime("%s")
+                yield from self._job_documents(
+                    job, job_dir, fio_output_file, rc, sample_starttime, sample_endtime
+                )
+            return
+
+        # the fio run of the next job starts as soon as the previous one has finished, and the documents
+        # of the previous job are produced while it runs
+        jobs = iter(self.fio_jobs)
+        running = self._start_job(next(jobs, None))
+        try:
+            while running is not None:
+                job, job_dir, fio_output_file, sample_starttime, fio_run = running
+                rc = fio_run.wait()
+                # the time fio exited, not the time the documents of the previous job were consumed
+                sample_endtime = fio_run.endtime
+                running = self._start_job(next(jobs, None)) if rc == 0 else None
+                yield from self._job_documents(
+                    job, job_dir, fio_output_file, rc, sample_starttime, sample_endtime
+                )
+        finally:
+            if running is not None and running[4].process.poll() is None:
+                logger.warning("Terminating fio of job %s" % running[0])
+                running[4].terminate()
+
+    def _prepare_job(self, job):
+        job_dir = os.path.join(self.working_dir, job)
+        os.makedirs(job_dir, exist_ok=True)
+        fio_output_file = os.path.join(job_dir, "fio-result.json")
+        fio_job_file = os.path.join(job_dir, "fiojob")
+        self._build_fio_job(job, job_dir, fio_job_file)
+        return job_dir, fio_output_file, fio_job_file
+
+    def _start_job(self, job):
+        """
+        Start the fio run of a job without waiting for it, returns
+        (job, job_dir, fio_output_file, sample_starttime, fio_run) or None without a job
+        """
+        if job is None:
+            return None
+        job_dir, fio_output_file, fio_job_file = self._prepare_job(job)
+        sample_starttime = datetime.utcnow().strftime("%s")
+        fio_run = _FioRun(self._start_fiod(fio_job_file, job_dir, fio_output_file))
+        return job, job_dir, fio_output_file, sample_starttime, fio_run
+
+    def _job_documents(self, job, job_dir, fio_output_file, rc, sample_starttime, sample_endtime):
+        """
+        Parse the results, logs and histograms of a finished fio run and yield its documents
+        """
+        if rc != 0:
+            logger.error("Fio failed to execute")
+            with open(fio_output_file) as output:
+                logger.error("Output file: %s" % output.read())
                 exit(1)
-            logger.info(
-                "fio has successfully finished sample {} executing for jobname {} and results "
-                "are in the dir {}\n".format(self.sample, job, job_dir)
-            )
+        stdout, stderr, rc = self._clean_output(fio_output_file)
+        if rc != 0:
+            logger.error("failed to parse the output file")
+            exit(1)
+        logger.info(
+            "fio has successfully finished sample {} executing for jobname {} and results "
+            "are in the dir {}\n".format(self.sample, job, job_dir)
+        )
 
-            # capture sample end time, used for prom data collection
-            sample_endtime = datetime.utcnow().strftime("%s")
-            with open(fio_output_file) as f:
+        fio_starttime = {}
+        earliest_starttime = float("inf")
+        clat_histograms = {}
+        with open(fio_output_file) as f:
+            if self.stream_results:
+                # the headers are read first, then the client_stats entries are decoded one at a time
+                data, client_stats = read_fio_result(f)
+            else:
                 data = json.load(f)
+                client_stats = data["client_stats"]
             fio_endtime = int(data["timestamp"])  # in epoch seconds
             self.fio_version = data["fio version"]
 
-            # parse fio json file, return list of normalized documents and structured start times
-            fio_result_documents, fio_starttime, earliest_starttime = self._document_payload(
-                data, fio_endtime
-            )
-
-            # Add fio result document to fio analyzer object
-            self.fio_analyzer_obj.add_fio_result_documents(fio_result_documents, earliest_starttime)
-
-            # from the returned normalized fio json document yield up for indexing
+            # normalize each fio result, structured start times are set in fio_starttime
             index = "results"
-            for document in fio_result_documents:
+            for document, start_time in self._document_payload(client_stats, fio_endtime, fio_starttime):
+                if self.json_plus:
+                    # json+ latency bins are merged here, results documents are indexed without them
+                    pop_clat_histograms([document["fio"]], histograms=clat_histograms)
+                if start_time is not None:
+                    earliest_starttime = min(earliest_starttime, start_time)
+                    # Add fio result document to fio analyzer object
+                    self.fio_analyzer_obj.add_fio_result_documents([document], start_time)
                 yield document, index
-
-            # check to determine if logs can be parsed, if not fail
+        clat_histograms = {key: histogram for key, histogram in clat_histograms.items() if histogram.samples}
+        for document in self._merged_latency_payload(clat_histograms, fio_endtime, job):
+            yield document, "merged-latency"
+
+        # check to determine if logs can be parsed, if not fail
+        try:
+            if self.fio_jobs_dict[job]["filename_format"] != r"f.\$jobnum.\$filenum":  # noqa
+                logger.error(r"filename_format is not 'f.\$jobnum.\$filenum'")  # noqa
+                exit(1)
+        except KeyError:
             try:
-                if self.fio_jobs_dict[job]["filename_format"] != r"f.\$jobnum.\$filenum":  # noqa
+                if self.fio_jobs_dict["global"]["filename_format"] != r"f.\$jobnum.\$filenum":  # noqa
                     logger.error(r"filename_format is not 'f.\$jobnum.\$filenum'")  # noqa
                     exit(1)
-            except KeyError:
-                try:
-                    if self.fio_jobs_dict["global"]["filename_format"] != r"f.\$jobnum.\$filenum":  # noqa
-                        logger.error(r"filename_format is not 'f.\$jobnum.\$filenum'")  # noqa
-                        exit(1)
-                except:  # noqa
-                    logger.error("Error getting filename_format")
+            except:  # noqa
+                logger.error("Error getting filename_format")
 
-            # parse all fio log files, return list of normalized log documents
-            fio_log_documents = self._log_payload(job_dir, fio_starttime, job, fio_output_file)
+        # parse all fio log files, documents are yielded as the files are read
+        fio_log_documents = self._log_payload(job_dir, fio_starttime, job, fio_output_file)
 
+        # if indexing is turned on yield back normalized data
+        for document, index in fio_log_documents:
+            yield document, index
+        if self.histogram_process:
+            try:
+                processed_histogram_prefix = self.fio_jobs_dict[job]["write_hist_log"] + "_clat_hist"
+            except KeyError:
+                try:
+                    processed_histogram_prefix = self.fio_jobs_dict["global"]["write_hist_log"] + "_clat_hist"
+                except Exception as err:  # noqa
+                    logger.error("Error setting processed_histogram_prefix %s" % err)
+            histogram_output_file = (
+                job_dir + "/" + processed_histogram_prefix + "_processed." + str(self.numjob)
+            )
+            histogram_rows = self._process_histogram(
+                job, job_dir, processed_histogram_prefix, histogram_output_file
+            )
+            histogram_documents = self._histogram_payload(histogram_rows, earliest_starttime, job)
             # if indexing is turned on yield back normalized data
-            index = "log"
-            for document in fio_log_documents:
+            index = "hist-log"
+            for document in histogram_documents:
                 yield document, index
-            if self.histogram_process:
-                try:
-                    processed_histogram_prefix = self.fio_jobs_dict[job]["write_hist_log"] + "_clat_hist"
-                except KeyError:
-                    try:
-                        processed_histogram_prefix = (
-                            self.fio_jobs_dict["global"]["write_hist_log"] + "_clat_hist"
-                        )
-                    except Exception as err:  # noqa
-                        logger.error("Error setting processed_histogram_prefix %s" % err)
-                histogram_output_file = (
-                    job_dir + "/" + processed_histogram_prefix + "_processed." + str(self.numjob)
-                )
-                self._process_histogram(job, job_dir, processed_histogram_prefix, histogram_output_file)
-                histogram_documents = self._histogram_payload(histogram_output_file, earliest_starttime, job)
-                # if indexing is turned on yield back normalized data
-                index = "hist-log"
-                for document in histogram_documents:
-                    yield document, index
-            # trigger collection of prom data
-            sample_info_dict = {
-                "uuid": self.uuid,
-                "user": self.user,
-                "cluster_name": self.cluster_name,
-                "starttime": sample_starttime,
-                "endtime": sample_endtime,
-                "sample": self.sample,
-                "tool": "fio",
-                "test_config": self.fio_jobs_dict,
-            }
-
-            yield sample_info_dict, "get_prometheus_trigger"
+        # trigger collection of prom data
+        sample_info_dict = {
+            "uuid": self.uuid,
+            "user": self.user,
+            "cluster_name": self.cluster_name,
+            "starttime": sample_starttime,
+            "endtime": sample_endtime,
+            "sample": self.sample,
+            "tool": "fio",
+            "test_config": self.fio_jobs_dict,
+        }
+
+        yield sample_info_dict, "get_prometheus_trigger"
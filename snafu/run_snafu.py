@@ -12,28 +12,43 @@
 #   limitations under the License.
 
 import datetime
-import hashlib
 import json
 import logging
+import multiprocessing
 
 # This wrapper assumes the following in fiojob
 # per_job_logs=true
 #
 import os
-import ssl
 import sys
 import time
 from distutils.util import strtobool
 
 import configargparse
-import elasticsearch
-import urllib3
 
 from snafu import benchmarks
+from snafu.utils.archive import (
+    ARCHIVE_FORMATS,
+    FSYNC_POLICIES,
+    ArchiveOnly,
+    BackgroundArchiveWriter,
+    detect_archive_format,
+    iter_archive,
+    open_archive_writer,
+    read_archive_index,
+    read_frame,
+)
+from snafu.utils.bulk_controller import AdaptiveBulkController
 from snafu.utils.common_logging import setup_loggers
+from snafu.utils.envelope import json_default
+from snafu.utils.es_clients import close_es_clients, create_es_client, get_es_client
+from snafu.utils.fingerprint import fingerprint
 from snafu.utils.get_prometheus_data import get_prometheus_data
+from snafu.utils.index_pipeline import IndexingPipeline
+from snafu.utils.prom_cache import PromQueryCache
 from snafu.utils.py_es_bulk import streaming_bulk
 from snafu.utils.request_cache_drop import drop_cache
+from snafu.utils.spool import Spool
 from snafu.utils.wrapper_factory import wrapper_factory
 
 logger = logging.getLogger("snafu")
@@ -76,9 +91,97 @@ def main():
         default=False,
         help="enables creation of archive file",
     )
+    parser.add_argument(
+        "--archive-format",
+        dest="archive_format",
+        choices=ARCHIVE_FORMATS,
+        default="ndjson",
+        help="format of created archive files, one JSON document per line (default) or chunked compressed "
+        "frames with an index, which --tool archive can index in parallel",
+    )
+    parser.add_argument(
+        "--archive-flush-interval",
+        dest="archive_flush_interval",
+        type=float,
+        default=1.0,
+        help="seconds between flushes of created archive files",
+    )
+    parser.add_argument(
+        "--archive-fsync",
+        dest="archive_fsync",
+        choices=FSYNC_POLICIES,
+        default="none",
+        help="fsync created archive files never, at every flush interval or after every batch of documents",
+    )
+    parser.add_argument(
+        "--archive-workers",
+        dest="archive_workers",
+        type=int,
+        default=os.cpu_count(),
+        help="number of processes decoding and indexing the frames of a chunked archive with --tool archive",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_const",
+        dest="pipeline",
+        const=True,
+        default=False,
+        help="index results from a separate thread so that slow indexing never stalls the benchmark",
+    )
+    parser.add_argument(
+        "--pipeline-queue-depth",
+        dest="pipeline_queue_depth",
+        type=int,
+        default=10000,
+        help="number of documents held in memory by --pipeline before spilling to disk",
+    )
+    parser.add_argument(
+        "--pipeline-spill-dir",
+        dest="pipeline_spill_dir",
+        default=None,
+        help="directory used by --pipeline to spill documents, defaults to the system temp directory",
+    )
+    parser.add_argument(
+        "--spool-dir",
+        dest="spool_dir",
+        default=None,
+        help="record every document in this write-ahead spool until Elasticsearch acknowledges it, "
+        "use with --tool spool-replay to resend uncommitted documents",
+    )
+    parser.add_argument(
+        "--spool-max-bytes",
+        dest="spool_max_bytes",
+        type=int,
+        default=2 * 1024**3,
+        help="disk budget of the spool directory",
+    )
+    parser.add_argument(
+        "--prom-cache-dir",
+        dest="prom_cache_dir",
+        default=None,
+        help="cache the results of prometheus queries in this directory, a sample window processed "
+        "again is then not queried",
+    )
+    parser.add_argument(
+        "--prom-cache-max-bytes",
+        dest="prom_cache_max_bytes",
+        type=int,
+        default=1024**3,
+        help="disk budget of the prometheus cache directory",
+    )
+    parser.add_argument(
+        "--prom-cache-package",
+        action="store_const",
+        dest="prom_cache_package",
+        const=True,
+        default=False,
+        help="copy the cached prometheus results used by the run next to each archive file, "
+        "as <archive>.prom-cache",
+    )
     index_args, unknown = parser.parse_known_args()
     index_args.index_results = False
     index_args.prefix = "snafu-%s" % index_args.tool
+    index_args.archive_writers = {}
 
     setup_loggers("snafu", index_args.loglevel)
     log_level_str = "DEBUG" if index_args.loglevel == logging.DEBUG else "INFO"
@@ -105,82 +208,147 @@ def main():
         try:
             if es_settings["verify_cert"] == "false":
                 logger.info("Turning off TLS certificate verification")
-                urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-                ssl_ctx = ssl.create_default_context()
-                ssl_ctx.check_hostname = False
-                ssl_ctx.verify_mode = ssl.CERT_NONE
-                es = elasticsearch.Elasticsearch(
-                    [es_settings["server"]], send_get_body_as="POST", ssl_context=ssl_ctx, use_ssl=False
-                )
-            else:
-                es = elasticsearch.Elasticsearch([es_settings["server"]], send_get_body_as="POST")
-            logger.info("Connected to the elasticsearch cluster with info as follows:")
-            logger.info(json.dumps(es.info(), indent=4))
+            es = get_es_client(es_settings)
         except Exception as e:
             error_msg = "Elasticsearch connection caused an exception: %s" % e
 
-            # Error out if user is only indexing an archive file
-            if "archive" in index_args.tool:
+            # Error out if user is only indexing an archive file or replaying a spool
+            if "archive" in index_args.tool or index_args.tool == "spool-replay":
                 logger.error(error_msg)
                 exit(1)
             else:
                 logger.warn(error_msg)
                 index_args.index_results = False
 
-    index_args.document_size_capacity_bytes = 0
-    # call py es bulk using a process generator to feed it ES documents
-    if index_args.index_results:
-        parallel_setting = strtobool(os.environ.get("parallel", "false"))
-
-        if "archive" in index_args.tool:
-            if index_args.archive_file:
-                #  if processing a archive file use the process archive file function
+    index_args.prom_cache = None
+    if index_args.prom_cache_dir:
+        index_args.prom_cache = PromQueryCache(index_args.prom_cache_dir, index_args.prom_cache_max_bytes)
+        logger.info("Caching prometheus results in %s" % index_args.prom_cache_dir)
+
+    spool = None
+    if index_args.spool_dir:
+        spool = Spool(index_args.spool_dir, max_bytes=index_args.spool_max_bytes)
+        logger.info("Spooling documents to %s" % index_args.spool_dir)
+    elif index_args.tool == "spool-replay":
+        logger.error("Attempted to replay a spool without specifying it, use --spool-dir=<dir>")
+        exit(1)
 
-                try:
-                    res_beg, res_end, res_suc, res_dup, res_fail, res_retry = streaming_bulk(
-                        es, process_archive_file(index_args), parallel_setting
+    index_args.document_size_capacity_bytes = 0
+    # archives are closed even when the benchmark fails or exits, so their queued documents, pending
+    # frame and footer are written
+    try:
+        # call py es bulk using a process generator to feed it ES documents
+        if index_args.index_results:
+            bulk_settings = get_bulk_settings()
+            bulk_settings["spool"] = spool
+
+            if index_args.tool == "spool-replay":
+                # resend uncommitted documents, in parallel unless another engine was requested
+                if not bulk_settings["engine"]:
+                    bulk_settings["parallel"] = True
+                res_beg, res_end, res_suc, res_dup, res_fail, res_retry = streaming_bulk(
+                    es, spool.uncommitted(), **bulk_settings
+                )
+            elif "archive" in index_args.tool:
+                if index_args.archive_file:
+                    #  if processing a archive file use the process archive file function
+
+                    try:
+                        res_beg, res_end, res_suc, res_dup, res_fail, res_retry = index_archive_file(
+                            es, es_settings, index_args, bulk_settings
+                        )
+                    except Exception as e:
+                        logger.error("Attempted to index archive causd an exception: %s" % e)
+                        exit(1)
+                else:
+                    logger.error(
+                        "Attempted to index archive without specifying a file, use --archive-file=<file>"
                     )
-                except Exception as e:
-                    logger.error("Attempted to index archive causd an exception: %s" % e)
                     exit(1)
+            elif index_args.pipeline:
+                # run a test, handing new result documents to an indexer running in its own thread
+                pipeline = IndexingPipeline(
+                    es,
+                    queue_depth=index_args.pipeline_queue_depth,
+                    spill_dir=index_args.pipeline_spill_dir,
+                    **bulk_settings,
+                )
+                pipeline.start()
+                try:
+                    pipeline.feed(process_generator(index_args, parser))
+                except BaseException:
+                    # index the documents produced before the benchmark failed or exited, and remove the
+                    # spill files, before the error propagates
+                    logger.error("Benchmark failed, draining indexing pipeline")
+                    try:
+                        pipeline.close()
+                    except RuntimeError:
+                        # the failure of the indexing thread was logged by it
+                        pass
+                    raise
+                logger.info("Benchmark finished, draining indexing pipeline")
+                res_beg, res_end, res_suc, res_dup, res_fail, res_retry = pipeline.close()
+                logger.info(
+                    "Indexing pipeline - %(produced)s documents produced, %(spilled)s spilled to disk in "
+                    "%(spill_segments)s segments, max queue depth %(max_queue_depth)s, "
+                    "final drain took %(drain_seconds)ss" % pipeline.stats
+                )
             else:
-                logger.error(
-                    "Attempted to index archive without specifying a file, use --archive-file=<file>"
+                # else run a test and process new result documents
+                res_beg, res_end, res_suc, res_dup, res_fail, res_retry = streaming_bulk(
+                    es, process_generator(index_args, parser), **bulk_settings
                 )
-                exit(1)
-        else:
-            # else run a test and process new result documents
-            res_beg, res_end, res_suc, res_dup, res_fail, res_retry = streaming_bulk(
-                es, process_generator(index_args, parser), parallel_setting
-            )
 
-        logger.info(
-            "Indexed results - %s success, %s duplicates, %s failures, with %s retries."
-            % (res_suc, res_dup, res_fail, res_retry)
-        )
+            logger.info(
+                "Indexed results - %s success, %s duplicates, %s failures, with %s retries."
+                % (res_suc, res_dup, res_fail, res_retry)
+            )
+            if bulk_settings["controller"]:
+                bulk_settings["controller"].log_summary()
 
-        start_t = time.strftime("%Y-%m-%dT%H:%M:%SGMT", time.gmtime(res_beg))
-        end_t = time.strftime("%Y-%m-%dT%H:%M:%SGMT", time.gmtime(res_end))
+            start_t = time.strftime("%Y-%m-%dT%H:%M:%SGMT", time.gmtime(res_beg))
+            end_t = time.strftime("%Y-%m-%dT%H:%M:%SGMT", time.gmtime(res_end))
 
-    else:
-        logger.info("Not connected to Elasticsearch")
-        start_t = time.strftime("%Y-%m-%dT%H:%M:%SGMT", time.gmtime())
-        # need to loop through generator and pass on all yields
-        # this will execute all jobs without elasticsearch
-        if "archive" in index_args.tool:
-            if index_args.archive_file:
-                logger.info("Processing archive file, but not indexing results...")
-                for es_friendly_doc in process_archive_file(index_args):
-                    pass
-            else:
-                logger.error(
-                    "Attempted to index archive without specifying a file, use --archive-file=<file>"
-                )
-                exit(1)
         else:
-            for i in process_generator(index_args, parser):
-                pass
-        end_t = time.strftime("%Y-%m-%dT%H:%M:%SGMT", time.gmtime())
+            logger.info("Not connected to Elasticsearch")
+            start_t = time.strftime("%Y-%m-%dT%H:%M:%SGMT", time.gmtime())
+            # need to loop through generator and pass on all yields
+            # this will execute all jobs without elasticsearch
+            if index_args.tool == "spool-replay":
+                logger.error("Attempted to replay a spool without an Elasticsearch server, set es=<server>")
+                exit(1)
+            elif "archive" in index_args.tool:
+                if index_args.archive_file:
+                    logger.info("Processing archive file, but not indexing results...")
+                    for es_friendly_doc in process_archive_file(index_args):
+                        pass
+                else:
+                    logger.error(
+                        "Attempted to index archive without specifying a file, use --archive-file=<file>"
+                    )
+                    exit(1)
+            elif spool is not None:
+                # keep the results in the spool so they can be replayed once Elasticsearch is back
+                for i in process_generator(index_args, parser):
+                    spool.record(i)
+            else:
+                for i in process_generator(index_args, parser):
+                    pass
+            end_t = time.strftime("%Y-%m-%dT%H:%M:%SGMT", time.gmtime())
+
+    finally:
+        if spool is not None:
+            spool.close()
+        for archive_writer in index_args.archive_writers.values():
+            archive_writer.close()
+        close_es_clients()
+    if index_args.prom_cache is not None:
+        prom_cache = index_args.prom_cache
+        logger.info("Prometheus cache - %s hits, %s misses" % (prom_cache.hits, prom_cache.misses))
+        if index_args.prom_cache_package:
+            for archive_filename in index_args.archive_writers:
+                entries = prom_cache.package(archive_filename + ".prom-cache")
+                logger.info("Packaged %s prometheus results in %s.prom-cache" % (entries, archive_filename))
 
     start_t = datetime.datetime.strptime(start_t, FMT)
     end_t = datetime.datetime.strptime(end_t, FMT)
@@ -193,8 +361,31 @@ def main():
     )
 
 
+def get_bulk_settings():
+    # bulk indexing engine, "parallel" is kept for backwards compatibility
+    concurrency = os.environ.get("es_bulk_concurrency")
+    bulk_settings = {
+        "parallel": strtobool(os.environ.get("parallel", "false")),
+        "engine": os.environ.get("es_bulk_engine"),
+        "concurrency": int(concurrency) if concurrency else None,
+        "controller": None,
+    }
+    # adaptive chunk size and concurrency control, driven by the async engine
+    if strtobool(os.environ.get("es_bulk_adaptive", "false")):
+        controller_settings = {}
+        if concurrency:
+            controller_settings["concurrency"] = int(concurrency)
+        if "es_bulk_target_latency" in os.environ:
+            controller_settings["target_latency"] = float(os.environ["es_bulk_target_latency"])
+        bulk_settings["controller"] = AdaptiveBulkController(**controller_settings)
+        bulk_settings["engine"] = bulk_settings["engine"] or "async"
+    return bulk_settings
+
+
 def process_generator(index_args, parser):
     benchmark_wrapper_object_generator = generate_wrapper_object(index_args, parser)
+    # archive-only indices whose documents were dropped because no archive is created
+    dropped_indices = set()
 
     for wrapper_object in benchmark_wrapper_object_generator:
         if isinstance(wrapper_object, benchmarks.Benchmark):
@@ -224,6 +415,16 @@ def process_generator(index_args, parser):
                         """
 
                         index_prom_data(index_args, action)
+                    elif isinstance(index, ArchiveOnly):
+                        if index_args.createarchive:
+                            # only written to the archive
+                            get_valid_es_document(action, index, index_args)
+                        elif index not in dropped_indices:
+                            dropped_indices.add(index)
+                            logger.warning(
+                                "Dropping %s documents which are only archived, use --create-archive "
+                                "to keep them" % index
+                            )
                     else:
                         es_valid_document = get_valid_es_document(action, index, index_args)
                         yield es_valid_document
@@ -235,19 +436,23 @@ def generate_wrapper_object(index_args, parser):
     yield benchmark_wrapper_object
 
 
-def get_valid_es_document(action, index, index_args):
+def get_valid_es_document(action, index, index_args, prefix=None):
+    # documents sent to another cluster than the results, e.g. prometheus data, use their own prefix
+    if prefix is None:
+        prefix = index_args.prefix
     if index != "":
-        es_index = index_args.prefix + "-" + index
+        es_index = prefix + "-" + index
     else:
-        es_index = index_args.prefix
+        es_index = prefix
     es_valid_document = {"_index": es_index, "_op_type": "create", "_source": action, "_id": ""}
     logger.debug("Run ID is %s" % {index_args.run_id})
     es_valid_document["run_id"] = action["run_id"] = index_args.run_id
-    es_valid_document["_id"] = hashlib.sha256(str(action).encode()).hexdigest()
+    es_valid_document["_id"] = fingerprint(action)
     document_size_bytes = sys.getsizeof(es_valid_document)
     index_args.document_size_capacity_bytes += document_size_bytes
     logger.debug("document size is: %s" % document_size_bytes)
-    logger.debug(json.dumps(es_valid_document, indent=4, default=str))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(json.dumps(es_valid_document, indent=4, default=json_default))
 
     if index_args.createarchive:
         write_to_archive_file(index_args, es_valid_document)
@@ -256,53 +461,48 @@ def get_valid_es_document(action, index, index_args):
 
 def index_prom_data(index_args, action):
     es_settings = {}
+    # the prefix of the prometheus cluster, the results keep index_args.prefix
+    prefix = os.getenv("es_index", "")
 
     # definition of prometheus data getter, will yield back prom doc
     def get_prometheus_generator(index_args, action):
-        prometheus_doc_generator = get_prometheus_data(action)
-        for prometheus_doc in prometheus_doc_generator.get_all_metrics():
-            es_valid_document = get_valid_es_document(prometheus_doc, "prometheus_data", index_args)
+        prometheus_doc_generator = get_prometheus_data(action, cache=index_args.prom_cache)
+        for prometheus_doc, index in prometheus_doc_generator.get_all_metrics():
+            es_valid_document = get_valid_es_document(prometheus_doc, index, index_args, prefix=prefix)
             yield es_valid_document
 
     es_settings["server"] = os.getenv("prom_es")
     es_settings["verify_cert"] = os.getenv("es_verify_cert", "true")
     if ":443" in es_settings["server"]:
         es_settings["verify_cert"] = "false"
+    index_prometheus = False
     if es_settings["server"]:
-        index_args.prefix = os.getenv("es_index", "")
         logger.info("Using Prometheus elasticsearch server with host: %s" % es_settings["server"])
-        logger.info("Using index prefix for prometheus ES: %s" % index_args.prefix)
-        index_args.index_results = True
+        logger.info("Using index prefix for prometheus ES: %s" % prefix)
+        index_prometheus = True
         try:
             if es_settings["verify_cert"] == "false":
                 logger.info("Turning off TLS certificate verification for Prometheus ES indexer")
-                urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-                ssl_ctx = ssl.create_default_context()
-                ssl_ctx.check_hostname = False
-                ssl_ctx.verify_mode = ssl.CERT_NONE
-                es = elasticsearch.Elasticsearch(
-                    [es_settings["server"]], send_get_body_as="POST", ssl_context=ssl_ctx, use_ssl=True
-                )
-            else:
-                es = elasticsearch.Elasticsearch([es_settings["server"]], send_get_body_as="POST")
-            logger.info("Connected to the elasticsearch cluster with info as follows:")
-            logger.info(json.dumps(es.info(), indent=4))
+            # the client is shared with the results and the previous samples sent to the same cluster
+            es = get_es_client(es_settings, use_ssl=True)
         except Exception as e:
             logger.warn("Elasticsearch connection caused an exception: %s" % e)
-            index_args.index_results = False
+            index_prometheus = False
 
     # check that we want to index and that the prom_es exist.
-    if index_args.index_results:
+    if index_prometheus:
         logger.info("initializing prometheus indexing")
-        parallel_setting = strtobool(os.environ.get("parallel", "false"))
+        bulk_settings = get_bulk_settings()
         res_beg, res_end, res_suc, res_dup, res_fail, res_retry = streaming_bulk(
-            es, get_prometheus_generator(index_args, action), parallel_setting
+            es, get_prometheus_generator(index_args, action), **bulk_settings
         )
 
         logger.info(
             "Prometheus indexed results - %s success, %s duplicates, %s failures, with %s retries."
             % (res_suc, res_dup, res_fail, res_retry)
         )
+        if bulk_settings["controller"]:
+            bulk_settings["controller"].log_summary()
         start_t = time.strftime("%Y-%m-%dT%H:%M:%SGMT", time.gmtime(res_beg))
         end_t = time.strftime("%Y-%m-%dT%H:%M:%SGMT", time.gmtime(res_end))
         # set up a standard format for time
@@ -318,17 +518,65 @@ def index_prom_data(index_args, action):
 def process_archive_file(index_args):
 
     if os.path.isfile(index_args.archive_file):
-        with open(index_args.archive_file) as f:
-            for line in f:
-                es_friendly_document = json.loads(line)
-                document_size_bytes = sys.getsizeof(es_friendly_document)
-                index_args.document_size_capacity_bytes += document_size_bytes
-                yield es_friendly_document
+        for es_friendly_document in iter_archive(index_args.archive_file):
+            document_size_bytes = sys.getsizeof(es_friendly_document)
+            index_args.document_size_capacity_bytes += document_size_bytes
+            yield es_friendly_document
     else:
         logger.error("%s Not found" % index_args.archive_file)
         exit(1)
 
 
+def index_archive_file(es, es_settings, index_args, bulk_settings):
+    archive_file = index_args.archive_file
+    workers = index_args.archive_workers or 1
+    if (
+        workers < 2
+        or not os.path.isfile(archive_file)
+        or detect_archive_format(archive_file) != "chunked"
+        or bulk_settings["spool"] is not None
+    ):
+        # legacy archives, single worker runs and spooled runs are indexed from this process
+        return streaming_bulk(es, process_archive_file(index_args), **bulk_settings)
+
+    frames = read_archive_index(archive_file)
+    workers = max(1, min(workers, len(frames)))
+    logger.info(
+        "Indexing %d documents in %d frames of %s with %d workers"
+        % (sum(frame.documents for frame in frames), len(frames), archive_file, workers)
+    )
+    res_beg, res_end, res_suc, res_dup, res_fail, res_retry = time.time(), time.time(), 0, 0, 0, 0
+    with multiprocessing.Pool(workers, initializer=_init_archive_worker, initargs=(es_settings,)) as pool:
+        for beg, end, suc, dup, fail, retry, size in pool.imap_unordered(
+            _index_archive_frame, [(archive_file, frame) for frame in frames]
+        ):
+            res_beg, res_end = min(res_beg, beg), max(res_end, end)
+            res_suc += suc
+            res_dup += dup
+            res_fail += fail
+            res_retry += retry
+            index_args.document_size_capacity_bytes += size
+    return res_beg, res_end, res_suc, res_dup, res_fail, res_retry
+
+
+# per process state of the archive indexing workers
+_archive_worker = {}
+
+
+def _init_archive_worker(es_settings):
+    # connections of the parent process cannot be shared with the workers
+    _archive_worker["es"] = create_es_client(es_settings)
+    _archive_worker["bulk_settings"] = get_bulk_settings()
+
+
+def _index_archive_frame(args):
+    archive_file, frame = args
+    documents = list(read_frame(archive_file, frame))
+    size = sum(sys.getsizeof(document) for document in documents)
+    res = streaming_bulk(_archive_worker["es"], iter(documents), **_archive_worker["bulk_settings"])
+    return tuple(res) + (size,)
+
+
 def write_to_archive_file(index_args, es_friendly_documment):
 
     if index_args.archive_file:
@@ -341,10 +589,14 @@ def write_to_archive_file(index_args, es_friendly_documment):
         #  create archive file as user_clustername_uuid.archive in cwd
         archive_filename = user + "_" + clustername + "_" + uuid + ".archive"
 
-    #  Will write each es friendly document on 1 line, this makes re-indexing easier later
-    with open(archive_filename, "a") as f:
-        json.dump(es_friendly_documment, f)
-        f.write(os.linesep)
+    #  documents are written by a background thread which keeps the archive open until main() closes it
+    if archive_filename not in index_args.archive_writers:
+        index_args.archive_writers[archive_filename] = BackgroundArchiveWriter(
+            open_archive_writer(archive_filename, index_args.archive_format),
+            flush_interval=index_args.archive_flush_interval,
+            fsync=index_args.archive_fsync,
+        )
+    index_args.archive_writers[archive_filename].write(es_friendly_documment)
 
 
 if __name__ == "__main__":
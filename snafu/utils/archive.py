@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Archive files of Elasticsearch friendly documents.
+
+Two formats are supported:
+
+* ``ndjson``, the legacy format, one JSON document per line.
+* ``chunked``, a file header followed by independently compressed frames (zstd when the ``zstandard``
+  package is installed, gzip otherwise) of newline delimited documents, and a footer index holding the
+  offset, length and document count of every frame. Frames can be decoded independently, which allows
+  ``run_snafu --tool archive`` to split them across worker processes.
+
+Layout of a chunked archive::
+
+    MAGIC | VERSION | frame 0 | frame 1 | ... | footer (JSON) | footer length (<Q) | MAGIC
+
+A chunked archive whose writer did not get to write the footer (e.g. the wrapper crashed) can still be
+read, the frames are then located by decompressing them one after another.
+"""
+import gzip
+import json
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from collections import namedtuple
+from typing import Any, Dict, Iterator, List, Optional
+
+from snafu.utils.envelope import EnvelopeSerializer
+
+try:
+    import zstandard
+
+    zstd_imported = True
+except ImportError:
+    zstd_imported = False
+
+logger = logging.getLogger("snafu")
+
+ARCHIVE_FORMATS = ("chunked", "ndjson")
+FSYNC_POLICIES = ("none", "interval", "per-batch")
+MAGIC = b"SNAFUARC"
+VERSION = 1
+_HEADER = MAGIC + bytes([VERSION])
+_TRAILER = struct.Struct("<Q")
+_FRAME_MAGICS = {b"\x1f\x8b": "gzip", b"\x28\xb5\x2f\xfd": "zstd"}
+_READ_SIZE = 1024**2
+# maximum number of documents written by the background writer between two flush checks
+_BATCH_SIZE = 1000
+# marks the end of the document stream on the background writer queue
+_END_OF_STREAM = object()
+
+# documents are archived the same way the elasticsearch client would serialize them
+_serializer = EnvelopeSerializer()
+
+ArchiveFrame = namedtuple("ArchiveFrame", ["offset", "length", "documents", "codec"])
+
+
+class ArchiveOnly(str):
+    """
+    Index name of documents which are written to the archive but not sent to Elasticsearch, e.g. raw
+    fio log lines which are indexed as rolled up windows.
+    """
+
+
+def _compress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor().compress(data)
+    return gzip.compress(data)
+
+
+def _decompressor(codec: str):
+    if codec == "zstd":
+        if not zstd_imported:
+            raise RuntimeError("Archive contains zstd frames, install the zstandard package to read it")
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(wbits=31)
+
+
+def _frame_codec(head: bytes) -> Optional[str]:
+    for magic, codec in _FRAME_MAGICS.items():
+        if head.startswith(magic):
+            return codec
+    return None
+
+
+def detect_archive_format(path: str) -> str:
+    """Return ``"chunked"`` or ``"ndjson"`` depending on the header of the archive file."""
+    with open(path, "rb") as archive_file:
+        return "chunked" if archive_file.read(len(MAGIC)) == MAGIC else "ndjson"
+
+
+def _read_footer(archive_file) -> Optional[List[ArchiveFrame]]:
+    archive_file.seek(0, os.SEEK_END)
+    size = archive_file.tell()
+    if size < len(_HEADER) + _TRAILER.size + len(MAGIC):
+        return None
+    archive_file.seek(size - _TRAILER.size - len(MAGIC))
+    trailer = archive_file.read()
+    if not trailer.endswith(MAGIC):
+        return None
+    (footer_length,) = _TRAILER.unpack(trailer[: _TRAILER.size])
+    archive_file.seek(size - _TRAILER.size - len(MAGIC) - footer_length)
+    footer = json.loads(archive_file.read(footer_length))
+    return [ArchiveFrame(*frame) for frame in footer["frames"]]
+
+
+def _scan_frames(archive_file) -> List[ArchiveFrame]:
+    """Locate the frames of an archive without footer by decompressing them, ignoring a truncated tail."""
+    frames: List[ArchiveFrame] = []
+    offset = len(_HEADER)
+    while True:
+        archive_file.seek(offset)
+        codec = _frame_codec(archive_file.read(4))
+        if codec is None:
+            return frames
+        archive_file.seek(offset)
+        decompressor = _decompressor(codec)
+        length = documents = 0
+        while not decompressor.eof:
+            chunk = archive_file.read(_READ_SIZE)
+            if not chunk:
+                logger.warning("Ignoring truncated frame at offset %d of archive" % offset)
+                return frames
+            documents += decompressor.decompress(chunk).count(b"\n")
+            length += len(chunk) - (len(decompressor.unused_data) if decompressor.eof else 0)
+        frames.append(ArchiveFrame(offset, length, documents, codec))
+        offset += length
+
+
+def read_archive_index(path: str) -> List[ArchiveFrame]:
+    """Return the frames of a chunked archive, from its footer index when it has one."""
+    with open(path, "rb") as archive_file:
+        if archive_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a chunked archive" % path)
+        frames = _read_footer(archive_file)
+        if frames is None:
+            logger.warning("Archive %s has no footer index, scanning its frames" % path)
+            frames = _scan_frames(archive_file)
+        return frames
+
+
+def read_frame(path: str, frame: ArchiveFrame) -> Iterator[Dict[str, Any]]:
+    """Decode the documents of a single frame of a chunked archive."""
+    with open(path, "rb") as archive_file:
+        archive_file.seek(frame.offset)
+        data = _decompressor(frame.codec).decompress(archive_file.read(frame.length))
+    for line in data.splitlines():
+        yield json.loads(line)
+
+
+def iter_archive(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield every document of an archive file of either format."""
+    if detect_archive_format(path) == "chunked":
+        for frame in read_archive_index(path):
+            yield from read_frame(path, frame)
+    else:
+        with open(path) as archive_file:
+            for line in archive_file:
+                yield json.loads(line)
+
+
+class NdjsonArchiveWriter:
+    """Legacy archive writer, one JSON document per line."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a")
+
+    def write(self, document: Dict[str, Any]):
+        #  Will write each es friendly document on 1 line, this makes re-indexing easier later
+        self._file.write(_serializer.dumps(document) + os.linesep)
+
+    def flush(self, fsync: bool = False):
+        self._file.flush()
+        if fsync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ChunkedArchiveWriter:
+    """
+    Write documents to a chunked archive.
+
+    Parameters
+    ----------
+    path : str
+        Archive file. An existing chunked archive is appended to.
+    frame_documents : int, optional
+        Number of documents compressed together in a frame.
+    codec : str, optional
+        ``"zstd"`` or ``"gzip"``, defaults to zstd when the zstandard package is installed.
+    """
+
+    def __init__(self, path: str, frame_documents: int = 1000, codec: Optional[str] = None):
+        if codec is None:
+            codec = "zstd" if zstd_imported else "gzip"
+        if codec not in ("zstd", "gzip") or (codec == "zstd" and not zstd_imported):
+            raise ValueError("Unsupported archive codec %s" % codec)
+        self.path = path
+        self.codec = codec
+        self.frame_documents = frame_documents
+        self.documents = 0
+        self._buffer: List[str] = []
+        if os.path.isfile(path) and os.path.getsize(path) > 0:
+            # drop the footer of the existing archive, it is rewritten on close
+            self.frames = read_archive_index(path)
+            end = self.frames[-1].offset + self.frames[-1].length if self.frames else len(_HEADER)
+            self._file = open(path, "r+b")
+            self._file.truncate(end)
+            self._file.seek(end)
+        else:
+            self.frames = []
+            self._file = open(path, "wb")
+            self._file.write(_HEADER)
+
+    def write(self, document: Dict[str, Any]):
+        self._buffer.append(_serializer.dumps(document))
+        if len(self._buffer) >= self.frame_documents:
+            self._write_frame()
+
+    def _write_frame(self):
+        if not self._buffer:
+            return
+        data = _compress(self.codec, ("\n".join(self._buffer) + "\n").encode("utf-8"))
+        self.frames.append(ArchiveFrame(self._file.tell(), len(data), len(self._buffer), self.codec))
+        self._file.write(data)
+        self.documents += len(self._buffer)
+        self._buffer = []
+
+    def flush(self, fsync: bool = False):
+        """
+        Write the pending frame, even if it is not full, and flush the archive file. Documents are then
+        on disk and readable without the footer if the writer is never closed.
+        """
+        self._write_frame()
+        self._file.flush()
+        if fsync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        """Write the pending frame and the footer index."""
+        if self._file is None:
+            return
+        self._write_frame()
+        footer = json.dumps({"version": VERSION, "frames": [list(frame) for frame in self.frames]})
+        footer = footer.encode("utf-8")
+        self._file.write(footer + _TRAILER.pack(len(footer)) + MAGIC)
+        self._file.close()
+        self._file = None
+
+
+def open_archive_writer(path: str, archive_format: str = "ndjson"):
+    """Return an archive writer for path, existing archives keep the format they were created with."""
+    if archive_format not in ARCHIVE_FORMATS:
+        raise ValueError("Unknown archive format %s, use one of %s" % (archive_format, ARCHIVE_FORMATS))
+    if os.path.isfile(path) and os.path.getsize(path) > 0:
+        existing_format = detect_archive_format(path)
+        if existing_format != archive_format:
+            logger.warning("Appending to %s archive %s in its own format" % (existing_format, path))
+            archive_format = existing_format
+    if archive_format == "chunked":
+        return ChunkedArchiveWriter(path)
+    return NdjsonArchiveWriter(path)
+
+
+class BackgroundArchiveWriter:
+    """
+    Hand documents to an archive writer running in a dedicated thread.
+
+    Documents are queued by :py:meth:`write` and written in batches by the writer thread, so the
+    benchmark only pays for a queue insertion per document. Errors of the writer thread are raised by
+    the next call to :py:meth:`write` or by :py:meth:`close`.
+
+    Parameters
+    ----------
+    writer : NdjsonArchiveWriter or ChunkedArchiveWriter
+        Archive writer owning the archive file, only used from the writer thread.
+    queue_depth : int, optional
+        Maximum number of queued documents, :py:meth:`write` blocks when the queue is full.
+    flush_interval : float, optional
+        Seconds between flushes of the archive file.
+    fsync : str, optional
+        ``"none"`` leaves syncing to the OS, ``"interval"`` syncs the archive at every flush and
+        ``"per-batch"`` syncs it after every batch of documents.
+    """
+
+    def __init__(self, writer, queue_depth: int = 10000, flush_interval: float = 1.0, fsync: str = "none"):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("Unknown fsync policy %s, use one of %s" % (fsync, FSYNC_POLICIES))
+        self.writer = writer
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.stats: Dict[str, Any] = {"documents": 0, "batches": 0, "flushes": 0}
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=queue_depth)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, name="snafu-archiver", daemon=True)
+        self._thread.start()
+
+    def write(self, document: Dict[str, Any]):
+        if self._error is not None:
+            raise RuntimeError("Archive writer failed: %s" % self._error) from self._error
+        self._queue.put(document)
+
+    def close(self):
+        """Write the queued documents and close the archive."""
+        if self._thread is None:
+            return
+        self._queue.put(_END_OF_STREAM)
+        self._thread.join()
+        self._thread = None
+        logger.debug(
+            "Archive %s - %d documents written in %d batches, %d flushes"
+            % (
+                self.writer.path,
+                self.stats["documents"],
+                self.stats["batches"],
+                self.stats["flushes"],
+            )
+        )
+        if self._error is not None:
+            raise RuntimeError("Archive writer failed: %s" % self._error) from self._error
+
+    def _run(self):
+        last_flush = time.monotonic()
+        done = False
+        try:
+            while not done:
+                batch = []
+                try:
+                    batch.append(self._queue.get(timeout=self.flush_interval))
+                    while len(batch) < _BATCH_SIZE:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    pass
+                for document in batch:
+                    if document is _END_OF_STREAM:
+                        done = True
+                        break
+                    self.writer.write(document)
+                    self.stats["documents"] += 1
+                if batch:
+                    self.stats["batches"] += 1
+                if self.fsync == "per-batch" and batch:
+                    self.writer.flush(fsync=True)
+                    self.stats["flushes"] += 1
+                    last_flush = time.monotonic()
+                elif time.monotonic() - last_flush >= self.flush_interval:
+                    self.writer.flush(fsync=self.fsync == "interval")
+                    self.stats["flushes"] += 1
+                    last_flush = time.monotonic()
+        except BaseException as e:
+            self._error = e
+            # keep draining so that producers blocked on a full queue are released, unless the end of
+            # stream was already taken off the queue
+            while not done:
+                done = self._queue.get() is _END_OF_STREAM
+        finally:
+            try:
+                self.writer.close()
+            except BaseException as e:
+                self._error = self._error or e
@@ -0,0 +1,244 @@
+"""
+Asyncio based bulk indexing engine.
+
+Keeps several bulk requests in flight on a single event loop sharing one keep-alive connection pool,
+instead of burning CPU on GIL contention in thread based ``parallel_bulk``. The result contract and
+the 409 duplicate, 400 failure and retry semantics are the same as
+:py:func:`snafu.utils.py_es_bulk.streaming_bulk`.
+
+Requires the optional ``aiohttp`` dependency used by ``elasticsearch.AsyncElasticsearch``.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from elasticsearch import exceptions as es_excs
+
+from snafu.utils import py_es_bulk
+from snafu.utils.envelope import json_default
+
+logger = logging.getLogger("snafu")
+
+aiohttp_imported = True
+try:
+    from elasticsearch import AsyncElasticsearch
+except ImportError:
+    aiohttp_imported = False
+
+# number of bulk requests kept in flight
+DEFAULT_CONCURRENCY = 8
+# maximum number of documents per bulk request
+DEFAULT_CHUNK_SIZE = 500
+# maximum size of the body of a bulk request
+DEFAULT_MAX_CHUNK_BYTES = 104857600
+
+
+def _async_client_from(es, concurrency):
+    """
+    Build an AsyncElasticsearch client pointing at the same hosts, with the same connection settings
+    (TLS context, certificate verification...) as an already constructed synchronous client.
+    """
+    connection_kwargs = dict(es.transport.kwargs)
+    connection_kwargs["maxsize"] = concurrency
+    return AsyncElasticsearch(es.transport.hosts, serializer=es.transport.serializer, **connection_kwargs)
+
+
+class _ChunkReader:
+    """
+    Pull actions from a (possibly blocking) synchronous iterator and group them into serialized bulk
+    request bodies. Called from a worker thread so that a slow benchmark never blocks the event loop.
+    """
+
+    def __init__(self, actions, serializer, chunk_size, max_chunk_bytes, spool=None):
+        self.actions = iter(actions)
+        self.spool = spool
+        self.serializer = serializer
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+
+    def serialize(self, action):
+        meta = {"_index": action["_index"], "_id": action["_id"]}
+        return "%s\n%s\n" % (
+            self.serializer.dumps({py_es_bulk._op_type: meta}),
+            self.serializer.dumps(action["_source"]),
+        )
+
+    def next_chunk(self):
+        chunk = []
+        size = 0
+        for action in self.actions:
+            assert "_id" in action
+            assert "_index" in action
+            assert py_es_bulk._op_type == action["_op_type"]
+            if self.spool is not None:
+                self.spool.record(action)
+            line = self.serialize(action)
+            chunk.append((0, action, line))
+            size += len(line)
+            if len(chunk) >= self.chunk_size or size >= self.max_chunk_bytes:
+                break
+        return chunk
+
+
+class _AsyncBulkIndexer:
+    def __init__(self, es, actions, concurrency, chunk_size, max_chunk_bytes, controller=None, spool=None):
+        self.es = es
+        self.concurrency = concurrency
+        self.controller = controller
+        self.spool = spool
+        self.reader = _ChunkReader(actions, es.transport.serializer, chunk_size, max_chunk_bytes, spool)
+        self.counts = Counter()
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        max_concurrency = self.controller.max_concurrency if self.controller else self.concurrency
+        client = _async_client_from(self.es, max_concurrency)
+        in_flight = set()
+        try:
+            with ThreadPoolExecutor(max_workers=1) as reader_pool:
+                while True:
+                    if self.controller:
+                        self.concurrency = self.controller.concurrency
+                        self.reader.chunk_size = self.controller.chunk_size
+                    chunk = await loop.run_in_executor(reader_pool, self.reader.next_chunk)
+                    if not chunk:
+                        break
+                    while len(in_flight) >= self.concurrency:
+                        done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                        for task in done:
+                            # surface exceptions raised while sending
+                            task.result()
+                    in_flight.add(loop.create_task(self.send(client, chunk)))
+                if in_flight:
+                    await asyncio.gather(*in_flight)
+        finally:
+            await client.close()
+
+    async def send(self, client, chunk):
+        backoff = 1
+        while chunk:
+            body = "".join(line for _, _, line in chunk)
+            epoch = self.controller.epoch if self.controller else 0
+            sent = time.time()
+            try:
+                resp = await client.bulk(body=body, request_timeout=py_es_bulk._request_timeout)
+            except es_excs.TransportError as exc:
+                # Connection errors, 429s and 5xx on the whole request, retry every action
+                logger.warning(exc)
+                items = [{py_es_bulk._op_type: {"status": exc.status_code, "error": str(exc)}}] * len(chunk)
+            else:
+                items = resp["items"]
+            if self.controller:
+                self.record(epoch, time.time() - sent, items)
+            chunk = self.account(chunk, items)
+            if chunk:
+                await asyncio.sleep(py_es_bulk._calc_backoff_sleep(backoff))
+                self.counts["retries"] += 1
+                backoff += 1
+
+    def record(self, epoch, latency, items):
+        """Feed the outcome of a bulk request to the adaptive controller."""
+        rejected = errors = 0
+        for item in items:
+            status = item.get(py_es_bulk._op_type, {}).get("status", 999)
+            if status == 429:
+                rejected += 1
+            elif not (isinstance(status, int) and (200 <= status < 300 or status == 409)):
+                errors += 1
+        self.controller.record(epoch, latency, len(items), rejected=rejected, errors=errors)
+
+    def account(self, chunk, items):
+        """Tally the bulk response items, returning the entries that must be retried."""
+        assert len(chunk) == len(items)
+        retry = []
+        for (retry_count, action, line), item in zip(chunk, items):
+            resp = item.get(py_es_bulk._op_type, {})
+            status = resp.get("status", 999)
+            if isinstance(status, int) and 200 <= status < 300:
+                assert action["_id"] == resp["_id"]
+                self.counts["successes"] += 1
+                if self.spool is not None:
+                    self.spool.commit(action["_id"])
+            elif status == 409:
+                if self.spool is not None:
+                    self.spool.commit(action["_id"])
+                if retry_count == 0:
+                    # Only count duplicates if the retry count is 0 ...
+                    self.counts["duplicates"] += 1
+                else:
+                    # ... otherwise consider it successful.
+                    self.counts["successes"] += 1
+            elif status == 400:
+                doc = {
+                    "action": action,
+                    "ok": False,
+                    "resp": resp,
+                    "retry_count": retry_count,
+                    "timestamp": py_es_bulk._tstos(time.time()),
+                }
+                print(json.dumps(doc, indent=4, sort_keys=True, default=json_default))
+                if self.spool is not None:
+                    self.spool.dead_letter(action, resp, retry_count)
+                self.counts["failures"] += 1
+            else:
+                # Retry all other errors
+                print(resp)
+                retry.append((retry_count + 1, action, line))
+        return retry
+
+
+def async_streaming_bulk(
+    es,
+    actions,
+    concurrency=DEFAULT_CONCURRENCY,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES,
+    controller=None,
+    spool=None,
+):
+    """
+    async_streaming_bulk(es, actions)
+    Arguments:
+        es - An Elasticsearch client object already constructed, its hosts and
+             connection settings are used to build the asyncio client
+        actions - An iterable for the documents to be indexed
+        concurrency - Number of bulk requests kept in flight
+        chunk_size - Maximum number of documents per bulk request
+        max_chunk_bytes - Maximum size in bytes of a bulk request
+        controller - Optional AdaptiveBulkController, overrides concurrency
+                     and chunk_size as it observes the cluster
+        spool - Optional snafu.utils.spool.Spool recording every document
+                before it is sent and committing it once acknowledged
+    Returns:
+        A tuple with the start and end times, the # of successfully indexed,
+        duplicate, and failed documents, along with number of times a bulk
+        request was retried.
+    """
+    if not aiohttp_imported:
+        raise RuntimeError("The async bulk indexer requires the aiohttp module, please install it")
+
+    if controller:
+        logger.info("Using adaptive async bulk indexer")
+    else:
+        logger.info("Using async bulk indexer with %d requests in flight" % concurrency)
+    indexer = _AsyncBulkIndexer(es, actions, concurrency, chunk_size, max_chunk_bytes, controller, spool)
+    beg = time.time()
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(indexer.run())
+    finally:
+        loop.close()
+    end = time.time()
+
+    return (
+        beg,
+        end,
+        indexer.counts["successes"],
+        indexer.counts["duplicates"],
+        indexer.counts["failures"],
+        indexer.counts["retries"],
+    )
@@ -0,0 +1,196 @@
+"""
+AIMD style controller for bulk indexing chunk size and concurrency.
+
+After every bulk request the controller is told how long the request took, how many documents were sent
+and how many of them were rejected (429) or failed. Healthy requests additively grow the chunk size and
+the number of requests in flight, while slow requests, rejections or high error rates multiplicatively
+shrink both. Only one decrease is applied per congestion event: requests which were already in flight
+when the controller backed off do not cause further decreases.
+"""
+
+import logging
+import time
+from collections import Counter
+
+logger = logging.getLogger("snafu")
+
+# number of decisions kept for the final summary
+_DECISION_HISTORY = 20
+
+
+class AdaptiveBulkController:
+    """
+    Adaptive (additive increase, multiplicative decrease) bulk size and concurrency controller.
+
+    Parameters
+    ----------
+    chunk_size : int, optional
+        Initial number of documents per bulk request.
+    concurrency : int, optional
+        Initial number of bulk requests in flight.
+    min_chunk_size, max_chunk_size : int, optional
+        Bounds for the chunk size.
+    min_concurrency, max_concurrency : int, optional
+        Bounds for the number of requests in flight.
+    chunk_step : int, optional
+        Number of documents added to the chunk size on each increase.
+    decrease_factor : float, optional
+        Factor applied to chunk size and concurrency on each decrease.
+    target_latency : float, optional
+        Bulk request latency in seconds above which the cluster is considered saturated.
+    max_error_rate : float, optional
+        Fraction of failed documents per request above which the controller backs off.
+    """
+
+    def __init__(
+        self,
+        chunk_size=500,
+        concurrency=4,
+        min_chunk_size=50,
+        max_chunk_size=10000,
+        min_concurrency=1,
+        max_concurrency=32,
+        chunk_step=100,
+        decrease_factor=0.5,
+        target_latency=5.0,
+        max_error_rate=0.05,
+    ):
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.chunk_step = chunk_step
+        self.decrease_factor = decrease_factor
+        self.target_latency = target_latency
+        self.max_error_rate = max_error_rate
+        self.chunk_size = min(max(chunk_size, min_chunk_size), max_chunk_size)
+        self.concurrency = min(max(concurrency, min_concurrency), max_concurrency)
+        # incremented on every decrease, requests sent before a decrease belong to an older epoch
+        self.epoch = 0
+        self.counts = Counter()
+        self.decisions = []
+        self._healthy_streak = 0
+        self._limits = {
+            "min_chunk_size": self.chunk_size,
+            "max_chunk_size": self.chunk_size,
+            "min_concurrency": self.concurrency,
+            "max_concurrency": self.concurrency,
+        }
+
+    def record(self, epoch, latency, documents, rejected=0, errors=0):
+        """
+        Record the outcome of a bulk request and adjust chunk size and concurrency.
+
+        Parameters
+        ----------
+        epoch : int
+            Value of :py:attr:`epoch` when the request was sent.
+        latency : float
+            Duration of the request in seconds.
+        documents : int
+            Number of documents in the request.
+        rejected : int, optional
+            Number of documents rejected with a 429 (or the whole request was rejected).
+        errors : int, optional
+            Number of documents which failed for any other reason.
+        """
+        self.counts["requests"] += 1
+        self.counts["documents"] += documents
+        self.counts["rejected"] += rejected
+        self.counts["errors"] += errors
+        self.counts["latency"] += latency
+
+        if rejected:
+            reason = "%d documents rejected" % rejected
+        elif documents and float(errors) / documents > self.max_error_rate:
+            reason = "error rate %.1f%%" % (100.0 * errors / documents)
+        elif latency > self.target_latency:
+            reason = "latency %.2fs above %.2fs target" % (latency, self.target_latency)
+        else:
+            reason = None
+
+        if reason is not None:
+            self._healthy_streak = 0
+            if epoch == self.epoch:
+                self._decrease(reason)
+        else:
+            self._healthy_streak += 1
+            # grow once per round trip, i.e. once every `concurrency` healthy requests
+            if self._healthy_streak >= self.concurrency:
+                self._healthy_streak = 0
+                self._increase(latency)
+
+    def _decrease(self, reason):
+        self.epoch += 1
+        self.chunk_size = max(self.min_chunk_size, int(self.chunk_size * self.decrease_factor))
+        self.concurrency = max(self.min_concurrency, int(self.concurrency * self.decrease_factor))
+        self.counts["decreases"] += 1
+        self._decide("decrease", reason)
+
+    def _increase(self, latency):
+        chunk_size = min(self.max_chunk_size, self.chunk_size + self.chunk_step)
+        concurrency = min(self.max_concurrency, self.concurrency + 1)
+        if (chunk_size, concurrency) == (self.chunk_size, self.concurrency):
+            return
+        self.chunk_size, self.concurrency = chunk_size, concurrency
+        self.counts["increases"] += 1
+        self._decide("increase", "latency %.2fs" % latency)
+
+    def _decide(self, action, reason):
+        self._limits["min_chunk_size"] = min(self._limits["min_chunk_size"], self.chunk_size)
+        self._limits["max_chunk_size"] = max(self._limits["max_chunk_size"], self.chunk_size)
+        self._limits["min_concurrency"] = min(self._limits["min_concurrency"], self.concurrency)
+        self._limits["max_concurrency"] = max(self._limits["max_concurrency"], self.concurrency)
+        decision = {
+            "time": time.time(),
+            "action": action,
+            "reason": reason,
+            "chunk_size": self.chunk_size,
+            "concurrency": self.concurrency,
+        }
+        logger.debug(
+            "Bulk controller %(action)s (%(reason)s): chunk size %(chunk_size)d, "
+            "concurrency %(concurrency)d" % decision
+        )
+        self.decisions.append(decision)
+        del self.decisions[:-_DECISION_HISTORY]
+
+    def summary(self):
+        """Return a dictionary describing the decisions taken by the controller."""
+        requests = self.counts["requests"]
+        summary = {
+            "requests": requests,
+            "documents": self.counts["documents"],
+            "rejected": self.counts["rejected"],
+            "errors": self.counts["errors"],
+            "mean_latency": round(self.counts["latency"] / requests, 3) if requests else 0,
+            "increases": self.counts["increases"],
+            "decreases": self.counts["decreases"],
+            "final_chunk_size": self.chunk_size,
+            "final_concurrency": self.concurrency,
+            "last_decisions": list(self.decisions),
+        }
+        summary.update(self._limits)
+        return summary
+
+    def log_summary(self, log=logger):
+        """Log the controller summary, meant to be called next to the final indexing summary."""
+        summary = self.summary()
+        log.info(
+            "Adaptive bulk controller - %(requests)d requests with mean latency %(mean_latency)ss, "
+            "%(rejected)d rejected and %(errors)d failed documents, %(increases)d increases and "
+            "%(decreases)d decreases, chunk size %(min_chunk_size)d-%(max_chunk_size)d "
+            "(final %(final_chunk_size)d), concurrency %(min_concurrency)d-%(max_concurrency)d "
+            "(final %(final_concurrency)d)" % summary
+        )
+        for decision in summary["last_decisions"]:
+            log.debug(
+                "Bulk controller decision at %s: %s (%s), chunk size %d, concurrency %d"
+                % (
+                    time.strftime("%Y-%m-%dT%H:%M:%SGMT", time.gmtime(decision["time"])),
+                    decision["action"],
+                    decision["reason"],
+                    decision["chunk_size"],
+                    decision["concurrency"],
+                )
+            )
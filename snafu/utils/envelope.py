@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Shared envelopes of run metadata for large document emissions.
+
+Documents emitted per log line or per time series data point repeat the same run and job metadata
+(uuid, user, cluster name, job options, test config...). An :py:class:`Envelope` holds that metadata
+once, and every :py:class:`EnvelopeDocument` only stores its own fields on top of it. The documents behave
+like regular dicts, and :py:class:`EnvelopeSerializer` merges the envelope back into each document when it
+is serialized, reusing the JSON of the envelope which is only serialized once. The indexed documents are
+the same as if the metadata had been copied into each of them.
+"""
+from collections.abc import Mapping, MutableMapping
+from typing import Any, Dict, Iterator, Optional
+
+from elasticsearch.serializer import JSONSerializer
+
+
+class Envelope(Mapping):
+    """
+    Immutable metadata shared by many documents.
+
+    Parameters
+    ----------
+    fields : mapping
+        Shared fields, copied so that later changes to the mapping do not leak into the documents.
+    """
+
+    def __init__(self, fields: Optional[Mapping] = None):
+        self._fields: Dict[str, Any] = dict(fields or {})
+        # serializer type -> JSON of the fields without the surrounding braces
+        self._fragments: Dict[type, str] = {}
+
+    def __getitem__(self, key):
+        return self._fields[key]
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __repr__(self):
+        return "Envelope(%r)" % self._fields
+
+    def extend(self, fields: Mapping) -> "Envelope":
+        """Return a new envelope with additional fields, e.g. a job envelope from a run envelope."""
+        return Envelope(dict(self._fields, **fields))
+
+    def fragment(self, serializer: JSONSerializer) -> str:
+        """Return the serialized fields without the surrounding braces, computed once per serializer."""
+        fragment = self._fragments.get(type(serializer))
+        if fragment is None:
+            fragment = serializer.dumps(self._fields)[1:-1]
+            self._fragments[type(serializer)] = fragment
+        return fragment
+
+
+class EnvelopeDocument(MutableMapping):
+    """
+    Document made of a shared envelope and its own fields, the document's own fields win.
+
+    Parameters
+    ----------
+    envelope : Envelope
+        Metadata shared with other documents, never modified through the document.
+    body : dict, optional
+        Fields specific to this document.
+    """
+
+    def __init__(self, envelope: Envelope, body: Optional[Dict[str, Any]] = None):
+        self.envelope = envelope
+        self.body: Dict[str, Any] = body if body is not None else {}
+
+    def __getitem__(self, key):
+        if key in self.body:
+            return self.body[key]
+        return self.envelope[key]
+
+    def __setitem__(self, key, value):
+        self.body[key] = value
+
+    def __delitem__(self, key):
+        if key in self.envelope:
+            # the envelope is shared, detach the document from it
+            self.body = dict(self)
+            self.envelope = _EMPTY
+        del self.body[key]
+
+    def __iter__(self) -> Iterator[str]:
+        for key in self.envelope:
+            if key not in self.body:
+                yield key
+        yield from self.body
+
+    def __len__(self):
+        return len(self.envelope) + sum(1 for key in self.body if key not in self.envelope)
+
+    def __contains__(self, key):
+        return key in self.body or key in self.envelope
+
+    def __repr__(self):
+        return "EnvelopeDocument(%r)" % dict(self)
+
+    def copy(self) -> "EnvelopeDocument":
+        return EnvelopeDocument(self.envelope, dict(self.body))
+
+    def to_json(self, serializer: JSONSerializer) -> str:
+        """Serialize the document, reusing the serialized envelope."""
+        if any(key in self.envelope for key in self.body):
+            return serializer.dumps(dict(self))
+        fragment = self.envelope.fragment(serializer)
+        body = serializer.dumps(self.body)
+        if not fragment:
+            return body
+        if body == "{}":
+            return "{" + fragment + "}"
+        return "{" + fragment + "," + body[1:]
+
+
+_EMPTY = Envelope()
+
+
+def json_default(obj: Any) -> Any:
+    """``default`` hook for json.dumps handling envelope documents, anything else is turned into a str."""
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    return str(obj)
+
+
+class EnvelopeSerializer(JSONSerializer):
+    """Elasticsearch serializer merging envelopes into documents, used for ES clients, archives and spools."""
+
+    def default(self, data):
+        if isinstance(data, Mapping):
+            return dict(data)
+        return super().default(data)
+
+    def dumps(self, data):
+        if isinstance(data, EnvelopeDocument):
+            return data.to_json(self)
+        if type(data) is dict and isinstance(data.get("_source"), EnvelopeDocument):
+            # bulk action holding an envelope document, e.g. in archives and spools
+            action = {key: value for key, value in data.items() if key != "_source"}
+            source = data["_source"].to_json(self)
+            if not action:
+                return '{"_source":' + source + "}"
+            return super().dumps(action)[:-1] + ',"_source":' + source + "}"
+        return super().dumps(data)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Registry of Elasticsearch clients shared by every bulk stream of a process.
+
+A client is created for each server and TLS settings the first time it is used, its connection is
+checked and the cluster info logged once. The results stream and the Prometheus streams sent to the same
+cluster then reuse the same client and connection pool, and streams to different clusters use their own
+clients. Clients must not be shared across processes, worker processes create their own with
+:py:func:`create_es_client`.
+"""
+import json
+import logging
+import ssl
+import threading
+from typing import Dict, Tuple
+
+import elasticsearch
+import urllib3
+
+from snafu.utils.envelope import EnvelopeSerializer
+
+logger = logging.getLogger("snafu")
+
+_clients: Dict[Tuple, elasticsearch.Elasticsearch] = {}
+_lock = threading.Lock()
+
+
+def _verify_cert(es_settings: Dict) -> bool:
+    return str(es_settings["verify_cert"]).lower() != "false"
+
+
+def create_es_client(es_settings: Dict, use_ssl: bool = False) -> elasticsearch.Elasticsearch:
+    """Create a new client of ``es_settings["server"]``, use_ssl only applies without certificate checks."""
+    if not _verify_cert(es_settings):
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        ssl_ctx = ssl.create_default_context()
+        ssl_ctx.check_hostname = False
+        ssl_ctx.verify_mode = ssl.CERT_NONE
+        return elasticsearch.Elasticsearch(
+            [es_settings["server"]],
+            send_get_body_as="POST",
+            ssl_context=ssl_ctx,
+            use_ssl=use_ssl,
+            serializer=EnvelopeSerializer(),
+        )
+    return elasticsearch.Elasticsearch(
+        [es_settings["server"]], send_get_body_as="POST", serializer=EnvelopeSerializer()
+    )
+
+
+def get_es_client(es_settings: Dict, use_ssl: bool = False) -> elasticsearch.Elasticsearch:
+    """
+    Return the shared client of a server and TLS settings, created on first use.
+
+    The connection of a new client is checked with ``info()``, whose exceptions are raised and leave no
+    client registered, so the next call tries again.
+    """
+    verify_cert = _verify_cert(es_settings)
+    key = (es_settings["server"], verify_cert, use_ssl and not verify_cert)
+    with _lock:
+        if key not in _clients:
+            es = create_es_client(es_settings, use_ssl)
+            info = es.info()
+            logger.info("Connected to the elasticsearch cluster with info as follows:")
+            logger.info(json.dumps(info, indent=4))
+            _clients[key] = es
+        return _clients[key]
+
+
+def close_es_clients():
+    """Close the connections of every registered client and empty the registry."""
+    with _lock:
+        for es in _clients.values():
+            es.close()
+        _clients.clear()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Canonical fingerprints of Elasticsearch documents, used as their ``_id``.
+
+Documents are encoded canonically (compact JSON with sorted keys, ``datetime`` objects in ISO 8601) so
+that their fingerprint does not depend on key insertion order, and the encoding is hashed with the 128-bit
+xxh3 hash when the ``xxhash`` package is installed, or with 128-bit blake2b otherwise. The two hashes give
+different ids, which only matters when the same documents are produced on hosts with and without xxhash.
+
+Run metadata shared by many documents (fio ``job_options``, ``global_options``, prometheus
+``test_config``...) is hashed once: the digest of the shared object is cached, keyed by its identity,
+and stands in for the object in the encoding of every document referencing it. The cache keeps a copy of
+the object, and a shared object that no longer compares equal to it, because it was modified, is hashed
+again.
+"""
+import copy
+import datetime
+import decimal
+import hashlib
+import json
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, Tuple
+
+try:
+    import xxhash
+
+    xxhash_imported = True
+except ImportError:
+    xxhash_imported = False
+
+# top level fields holding metadata shared by every document of a job or run
+SHARED_KEYS = ("job_options", "global_options", "test_config")
+# key standing in for a shared object in the canonical encoding
+_DIGEST_KEY = "\x00fingerprint"
+
+
+def _digest(data: bytes) -> str:
+    if xxhash_imported:
+        return xxhash.xxh3_128_hexdigest(data)
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj, key=repr)
+    return str(obj)
+
+
+def _stringify_keys(obj: Any) -> Any:
+    # json cannot sort keys of mixed types, compare them as strings instead
+    if isinstance(obj, Mapping):
+        return {str(key): _stringify_keys(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_stringify_keys(value) for value in obj]
+    return obj
+
+
+_encoder = json.JSONEncoder(sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=_default)
+
+
+def canonical_encoding(obj: Any) -> bytes:
+    """Return the canonical encoding of a JSON-like object."""
+    try:
+        encoded = _encoder.encode(obj)
+    except TypeError:
+        encoded = _encoder.encode(_stringify_keys(obj))
+    return encoded.encode("utf-8", "surrogatepass")
+
+
+class Fingerprinter:
+    """
+    Compute fingerprints, caching the digests of shared sub-objects.
+
+    Parameters
+    ----------
+    shared_keys : iterable of str, optional
+        Top level fields whose mapping values are shared between documents. A shared object modified after
+        it was fingerprinted is hashed again, but only if it does not compare equal to its old value
+        (changing ``1`` to ``1.0`` keeps the old digest).
+    max_cached : int, optional
+        Maximum number of cached digests, the cache is cleared when it is full.
+    """
+
+    def __init__(self, shared_keys: Iterable[str] = SHARED_KEYS, max_cached: int = 4096):
+        self.shared_keys = tuple(shared_keys)
+        self.max_cached = max_cached
+        # id of the shared object -> (shared object, copy of it, digest), the reference keeps the id from
+        # being reused and the copy detects modifications of the object
+        self._cache: Dict[int, Tuple[Any, Any, str]] = {}
+
+    def _shared_digest(self, obj: Mapping) -> str:
+        cached = self._cache.get(id(obj))
+        if cached is not None and cached[0] is obj and cached[1] == obj:
+            return cached[2]
+        digest = _digest(canonical_encoding(obj))
+        if len(self._cache) >= self.max_cached:
+            self._cache.clear()
+        self._cache[id(obj)] = (obj, copy.deepcopy(obj), digest)
+        return digest
+
+    def fingerprint(self, document: Any) -> str:
+        """Return the 128-bit fingerprint of a document as a hex string."""
+        if isinstance(document, Mapping):
+            shared = None
+            for key in self.shared_keys:
+                value = document.get(key)
+                if isinstance(value, Mapping):
+                    if shared is None:
+                        shared = dict(document)
+                    shared[key] = {_DIGEST_KEY: self._shared_digest(value)}
+            if shared is not None:
+                document = shared
+        return _digest(canonical_encoding(document))
+
+
+_fingerprinter = Fingerprinter()
+
+
+def fingerprint(document: Any) -> str:
+    """Return the fingerprint of a document, sharing digests of shared sub-objects for the whole run."""
+    return _fingerprinter.fingerprint(document)
@@ -2,20 +2,104 @@ import json
 import logging
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from distutils.util import strtobool
 
+import numpy as np
 import urllib3
 from prometheus_api_client import PrometheusConnect
+from requests.adapters import HTTPAdapter
+
+from snafu.utils.envelope import Envelope, EnvelopeDocument
+from snafu.utils.parallel import ordered_map
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 logger = logging.getLogger("snafu")
 
+# prometheus rejects range queries returning more points per series
+MAX_POINTS_PER_QUERY = 11000
+ROLLUP_PERCENTILES = (50, 95, 99)
+
+
+def plan_query_ranges(
+    start, end, min_step=30, target_points=10000, fixed_step=None, max_points=MAX_POINTS_PER_QUERY
+):
+    """
+    Choose the step in seconds of the range queries of [start, end] in epoch seconds, the smallest
+    step giving at most about target_points points per series and not below min_step unless fixed_step
+    is given. The window is then split on that step, chosen or fixed, in consecutive sub-ranges of at
+    most max_points points, each sub-range starting where the previous one ends. A chosen step only
+    needs splitting when target_points (prom_points) is above max_points. Returns
+    (step, [(start, end), ...])
+    """
+    window = max(0, end - start)
+    if fixed_step:
+        step = int(fixed_step)
+    else:
+        step = max(int(min_step), -(-window // target_points))
+    span = (max_points - 1) * step
+    ranges = [(range_start, min(end, range_start + span)) for range_start in range(start, end, span)]
+    return step, ranges or [(start, end)]
+
+
+def stitch_series(responses):
+    """
+    Merge the series returned by the consecutive sub-ranges of a query, a timestamp returned by two
+    sub-ranges is kept once
+    """
+    stitched = {}
+    for response in responses:
+        for result in response:
+            series = stitched.setdefault(
+                tuple(sorted(result["metric"].items())), {"metric": result["metric"], "values": []}
+            )
+            values = series["values"]
+            if values:
+                last = values[-1][0]
+                values.extend(value for value in result["values"] if value[0] > last)
+            else:
+                values.extend(result["values"])
+    return list(stitched.values())
+
+
+def rollup_series(values):
+    """
+    Summarize the [timestamp, value] points of a series: number of points, first and last timestamp
+    in ms, min, max, mean, percentiles and integral over time (trapezoidal, value x seconds). NaN and
+    infinite values are left out, the statistics are None when no value is left
+    """
+    points = np.array(values, dtype=float).reshape(-1, 2)
+    points = points[np.isfinite(points[:, 1])]
+    summary = {"samples": len(points)}
+    fields = ["timestamp_start", "timestamp_end", "min", "max", "mean"]
+    fields += ["p%d" % percentile for percentile in ROLLUP_PERCENTILES] + ["integral"]
+    if not len(points):
+        summary.update(dict.fromkeys(fields))
+        return summary
+    timestamps, series = points[:, 0], points[:, 1]
+    summary.update(
+        {
+            "timestamp_start": int(timestamps[0] * 1000),
+            "timestamp_end": int(timestamps[-1] * 1000),
+            "min": float(series.min()),
+            "max": float(series.max()),
+            "mean": float(series.mean()),
+            "integral": float(((series[1:] + series[:-1]) / 2 * np.diff(timestamps)).sum()),
+        }
+    )
+    for percentile, value in zip(ROLLUP_PERCENTILES, np.percentile(series, ROLLUP_PERCENTILES)):
+        summary["p%d" % percentile] = float(value)
+    return summary
+
 
 class get_prometheus_data:
-    def __init__(self, action):
+    def __init__(self, action, cache=None):
 
         self.sample_info_dict = action
+        # PromQueryCache of query results, queries found in it are not sent to prometheus
+        self.cache = cache
         self.uuid = action["uuid"]
         self.user = action["user"]
         self.cluster_name = action["cluster_name"]
@@ -29,13 +113,25 @@ class get_prometheus_data:
         endtime = datetime.fromtimestamp(int(self.sample_info_dict["endtime"]))
         self.end = endtime
 
-        # step value to be used in prometheus query
-        # default is 30 seconds(openshift default scraping interval)
-        # but can be overridden with env
-        if "prom_step" in os.environ:
-            self.T_Delta = os.environ["prom_step"]
-        else:
-            self.T_Delta = 30
+        # step value to be used in prometheus query, by default the step is chosen from the length
+        # of the sample to get about prom_points points per series and is at least 30 seconds
+        # (openshift default scraping interval), a fixed step can be set with env
+        self.T_Delta = os.environ.get("prom_step")
+        self.target_points = int(os.environ.get("prom_points", 10000))
+        self.step, self.ranges = plan_query_ranges(
+            int(self.sample_info_dict["starttime"]),
+            int(self.sample_info_dict["endtime"]),
+            target_points=self.target_points,
+            fixed_step=self.T_Delta,
+        )
+
+        # index one prometheus_rollup summary per series instead of one document per point, the points
+        # are still indexed as prometheus_data with prom_raw_points
+        self.rollup = strtobool(os.environ.get("prom_rollup", "false"))
+        self.raw_points = not self.rollup or strtobool(os.environ.get("prom_raw_points", "false"))
+
+        # number of prometheus queries running at the same time, can be overridden with env
+        self.parallelism = max(1, int(os.environ.get("prom_parallelism", 4)))
 
         self.get_data = False
         if "prom_token" in os.environ and "prom_url" in os.environ:
@@ -45,17 +141,56 @@ class get_prometheus_data:
             bearer = "Bearer " + token
             self.headers = {"Authorization": bearer}
             self.pc = PrometheusConnect(url=self.url, headers=self.headers, disable_ssl=True)
+            # the queries share the session of the client, keep a connection per concurrent query
+            retry = self.pc._session.get_adapter(self.url).max_retries
+            self.pc._session.mount(self.url, HTTPAdapter(max_retries=retry, pool_maxsize=self.parallelism))
         else:
             logger.warn(
                 """snafu service account token and prometheus url not set \n
                         No Prometheus data will be indexed"""
             )
 
+    def _query_range(self, metric_name, query, start, end):
+        """
+        Execute a custom query to pull the desired labels between start and end time in epoch seconds,
+        returns the list of series, empty if the query failed
+        """
+        step = str(self.step) + "s"
+        query_start = time.time()
+        key = (self.url, query, start, end, step)
+        if self.cache is not None:
+            response = self.cache.get(key)
+            if response is not None:
+                logger.info(
+                    "prometheus query %s returned %d series from cache" % (metric_name, len(response))
+                )
+                return response
+        try:
+            response = self.pc.custom_query_range(
+                query, datetime.fromtimestamp(start), datetime.fromtimestamp(end), step, None
+            )
+            if self.cache is not None:
+                self.cache.put(key, response)
+        except Exception as e:
+            response = []
+            logger.info(query)
+            logger.warning("failure to get metric results %s" % e)
+        logger.info(
+            "prometheus query %s returned %d series in %.3f seconds"
+            % (metric_name, len(response), time.time() - query_start)
+        )
+        return response
+
     def get_all_metrics(self):
+        """
+        Query every metric of the include file of the tool and yield (document, index) of each point
+        and/or of the rollup of each series
+        """
 
         # check get_data bool, if false by-pass all processing
         if self.get_data:
             start_time = time.time()
+            envelope = Envelope(self.sample_info_dict)
 
             # resolve directory  the tool include file
             dirname = os.path.dirname(os.path.realpath(__file__))
@@ -74,22 +209,26 @@ class get_prometheus_data:
             with open(filename) as f:
                 datastore = json.load(f)
 
-            for metric_name in datastore["data"]:
-
-                query_item = datastore["data"][metric_name]
-                query = query_item["query"]
-                label = query_item["label"]
-
-                step = str(self.T_Delta) + "s"
-                try:
-                    # Execute custom query to pull the desired labels between X and Y time.
-                    response = self.pc.custom_query_range(query, self.start, self.end, step, None)
+            logger.info(
+                "querying prometheus with a step of %ss in %d range(s)" % (self.step, len(self.ranges))
+            )
+            # queries of every sub-range run in a bounded thread pool, responses are handled in the
+            # order of the include file
+            metric_names = list(datastore["data"])
+            responses = ordered_map(
+                self._query_range,
+                (
+                    (metric_name, datastore["data"][metric_name]["query"], range_start, range_end)
+                    for metric_name in metric_names
+                    for range_start, range_end in self.ranges
+                ),
+                workers=self.parallelism,
+                executor_class=ThreadPoolExecutor,
+            )
+            for metric_name in metric_names:
 
-                except Exception as e:
-                    # response undefined at this point, we want to skip next for loop
-                    response = []
-                    logger.info(query)
-                    logger.warn("failure to get metric results %s" % e)
+                label = datastore["data"][metric_name]["label"]
+                response = stitch_series([next(responses) for _ in self.ranges])
 
                 for result in response:
                     # clean up name key from __name__ to name
@@ -99,6 +238,20 @@ class get_prometheus_data:
                         del result["metric"]["__name__"]
                     else:
                         result["metric"]["name"] = label
+                    if self.rollup:
+                        rollup_doc = {
+                            "metric": result["metric"],
+                            "metric_name": metric_name,
+                            "step": self.step,
+                        }
+                        rollup_doc.update(rollup_series(result["values"]))
+                        if result["values"]:
+                            rollup_doc["Date"] = datetime.utcfromtimestamp(result["values"][0][0]).strftime(
+                                "%Y-%m-%dT%H:%M:%S.%fZ"
+                            )
+                        yield EnvelopeDocument(envelope, rollup_doc), "prometheus_rollup"
+                    if not self.raw_points:
+                        continue
                     # each result has a list, we must flatten it out in order to send to ES
                     for value in result["values"]:
                         # fist index is time stamp
@@ -116,7 +269,7 @@ class get_prometheus_data:
                             "metric_name": metric_name,
                         }
 
-                        flat_doc.update(self.sample_info_dict)
-                        yield flat_doc
+                        # sample info is shared by every data point and merged in at serialization
+                        yield EnvelopeDocument(envelope, flat_doc), "prometheus_data"
 
             logger.debug("Total Time --- %s seconds ---" % (time.time() - start_time))
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Producer/consumer pipeline decoupling benchmark execution from Elasticsearch indexing.
+
+Documents produced by a benchmark are placed on a bounded in-memory queue which is drained by an
+independent indexing thread running :py:func:`snafu.utils.py_es_bulk.streaming_bulk`. When the queue is
+full, documents are spilled to disk instead of blocking the benchmark, so a slow cluster (or the bulk
+helper's retry backoff) can never stall the benchmark between samples.
+"""
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from snafu.utils.envelope import EnvelopeSerializer
+from snafu.utils.py_es_bulk import streaming_bulk
+
+logger = logging.getLogger("snafu")
+
+# marks the end of the document stream on the in-memory queue
+_END_OF_STREAM = object()
+# how long the indexing thread waits on an empty queue before checking for spilled documents
+_POLL_INTERVAL = 0.1
+# spilled documents are serialized the same way the elasticsearch client would serialize them
+_serializer = EnvelopeSerializer()
+
+
+class IndexingPipeline:
+    """
+    Bounded producer/consumer pipeline feeding an Elasticsearch bulk indexer.
+
+    Call :py:meth:`start` once, :py:meth:`put` for every document and :py:meth:`close` to perform the
+    final drain, which returns the usual ``streaming_bulk`` result tuple.
+
+    Parameters
+    ----------
+    es : elasticsearch.Elasticsearch
+        Client used by the indexing thread.
+    queue_depth : int, optional
+        Maximum number of documents held in memory before spilling to disk.
+    spill_dir : str, optional
+        Directory in which spill segments are created. Defaults to the system temporary directory.
+    bulk_kwargs
+        Extra kwargs passed through to :py:func:`~snafu.utils.py_es_bulk.streaming_bulk`.
+    """
+
+    def __init__(self, es, queue_depth: int = 10000, spill_dir: Optional[str] = None, **bulk_kwargs):
+        if queue_depth < 1:
+            raise ValueError(f"Pipeline queue depth must be a positive integer, got {queue_depth}")
+        self.es = es
+        self.queue_depth = queue_depth
+        self.spill_dir = spill_dir
+        self.bulk_kwargs = bulk_kwargs
+        self.stats: Dict[str, Any] = {
+            "produced": 0,
+            "spilled": 0,
+            "spill_segments": 0,
+            "max_queue_depth": 0,
+        }
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=queue_depth)
+        self._spill_lock = threading.Lock()
+        self._spill_file = None
+        self._spill_path: Optional[str] = None
+        self._ready_segments: List[str] = []
+        self._thread: Optional[threading.Thread] = None
+        self._result: Optional[Tuple[float, float, int, int, int, int]] = None
+        self._error: Optional[BaseException] = None
+        # set once the indexing thread has taken the end of stream marker off the queue
+        self._ended = False
+
+    def start(self):
+        """Start the indexing thread."""
+        self._thread = threading.Thread(target=self._index, name="snafu-indexer", daemon=True)
+        self._thread.start()
+
+    def put(self, document: Dict[str, Any]):
+        """Hand a document to the indexer, spilling it to disk if the in-memory queue is full."""
+        if self._error is not None:
+            raise RuntimeError("Indexing thread failed") from self._error
+        self.stats["produced"] += 1
+        try:
+            self._queue.put_nowait(document)
+        except queue.Full:
+            self._spill(document)
+        else:
+            depth = self._queue.qsize()
+            if depth > self.stats["max_queue_depth"]:
+                self.stats["max_queue_depth"] = depth
+
+    def feed(self, documents: Iterable[Dict[str, Any]]):
+        """Convenience wrapper calling :py:meth:`put` for every document in the given iterable."""
+        for document in documents:
+            self.put(document)
+
+    def close(self) -> Tuple[float, float, int, int, int, int]:
+        """
+        Wait for the indexing thread to drain the queue and any spilled documents.
+
+        Returns
+        -------
+        tuple
+            ``(beg, end, successes, duplicates, failures, retries)`` as returned by ``streaming_bulk``.
+        """
+        drain_start = time.time()
+        self._queue.put(_END_OF_STREAM)
+        self._thread.join()
+        self.stats["drain_seconds"] = round(time.time() - drain_start, 3)
+        if self._error is not None:
+            raise RuntimeError("Indexing thread failed") from self._error
+        return self._result
+
+    def _index(self):
+        try:
+            self._result = streaming_bulk(self.es, self._drain(), **self.bulk_kwargs)
+        except BaseException as err:  # pylint: disable=W0703
+            logger.error("Indexing thread caused an exception: %s" % err)
+            self._error = err
+            # keep consuming so that the producer never blocks on a dead consumer
+            self._discard()
+
+    def _discard(self):
+        while not self._ended and self._queue.get() is not _END_OF_STREAM:
+            pass
+        self._ended = True
+        for segment in self._rotate_spill():
+            os.remove(segment)
+
+    def _drain(self) -> Iterator[Dict[str, Any]]:
+        while True:
+            try:
+                document = self._queue.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                # the benchmark is idle, use the time to catch up on spilled documents
+                for segment in self._rotate_spill():
+                    yield from self._read_segment(segment)
+                continue
+            if document is _END_OF_STREAM:
+                self._ended = True
+                for segment in self._rotate_spill():
+                    yield from self._read_segment(segment)
+                return
+            yield document
+
+    def _spill(self, document: Dict[str, Any]):
+        with self._spill_lock:
+            if self._spill_file is None:
+                fd, self._spill_path = tempfile.mkstemp(
+                    prefix="snafu-spill-", suffix=".ndjson", dir=self.spill_dir
+                )
+                self._spill_file = os.fdopen(fd, "w")
+                self.stats["spill_segments"] += 1
+            self._spill_file.write(_serializer.dumps(document))
+            self._spill_file.write("\n")
+            self.stats["spilled"] += 1
+
+    def _rotate_spill(self) -> List[str]:
+        # close the segment currently being written so it can be read back, the producer will
+        # lazily open a new one the next time the queue overflows
+        with self._spill_lock:
+            if self._spill_file is not None:
+                self._spill_file.close()
+                self._ready_segments.append(self._spill_path)
+                self._spill_file = None
+                self._spill_path = None
+            segments, self._ready_segments = self._ready_segments, []
+        return segments
+
+    @staticmethod
+    def _read_segment(segment: str) -> Iterator[Dict[str, Any]]:
+        logger.debug("Indexing documents spilled to %s" % segment)
+        with open(segment) as spill_file:
+            for line in spill_file:
+                yield json.loads(line)
+        os.remove(segment)
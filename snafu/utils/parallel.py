@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""Ordered parallel map over a process or thread pool with a bounded window of pending tasks."""
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, Optional, Type
+
+
+def ordered_map(
+    fn: Callable[..., Any],
+    args: Iterable[Any],
+    workers: int = 1,
+    window: Optional[int] = None,
+    executor_class: Type[Executor] = ProcessPoolExecutor,
+) -> Iterator[Any]:
+    """
+    Yield ``fn(*arg)`` for every tuple of ``args``, in order, computed by ``workers`` processes.
+
+    At most ``window`` tasks (twice the number of workers by default) are pending at any time, so the
+    results are consumed while the next ones are computed without holding every result in memory.
+    ``fn`` must be a module level function. Exceptions raised by ``fn`` are raised when its result is
+    reached. With a single worker, results are computed in this process. I/O bound tasks can run in
+    threads with ``executor_class=ThreadPoolExecutor``, ``fn`` may then be any callable.
+
+    >>> list(ordered_map(pow, [(2, 3), (3, 2)]))
+    [8, 9]
+    """
+    if workers is None or workers <= 1:
+        for arg in args:
+            yield fn(*arg)
+        return
+    window = window or 2 * workers
+    args = iter(args)
+    with executor_class(max_workers=workers) as executor:
+        pending: deque = deque()
+        for arg in args:
+            pending.append(executor.submit(fn, *arg))
+            if len(pending) >= window:
+                break
+        while pending:
+            result = pending.popleft().result()
+            for arg in args:
+                pending.append(executor.submit(fn, *arg))
+                break
+            yield result
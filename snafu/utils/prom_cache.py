@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Content addressed on-disk cache of Prometheus range query results.
+
+Every result is stored in a gzip compressed JSON file named after the SHA-256 digest of its key
+``(prom_url, query, start, end, step)``, so processing the same sample window again (a failed indexing
+attempt, an archive created again) reads the results from disk instead of querying Prometheus. The size
+of the cache is bounded and the least recently used entries are evicted first, recency is kept across
+runs in the modification time of the files.
+
+The entries used by a run can be packaged next to its archive file: the package is itself a cache
+directory, which can be passed back with ``--prom-cache-dir`` to export the same windows again without
+any Prometheus query.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional, Set, Tuple
+
+logger = logging.getLogger("snafu")
+
+_SUFFIX = ".json.gz"
+
+
+def cache_key(prom_url: str, query: str, start: int, end: int, step: str) -> str:
+    """Return the SHA-256 hex digest identifying a range query."""
+    key = json.dumps([prom_url, query, int(start), int(end), str(step)])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class PromQueryCache:
+    """
+    Size bounded LRU cache of Prometheus range query results, safe to use from several threads.
+
+    Parameters
+    ----------
+    directory : str
+        Cache directory, created if it does not exist. Entries left by previous runs are kept.
+    max_bytes : int, optional
+        Disk budget of the cache, least recently used entries are removed to stay below it.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 1024**3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # digest -> size of the entry, least recently used first
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        # digests of the entries read or written by this run
+        self._used: Set[str] = set()
+        existing = []
+        for name in os.listdir(directory):
+            if name.endswith(_SUFFIX):
+                stat = os.stat(os.path.join(directory, name))
+                existing.append((stat.st_mtime, name[: -len(_SUFFIX)], stat.st_size))
+        for _, digest, size in sorted(existing):
+            self._entries[digest] = size
+        self._bytes = sum(self._entries.values())
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest + _SUFFIX)
+
+    def get(self, key: Tuple) -> Optional[List[Any]]:
+        """Return the cached result of a ``(prom_url, query, start, end, step)`` query, None on a miss."""
+        digest = cache_key(*key)
+        with self._lock:
+            if digest not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+        path = self._path(digest)
+        try:
+            with gzip.open(path, "rt") as entry:
+                result = json.load(entry)
+            os.utime(path)
+        except (OSError, ValueError) as e:
+            logger.warning("Discarding unreadable prometheus cache entry %s: %s" % (path, e))
+            with self._lock:
+                self.misses += 1
+                self._remove(digest)
+            return None
+        with self._lock:
+            self.hits += 1
+            self._used.add(digest)
+        return result
+
+    def put(self, key: Tuple, result: List[Any]):
+        """Store the result of a ``(prom_url, query, start, end, step)`` query."""
+        digest = cache_key(*key)
+        path = self._path(digest)
+        tmp_path = "%s.%d.tmp" % (path, threading.get_ident())
+        with gzip.open(tmp_path, "wt") as entry:
+            json.dump(result, entry)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._bytes += size - self._entries.pop(digest, 0)
+            self._entries[digest] = size
+            self._used.add(digest)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, digest: str):
+        # must be called with the lock held
+        self._bytes -= self._entries.pop(digest, 0)
+        self._used.discard(digest)
+        try:
+            os.remove(self._path(digest))
+        except FileNotFoundError:
+            pass
+
+    def package(self, directory: str) -> int:
+        """Copy the entries used by this run into a cache directory, returns the number of entries."""
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            used = sorted(self._used)
+        copied = 0
+        for digest in used:
+            try:
+                shutil.copy2(self._path(digest), os.path.join(directory, digest + _SUFFIX))
+            except FileNotFoundError:
+                continue
+            copied += 1
+        return copied
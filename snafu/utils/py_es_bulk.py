@@ -2,6 +2,12 @@
 Opinionated methods for interfacing with Elasticsearch. We provide two
 such opinions for creating templates (put_template()) and bulk indexing
 (streaming_bulk).
+
+Bulk indexing can use one of the following engines:
+    streaming - single threaded elasticsearch.helpers.streaming_bulk
+    parallel - thread based elasticsearch.helpers.parallel_bulk
+    async - asyncio based engine keeping several bulk requests in flight,
+            see snafu.utils.async_es_bulk
 """
 
 import json
@@ -15,6 +21,8 @@ from elasticsearch import VERSION as es_VERSION
 from elasticsearch import exceptions as es_excs
 from elasticsearch import helpers
 
+from snafu.utils.envelope import json_default
+
 _es_logger = "elasticsearch"
 
 logger = logging.getLogger("snafu")
@@ -34,6 +42,8 @@ _op_type = "create"
 # can add undue burden to the Elasticsearch cluster.
 
 _request_timeout = 100000 * 60.0
+# Supported bulk indexing engines
+BULK_ENGINES = ("streaming", "parallel", "async")
 
 
 def _tstos(ts=None):
@@ -92,17 +102,47 @@ def put_template(es, name, body):
     return beg, end, retry_count
 
 
-def streaming_bulk(es, actions, parallel=False):
+def get_bulk_engine(engine=None, parallel=False):
+    """
+    Resolve the bulk indexing engine to use. An explicitly requested engine
+    wins, otherwise the legacy parallel flag selects between the streaming
+    and parallel engines.
+    """
+    if not engine:
+        return "parallel" if parallel else "streaming"
+    if engine not in BULK_ENGINES:
+        raise ValueError("Unknown bulk engine %s, expected one of %s" % (engine, ", ".join(BULK_ENGINES)))
+    return engine
+
+
+def streaming_bulk(es, actions, parallel=False, engine=None, concurrency=None, controller=None, spool=None):
     """
     streaming_bulk(es, actions)
     Arguments:
         es - An Elasticsearch client object already constructed
         actions - An iterable for the documents to be indexed
+        parallel - Use the parallel engine when no engine is given
+        engine - One of BULK_ENGINES, overrides parallel
+        concurrency - Number of bulk requests kept in flight by the async engine
+        controller - Optional AdaptiveBulkController driving chunk size and
+                     concurrency, only honored by the async engine
+        spool - Optional snafu.utils.spool.Spool recording every document
+                before it is sent and committing it once acknowledged
     Returns:
         A tuple with the start and end times, the # of successfully indexed,
         duplicate, and failed documents, along with number of times a bulk
         request was retried.
     """
+    engine = get_bulk_engine(engine, parallel)
+    if engine == "async":
+        # imported here as the async engine builds on the helpers of this module
+        from snafu.utils.async_es_bulk import DEFAULT_CONCURRENCY, async_streaming_bulk
+
+        return async_streaming_bulk(
+            es, actions, concurrency=concurrency or DEFAULT_CONCURRENCY, controller=controller, spool=spool
+        )
+    if controller is not None:
+        logger.warning("Adaptive bulk control is only supported by the async engine, using fixed settings")
 
     # These need to be defined before the closure below. These work because
     # a closure remembers the binding of a name to an object. If integer
@@ -120,6 +160,8 @@ def streaming_bulk(es, actions, parallel=False):
             assert "_index" in cl_action
             assert _op_type == cl_action["_op_type"]
 
+            if spool is not None:
+                spool.record(cl_action)
             actions_deque.append((0, cl_action))  # Append to the right side ...
             yield cl_action
             # if after yielding an action some actions appear on the retry deque
@@ -150,7 +192,7 @@ def streaming_bulk(es, actions, parallel=False):
     # Create the generator that closes over the external generator, "actions"
     generator = actions_tracking_closure(actions)
 
-    if parallel:
+    if engine == "parallel":
         logger.info("Using parallel bulk indexer")
         streaming_bulk_generator = helpers.parallel_bulk(
             es,
@@ -185,8 +227,12 @@ def streaming_bulk(es, actions, parallel=False):
             assert action["_id"] == resp["_id"]
         if ok:
             successes += 1
+            if spool is not None:
+                spool.commit(action["_id"])
         else:
             if status == 409:
+                if spool is not None:
+                    spool.commit(action["_id"])
                 if retry_count == 0:
                     # Only count duplicates if the retry count is 0 ...
                     duplicates += 1
@@ -201,9 +247,11 @@ def streaming_bulk(es, actions, parallel=False):
                     "retry_count": retry_count,
                     "timestamp": _tstos(time.time()),
                 }
-                jsonstr = json.dumps(doc, indent=4, sort_keys=True, default=str)
+                jsonstr = json.dumps(doc, indent=4, sort_keys=True, default=json_default)
                 print(jsonstr)
                 # errorsfp.flush()
+                if spool is not None:
+                    spool.dead_letter(action, resp, retry_count)
                 failures += 1
             else:
                 # Retry all other errors
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Durable, segment based spool (write-ahead log) for documents sent to Elasticsearch.
+
+Every document is recorded in the current segment before it is sent, and its ``_id`` is appended to the
+segment's commit log once Elasticsearch acknowledges it (or reports it as a duplicate). Documents rejected
+with a 400 are moved to a dead-letter segment instead of being retried forever. After a crash or an
+outage, :py:meth:`Spool.uncommitted` yields only the documents which were never acknowledged so they can
+be replayed with ``run_snafu --tool spool-replay --spool-dir <dir>``.
+"""
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Iterator, Optional
+
+from snafu.utils.envelope import EnvelopeSerializer, json_default
+
+logger = logging.getLogger("snafu")
+
+_SEGMENT_PREFIX = "segment-"
+_SEGMENT_SUFFIX = ".ndjson"
+_COMMIT_SUFFIX = ".commits"
+DEAD_LETTER_FILE = "dead-letter.ndjson"
+
+# documents are spooled the same way the elasticsearch client would serialize them
+_serializer = EnvelopeSerializer()
+
+
+class Spool:
+    """
+    Segment based write-ahead log of Elasticsearch documents.
+
+    Parameters
+    ----------
+    directory : str
+        Spool directory, created if it does not exist. Segments left by a previous run are kept.
+    max_bytes : int, optional
+        Disk budget for the spool. Documents which would exceed it are still indexed but not spooled.
+    segment_bytes : int, optional
+        Size after which a new segment is started. Fully committed segments are deleted.
+    """
+
+    def __init__(self, directory: str, max_bytes: Optional[int] = None, segment_bytes: int = 64 * 1024**2):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.counts: Counter = Counter()
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # segment sequence number of every recorded but not yet committed document
+        self._pending: Dict[str, int] = {}
+        # number of uncommitted documents per segment
+        self._outstanding: Counter = Counter()
+        self._commit_files: Dict[int, Any] = {}
+        self._segment_file = None
+        self._segment_size = 0
+        self._over_budget = False
+        # segment currently being replayed, it must not be removed while it is read
+        self._replaying: Optional[int] = None
+        existing = self._segments()
+        self._seq = existing[-1] + 1 if existing else 0
+        self._bytes = sum(
+            os.path.getsize(os.path.join(directory, name))
+            for name in os.listdir(directory)
+            if os.path.isfile(os.path.join(directory, name))
+        )
+
+    def _path(self, seq: int, suffix: str) -> str:
+        return os.path.join(self.directory, "%s%08d%s" % (_SEGMENT_PREFIX, seq, suffix))
+
+    def _segments(self):
+        pattern = os.path.join(self.directory, _SEGMENT_PREFIX + "*" + _SEGMENT_SUFFIX)
+        start, end = len(_SEGMENT_PREFIX), -len(_SEGMENT_SUFFIX)
+        return sorted(int(os.path.basename(p)[start:end]) for p in glob.glob(pattern))
+
+    def _append(self, fileobj, line: str):
+        fileobj.write(line)
+        self._bytes += len(line)
+
+    def record(self, document: Dict[str, Any]):
+        """Record a document before it is sent, no-op for documents already in the spool."""
+        with self._lock:
+            if document["_id"] in self._pending:
+                return
+            line = _serializer.dumps(document) + "\n"
+            if self.max_bytes is not None and self._bytes + len(line) > self.max_bytes:
+                if not self._over_budget:
+                    logger.warning(
+                        "Spool %s exceeded its disk budget of %d bytes, new documents are not spooled"
+                        % (self.directory, self.max_bytes)
+                    )
+                    self._over_budget = True
+                self.counts["unspooled"] += 1
+                return
+            if self._segment_file is None or self._segment_size >= self.segment_bytes:
+                self._rotate()
+            self._append(self._segment_file, line)
+            self._segment_size += len(line)
+            self._pending[document["_id"]] = self._seq
+            self._outstanding[self._seq] += 1
+            self.counts["recorded"] += 1
+
+    def commit(self, doc_id: str):
+        """Mark a document as acknowledged by Elasticsearch."""
+        with self._lock:
+            seq = self._pending.pop(doc_id, None)
+            if seq is None:
+                return
+            if seq not in self._commit_files:
+                # line buffered so that acknowledgements survive a crash of the wrapper
+                self._commit_files[seq] = open(self._path(seq, _COMMIT_SUFFIX), "a", buffering=1)
+            self._append(self._commit_files[seq], doc_id + "\n")
+            self._outstanding[seq] -= 1
+            self.counts["committed"] += 1
+            if self._outstanding[seq] == 0 and seq not in (self._seq, self._replaying):
+                self._remove(seq)
+
+    def dead_letter(self, action: Dict[str, Any], resp: Any, retry_count: int = 0):
+        """Move a document Elasticsearch refused (400) to the dead-letter segment."""
+        doc = {"action": action, "resp": resp, "retry_count": retry_count, "timestamp": time.time()}
+        with self._lock:
+            with open(os.path.join(self.directory, DEAD_LETTER_FILE), "a") as dead_letter_file:
+                self._append(dead_letter_file, json.dumps(doc, sort_keys=True, default=json_default) + "\n")
+            self.counts["dead_letter"] += 1
+        self.commit(action["_id"])
+
+    def uncommitted(self) -> Iterator[Dict[str, Any]]:
+        """Yield every spooled document which was never committed, oldest segment first."""
+        for seq in self._segments():
+            if seq == self._seq and self._segment_file is not None:
+                continue
+            self._replaying = seq
+            committed = set()
+            if os.path.exists(self._path(seq, _COMMIT_SUFFIX)):
+                with open(self._path(seq, _COMMIT_SUFFIX)) as commit_file:
+                    committed = {line.strip() for line in commit_file}
+            with open(self._path(seq, _SEGMENT_SUFFIX)) as segment_file:
+                for line in segment_file:
+                    document = json.loads(line)
+                    if document["_id"] in committed:
+                        continue
+                    with self._lock:
+                        if document["_id"] in self._pending:
+                            continue
+                        self._pending[document["_id"]] = seq
+                        self._outstanding[seq] += 1
+                    yield document
+            with self._lock:
+                self._replaying = None
+                if self._outstanding[seq] == 0:
+                    self._remove(seq)
+
+    def close(self):
+        """Close the spool, removing segments whose documents were all committed."""
+        with self._lock:
+            if self._segment_file is not None:
+                self._segment_file.close()
+                self._segment_file = None
+                if self._outstanding[self._seq] == 0:
+                    self._remove(self._seq)
+            for commit_file in self._commit_files.values():
+                commit_file.close()
+            self._commit_files = {}
+        logger.info(
+            "Spool %s - %d documents recorded, %d committed, %d dead-lettered, %d not spooled, "
+            "%d documents left to replay"
+            % (
+                self.directory,
+                self.counts["recorded"],
+                self.counts["committed"],
+                self.counts["dead_letter"],
+                self.counts["unspooled"],
+                len(self._pending),
+            )
+        )
+
+    def _rotate(self):
+        if self._segment_file is not None:
+            self._segment_file.close()
+            if self._outstanding[self._seq] == 0:
+                self._remove(self._seq)
+            self._seq += 1
+        # line buffered so that recorded documents survive a crash of the wrapper
+        self._segment_file = open(self._path(self._seq, _SEGMENT_SUFFIX), "a", buffering=1)
+        self._segment_size = 0
+
+    def _remove(self, seq: int):
+        commit_file = self._commit_files.pop(seq, None)
+        if commit_file is not None:
+            commit_file.close()
+        for suffix in (_SEGMENT_SUFFIX, _COMMIT_SUFFIX):
+            path = self._path(seq, suffix)
+            if os.path.exists(path):
+                self._bytes -= os.path.getsize(path)
+                os.remove(path)
+        self._outstanding.pop(seq, None)
+        self._over_budget = False
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""Test functionality in the archive module."""
+import json
+import time
+
+import pytest
+
+from snafu.utils.archive import (
+    FSYNC_POLICIES,
+    BackgroundArchiveWriter,
+    ChunkedArchiveWriter,
+    detect_archive_format,
+    iter_archive,
+    open_archive_writer,
+    read_archive_index,
+    read_frame,
+)
+
+
+def make_document(i):
+    return {"_index": "test", "_op_type": "create", "_id": str(i), "_source": {"sample": i}}
+
+
+def test_chunked_archive_round_trip(tmp_path):
+    """Test that frames are indexed in the footer and can be decoded independently."""
+
+    path = str(tmp_path / "test.archive")
+    writer = ChunkedArchiveWriter(path, frame_documents=4, codec="gzip")
+    for i in range(10):
+        writer.write(make_document(i))
+    writer.close()
+
+    assert detect_archive_format(path) == "chunked"
+    frames = read_archive_index(path)
+    assert [frame.documents for frame in frames] == [4, 4, 2]
+    assert [doc["_id"] for doc in read_frame(path, frames[1])] == ["4", "5", "6", "7"]
+    assert [doc["_source"]["sample"] for doc in iter_archive(path)] == list(range(10))
+
+
+def test_chunked_archive_append_and_missing_footer(tmp_path):
+    """Test that archives are appended to and that an archive without footer is still readable."""
+
+    path = str(tmp_path / "test.archive")
+    for start in (0, 5):
+        writer = open_archive_writer(path, "chunked")
+        writer.frame_documents = 2
+        for i in range(start, start + 5):
+            writer.write(make_document(i))
+        writer.close()
+    assert [doc["_id"] for doc in iter_archive(path)] == [str(i) for i in range(10)]
+
+    # simulate a crash of the writer, frames were written but the footer was not
+    writer = ChunkedArchiveWriter(str(tmp_path / "crashed.archive"), frame_documents=3, codec="gzip")
+    for i in range(7):
+        writer.write(make_document(i))
+    writer._file.close()
+    frames = read_archive_index(str(tmp_path / "crashed.archive"))
+    assert [frame.documents for frame in frames] == [3, 3]
+
+
+def test_archives_are_ndjson_by_default(tmp_path):
+    """Test that new archives are plain ndjson unless the chunked format is requested."""
+
+    path = str(tmp_path / "test.archive")
+    writer = open_archive_writer(path)
+    writer.write(make_document(0))
+    writer.close()
+    assert detect_archive_format(path) == "ndjson"
+    with open(path) as archive_file:
+        assert [json.loads(line)["_id"] for line in archive_file] == ["0"]
+
+
+def test_legacy_ndjson_archive(tmp_path):
+    """Test that existing ndjson archives keep their format when appended to."""
+
+    path = str(tmp_path / "legacy.archive")
+    with open(path, "w") as archive_file:
+        archive_file.write(json.dumps(make_document(0)) + "\n")
+    writer = open_archive_writer(path, "chunked")
+    writer.write(make_document(1))
+    writer.close()
+    assert detect_archive_format(path) == "ndjson"
+    assert [doc["_id"] for doc in iter_archive(path)] == ["0", "1"]
+
+
+@pytest.mark.parametrize("fsync", FSYNC_POLICIES)
+def test_background_writer_writes_every_document(tmp_path, fsync):
+    """Test that the background writer archives every queued document before close returns."""
+
+    path = str(tmp_path / "test.archive")
+    writer = BackgroundArchiveWriter(
+        ChunkedArchiveWriter(path, frame_documents=7), flush_interval=0.01, fsync=fsync
+    )
+    for i in range(100):
+        writer.write(make_document(i))
+    writer.close()
+    assert writer.stats["documents"] == 100
+    assert [doc["_id"] for doc in iter_archive(path)] == [str(i) for i in range(100)]
+
+
+def test_background_writer_reports_errors(tmp_path):
+    """Test that a failure of the writer thread is raised to the producer."""
+
+    class FailingWriter:
+        path = "failing"
+
+        def write(self, document):
+            raise IOError("disk full")
+
+        def close(self):
+            pass
+
+    writer = BackgroundArchiveWriter(FailingWriter(), queue_depth=1)
+    with pytest.raises(RuntimeError, match="disk full"):
+        for i in range(100):
+            writer.write(make_document(i))
+            time.sleep(0.001)
+        writer.close()
+
+
+def test_background_writer_reports_errors_of_the_last_batch(tmp_path):
+    """Test that close raises instead of hanging when syncing the batch ending the stream fails."""
+
+    class FailingFlushWriter:
+        path = "failing"
+        failing = False
+
+        def write(self, document):
+            pass
+
+        def flush(self, fsync=False):
+            if self.failing:
+                raise IOError("sync failed")
+
+        def close(self):
+            pass
+
+    writer = BackgroundArchiveWriter(FailingFlushWriter(), flush_interval=0.01, fsync="per-batch")
+    for i in range(3):
+        writer.write(make_document(i))
+    deadline = time.monotonic() + 5
+    while writer.stats["documents"] < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    writer.writer.failing = True
+    with pytest.raises(RuntimeError, match="sync failed"):
+        writer.close()
+
+
+@pytest.mark.parametrize("fsync", ["interval", "per-batch"])
+def test_background_writer_flushes_pending_frame(tmp_path, fsync):
+    """Test that flushed documents are on disk before a frame is full and without the footer."""
+
+    path = str(tmp_path / "test.archive")
+    writer = BackgroundArchiveWriter(ChunkedArchiveWriter(path), flush_interval=0.01, fsync=fsync)
+    for i in range(10):
+        writer.write(make_document(i))
+    deadline = time.monotonic() + 5
+    while writer.stats["documents"] < 10 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    flushes = writer.stats["flushes"]
+    while writer.stats["flushes"] <= flushes and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [doc["_id"] for doc in iter_archive(path)] == [str(i) for i in range(10)]
+    writer.close()
+    assert [doc["_id"] for doc in iter_archive(path)] == [str(i) for i in range(10)]
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Test functionality in the async_es_bulk module."""
+import json
+
+import pytest
+from elasticsearch.serializer import JSONSerializer
+
+import snafu.utils.async_es_bulk
+from snafu.utils import py_es_bulk
+from snafu.utils.bulk_controller import AdaptiveBulkController
+
+pytestmark = pytest.mark.skipif(
+    not snafu.utils.async_es_bulk.aiohttp_imported, reason="async engine requires aiohttp"
+)
+
+
+class FakeTransport:
+    serializer = JSONSerializer()
+
+
+class FakeEs:
+    transport = FakeTransport()
+
+
+class FakeAsyncClient:
+    """Answer bulk requests with the status stored in each document, succeeding on retries."""
+
+    def __init__(self):
+        self.requests = 0
+        self.seen = set()
+
+    async def bulk(self, body, request_timeout=None):
+        self.requests += 1
+        lines = body.splitlines()
+        items = []
+        for meta, source in zip(lines[::2], lines[1::2]):
+            _id = json.loads(meta)["create"]["_id"]
+            status = json.loads(source)["status"]
+            if status in (429, 503) and _id in self.seen:
+                status = 201
+            self.seen.add(_id)
+            items.append({"create": {"_id": _id, "status": status}})
+        return {"items": items}
+
+    async def close(self):
+        pass
+
+
+def make_action(_id, status):
+    return {"_index": "test", "_op_type": "create", "_id": str(_id), "_source": {"status": status}}
+
+
+def test_async_streaming_bulk_keeps_streaming_bulk_semantics(monkeypatch):
+    """Test that successes, duplicates, failures and retries are accounted like streaming_bulk."""
+
+    client = FakeAsyncClient()
+    monkeypatch.setattr(snafu.utils.async_es_bulk, "_async_client_from", lambda es, concurrency: client)
+    monkeypatch.setattr(py_es_bulk, "_calc_backoff_sleep", lambda backoff: 0)
+
+    statuses = [201] * 10 + [409] * 3 + [400] * 2 + [503] * 4
+    actions = (make_action(i, status) for i, status in enumerate(statuses))
+    beg, end, successes, duplicates, failures, retries = snafu.utils.async_es_bulk.async_streaming_bulk(
+        FakeEs(), actions, concurrency=3, chunk_size=4
+    )
+
+    assert beg <= end
+    # retried documents eventually succeed and count as successes
+    assert successes == 14
+    assert duplicates == 3
+    assert failures == 2
+    assert retries > 0
+    assert client.requests == 5 + retries
+
+
+def test_async_streaming_bulk_reports_rejections_to_controller(monkeypatch):
+    """Test that 429 rejections are retried and make the adaptive controller back off."""
+
+    client = FakeAsyncClient()
+    monkeypatch.setattr(snafu.utils.async_es_bulk, "_async_client_from", lambda es, concurrency: client)
+    monkeypatch.setattr(py_es_bulk, "_calc_backoff_sleep", lambda backoff: 0)
+    controller = AdaptiveBulkController(chunk_size=100, concurrency=4, min_chunk_size=10)
+
+    actions = (make_action(i, 429 if i == 0 else 201) for i in range(300))
+    _, _, successes, duplicates, failures, retries = snafu.utils.async_es_bulk.async_streaming_bulk(
+        FakeEs(), actions, controller=controller
+    )
+
+    assert (successes, duplicates, failures) == (300, 0, 0)
+    assert retries == 1
+    summary = controller.summary()
+    assert summary["rejected"] == 1
+    assert summary["decreases"] == 1
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Test functionality in the bulk_controller module."""
+from snafu.utils.bulk_controller import AdaptiveBulkController
+
+
+def test_controller_grows_additively_when_healthy():
+    """Test that healthy requests grow chunk size and concurrency once per round trip."""
+
+    controller = AdaptiveBulkController(chunk_size=500, concurrency=2, chunk_step=100, target_latency=1.0)
+    controller.record(controller.epoch, 0.1, 500)
+    assert (controller.chunk_size, controller.concurrency) == (500, 2)
+    controller.record(controller.epoch, 0.1, 500)
+    assert (controller.chunk_size, controller.concurrency) == (600, 3)
+
+
+def test_controller_backs_off_once_per_congestion_event():
+    """Test that rejections halve the settings, but in-flight requests from an old epoch don't."""
+
+    controller = AdaptiveBulkController(chunk_size=800, concurrency=8)
+    epoch = controller.epoch
+    controller.record(epoch, 0.1, 800, rejected=10)
+    assert (controller.chunk_size, controller.concurrency) == (400, 4)
+    # these were sent before the decrease, they must not shrink the settings again
+    controller.record(epoch, 0.1, 800, rejected=10)
+    controller.record(epoch, 0.1, 800, rejected=10)
+    assert (controller.chunk_size, controller.concurrency) == (400, 4)
+
+    controller.record(controller.epoch, 0.1, 400, rejected=1)
+    assert (controller.chunk_size, controller.concurrency) == (200, 2)
+
+
+def test_controller_backs_off_on_latency_and_error_rate():
+    """Test that slow requests and high per-item error rates are treated as congestion."""
+
+    controller = AdaptiveBulkController(chunk_size=400, concurrency=4, target_latency=2.0, max_error_rate=0.1)
+    controller.record(controller.epoch, 3.0, 400)
+    assert controller.summary()["decreases"] == 1
+    controller.record(controller.epoch, 0.5, 200, errors=50)
+    summary = controller.summary()
+    assert summary["decreases"] == 2
+    assert summary["final_chunk_size"] == 100
+    assert summary["final_concurrency"] == 1
+    assert [d["action"] for d in summary["last_decisions"]] == ["decrease", "decrease"]
+
+
+def test_controller_respects_bounds():
+    """Test that chunk size and concurrency stay within the configured bounds."""
+
+    controller = AdaptiveBulkController(
+        chunk_size=100, concurrency=1, min_chunk_size=60, max_chunk_size=150, max_concurrency=2
+    )
+    for _ in range(10):
+        controller.record(controller.epoch, 0.1, 100)
+    assert (controller.chunk_size, controller.concurrency) == (150, 2)
+    for _ in range(10):
+        controller.record(controller.epoch, 0.1, 100, rejected=1)
+    assert (controller.chunk_size, controller.concurrency) == (60, 1)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""Test functionality in the envelope module."""
+import datetime
+import json
+
+from elasticsearch.serializer import JSONSerializer
+
+from snafu.utils.envelope import Envelope, EnvelopeDocument, EnvelopeSerializer
+from snafu.utils.fingerprint import fingerprint
+
+
+def make_documents():
+    fields = {"uuid": "abc", "user": "snafu", "job_options": {"bs": "4k"}, "date": datetime.date(2021, 1, 1)}
+    envelope = Envelope(fields)
+    bodies = [{"timestamp": i, "lat": i * 10} for i in range(3)]
+    return fields, envelope, bodies
+
+
+def test_envelope_documents_serialize_like_plain_documents():
+    """Test that envelope documents are indexed exactly like the documents they replace."""
+
+    fields, envelope, bodies = make_documents()
+    serializer = EnvelopeSerializer()
+    for body in bodies:
+        document = EnvelopeDocument(envelope, dict(body))
+        plain = dict(fields, **body)
+        assert document == plain
+        assert json.loads(serializer.dumps(document)) == json.loads(JSONSerializer().dumps(plain))
+        action = {"_index": "test", "_id": fingerprint(document), "_source": document}
+        assert json.loads(serializer.dumps(action))["_source"] == json.loads(JSONSerializer().dumps(plain))
+        assert fingerprint(document) == fingerprint(plain)
+    # the envelope is only serialized once
+    assert len(envelope._fragments) == 1
+
+
+def test_envelope_document_writes_never_reach_the_envelope():
+    """Test that modifying a document leaves the shared envelope and other documents untouched."""
+
+    fields, envelope, bodies = make_documents()
+    first = EnvelopeDocument(envelope, dict(bodies[0]))
+    second = EnvelopeDocument(envelope, dict(bodies[1]))
+    first["run_id"] = "NA"
+    first["user"] = "someone"
+    del first["uuid"]
+    assert "uuid" not in first and first["user"] == "someone" and first["run_id"] == "NA"
+    assert dict(second) == dict(fields, **bodies[1])
+    assert dict(envelope) == fields
+    assert json.loads(EnvelopeSerializer().dumps(first))["user"] == "someone"
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Test functionality in the es_clients module."""
+import pytest
+
+from snafu.utils import es_clients
+
+
+class FakeElasticsearch:
+    created = []
+
+    def __init__(self, hosts, **kwargs):
+        self.hosts = hosts
+        self.kwargs = kwargs
+        self.info_calls = 0
+        self.closed = False
+        self.created.append(self)
+
+    def info(self):
+        self.info_calls += 1
+        if "down" in self.hosts[0]:
+            raise ConnectionError("connection refused")
+        return {"cluster_name": self.hosts[0]}
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_es(monkeypatch):
+    monkeypatch.setattr(es_clients.elasticsearch, "Elasticsearch", FakeElasticsearch)
+    monkeypatch.setattr(FakeElasticsearch, "created", [])
+    yield FakeElasticsearch
+    es_clients.close_es_clients()
+
+
+def test_get_es_client_is_shared_per_server_and_tls_settings(fake_es):
+    """Test that one client is created and checked per server and TLS settings."""
+
+    results = es_clients.get_es_client({"server": "https://es:9200", "verify_cert": "true"})
+    prometheus = es_clients.get_es_client({"server": "https://es:9200", "verify_cert": "true"}, use_ssl=True)
+    assert prometheus is results
+    assert results.info_calls == 1
+    insecure = es_clients.get_es_client({"server": "https://es:443", "verify_cert": "false"}, use_ssl=True)
+    assert insecure is es_clients.get_es_client(
+        {"server": "https://es:443", "verify_cert": "False"}, use_ssl=True
+    )
+    assert insecure is not es_clients.get_es_client({"server": "https://es:443", "verify_cert": "false"})
+    other = es_clients.get_es_client({"server": "https://other:9200", "verify_cert": "true"})
+    assert other is not results
+    assert len(fake_es.created) == 4
+
+    es_clients.close_es_clients()
+    assert all(es.closed for es in fake_es.created)
+    assert es_clients.get_es_client({"server": "https://es:9200", "verify_cert": "true"}) is not results
+
+
+def test_get_es_client_failed_connection_is_not_registered(fake_es):
+    """Test that a client whose connection check fails is created again on the next call."""
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            es_clients.get_es_client({"server": "https://down:9200", "verify_cert": "true"})
+    assert len(fake_es.created) == 2
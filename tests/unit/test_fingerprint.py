@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""Test functionality in the fingerprint module."""
+import datetime
+
+from snafu.utils.fingerprint import Fingerprinter, canonical_encoding, fingerprint
+
+
+def test_fingerprint_ignores_key_order():
+    """Test that documents differing only in key order share a fingerprint."""
+
+    timestamp = datetime.datetime(2021, 1, 1, 12, 0, 0)
+    first = {"uuid": "abc", "sample": 1, "date": timestamp, "job_options": {"bs": "4k", "rw": "read"}}
+    second = {"job_options": {"rw": "read", "bs": "4k"}, "date": timestamp, "sample": 1, "uuid": "abc"}
+    assert fingerprint(first) == fingerprint(second)
+    assert len(fingerprint(first)) == 32
+    assert fingerprint(first) != fingerprint(dict(first, sample=2))
+    assert fingerprint(first) != fingerprint(dict(first, job_options={"bs": "8k", "rw": "read"}))
+
+
+def test_shared_objects_are_hashed_once(monkeypatch):
+    """Test that the digest of a shared sub-object is reused and gives the same result as a copy."""
+
+    job_options = {"bs": "4k", "rw": "randread", "iodepth": "16"}
+    encoded = []
+
+    def counting_encoding(obj):
+        encoded.append(obj)
+        return canonical_encoding(obj)
+
+    monkeypatch.setattr("snafu.utils.fingerprint.canonical_encoding", counting_encoding)
+    fingerprinter = Fingerprinter()
+    ids = [fingerprinter.fingerprint({"lat": i, "job_options": job_options}) for i in range(100)]
+    assert len(set(ids)) == 100
+    assert sum(obj is job_options for obj in encoded) == 1
+    assert fingerprinter.fingerprint({"lat": 0, "job_options": dict(job_options)}) == ids[0]
+
+
+def test_modified_shared_objects_are_hashed_again():
+    """Test that modifying a shared object between two documents changes their fingerprints."""
+
+    job_options = {"bs": "4k", "rw": "randread", "nested": {"iodepth": "16"}}
+    fingerprinter = Fingerprinter()
+    first = fingerprinter.fingerprint({"lat": 0, "job_options": job_options})
+    job_options["bs"] = "8k"
+    second = fingerprinter.fingerprint({"lat": 0, "job_options": job_options})
+    job_options["nested"]["iodepth"] = "32"
+    third = fingerprinter.fingerprint({"lat": 0, "job_options": job_options})
+    assert len({first, second, third}) == 3
+    assert third == Fingerprinter().fingerprint({"lat": 0, "job_options": job_options})
+
+
+def test_canonical_encoding_handles_mixed_keys():
+    """Test that mappings with keys of different types can still be encoded."""
+
+    assert canonical_encoding({1: "a", "b": 2}) == b'{"1":"a","b":2}'
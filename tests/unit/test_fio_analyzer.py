@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Test functionality in the fio_analyzer module."""
+import pytest
+
+from snafu.fio_wrapper.fio_analyzer import Fio_Analyzer
+
+
+def result_document(sample, rw, iops, hostname="a", lat=1000.0):
+    direction = {"iops": iops, "bw": iops * 4, "total_ios": iops * 10, "lat_ns": {"mean": lat}}
+    return {
+        "sample": sample,
+        "global_options": {"bs": "4k"},
+        "fio": {
+            "jobname": "job",
+            "hostname": hostname,
+            "job options": {"rw": rw},
+            "read": direction if "read" in rw else {"iops": 0, "bw": 0, "total_ios": 0},
+            "write": {"iops": 0, "bw": 0, "total_ios": 0},
+        },
+    }
+
+
+def test_analyzer_statistics_across_samples():
+    """Test that hosts are summed per sample and statistics are computed across samples."""
+
+    analyzer = Fio_Analyzer("uuid", "user", "cluster")
+    for sample, iops in ((1, 100.0), (2, 110.0), (3, 120.0)):
+        documents = [
+            result_document(sample, "randread", iops, "a", lat=1000.0),
+            result_document(sample, "randread", iops, "b", lat=3000.0),
+            {"sample": sample, "fio": {"jobname": "All clients"}},
+        ]
+        analyzer.add_fio_result_documents(documents, 1600000000000 + sample)
+    analyzer.add_fio_result_documents([result_document(1, "randwrite", 0)], 1600000000000)
+
+    documents = list(analyzer.emit_actions())
+    assert [index for _, index in documents] == ["analyzed-result"] * 2
+    assert documents[0][0] is not documents[1][0]
+    read, write = (document["ceph_benchmark_test"]["test_data"] for document, _ in documents)
+    assert documents[0][0]["date"] == "2020-09-13T12:26:40.000Z"
+
+    assert read["samples"] == 3
+    assert read["read-iops"] == read["total-iops"] == 220.0
+    assert read["std-dev-4k"] == 9.091
+    iops = read["statistics"]["read-iops"]
+    assert (iops["min"], iops["max"], iops["stdev"]) == (200.0, 240.0, 20.0)
+    assert iops["cv"] == pytest.approx(9.0909, rel=1e-4)
+    # t(0.975, 2) = 4.303
+    assert iops["ci_high"] - iops["mean"] == pytest.approx(4.303 * 20.0 / 3**0.5, rel=1e-3)
+    assert read["statistics"]["read-lat-mean-ns"]["mean"] == 2000.0
+    assert read["statistics"]["read-bw"]["mean"] == 880.0
+
+    assert write["samples"] == 1
+    assert write["statistics"]["write-iops"]["ci_low"] is None
+    assert "std-dev-4k" not in write
+
+
+def test_analyzer_job_block_size_overrides_global():
+    """Test that a job with its own bs is grouped under it rather than under the global bs."""
+
+    analyzer = Fio_Analyzer("uuid", "user", "cluster")
+    document = result_document(1, "randread", 100.0)
+    document["fio"]["job options"]["bs"] = "64k"
+    analyzer.add_fio_result_documents([document, result_document(1, "randread", 100.0, "b")], 1600000000000)
+    assert sorted(analyzer.groups) == [("randread", "4k"), ("randread", "64k")]
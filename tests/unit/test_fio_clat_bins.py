@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""Test functionality in the fio_clat_bins module."""
+from snafu.fio_wrapper.fio_clat_bins import ClatHistogram, pop_clat_histograms
+
+
+def client_stats():
+    return [
+        {"jobname": "randrw", "hostname": "a", "read": {"clat_ns": {"bins": {"1000": 90, "5000": 10}}}},
+        {"jobname": "randrw", "hostname": "b", "read": {"clat_ns": {"bins": {"2000": 50, "9000": 50}}}},
+        {"jobname": "seq", "hostname": "a", "read": {"clat_ns": {"bins": {"2000": 100}}}, "write": {}},
+        {"jobname": "All clients", "read": {"clat_ns": {"bins": {"1000": 90, "2000": 150}}}},
+    ]
+
+
+def test_pop_clat_histograms_merges_clients():
+    """Test that bins are merged per job and direction and removed from the client stats."""
+
+    stats = client_stats()
+    histograms = pop_clat_histograms(stats)
+    assert sorted(histograms) == [("randrw", "read"), ("seq", "read")]
+    assert all("bins" not in result["read"]["clat_ns"] for result in stats)
+    randrw = histograms[("randrw", "read")]
+    assert (randrw.sources, randrw.samples) == (2, 200)
+    assert randrw.values.tolist() == [1000, 2000, 5000, 9000]
+    assert randrw.counts.tolist() == [90, 50, 10, 50]
+    # the p99 of the clients are 5000 and 9000, the p99 of their I/Os is 9000, the median is 2000
+    assert randrw.percentiles([0, 50, 90, 99, 100]).tolist() == [1000, 2000, 9000, 9000, 9000]
+    assert randrw.mean() == (1000 * 90 + 2000 * 50 + 5000 * 10 + 9000 * 50) / 200
+
+
+def test_clat_histogram_update():
+    """Test that histograms of several jobs are merged into one."""
+
+    histograms = pop_clat_histograms(client_stats())
+    merged = ClatHistogram()
+    for histogram in histograms.values():
+        merged.update(histogram)
+    assert (merged.sources, merged.samples) == (3, 300)
+    assert merged.values.tolist() == [1000, 2000, 5000, 9000]
+    assert merged.counts.tolist() == [90, 150, 10, 50]
+    assert merged.percentiles([50.0, 99.9]).tolist() == [2000, 9000]
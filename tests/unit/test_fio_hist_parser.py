@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""Test functionality in the fio_hist_parser module."""
+import random
+
+import numpy as np
+import pytest
+
+from snafu.fio_wrapper import fio_hist_parser
+
+BUCKETS = 29 * 64
+
+
+def write_hist_logs(tmp_path, hosts=3, records=20):
+    rng = random.Random(42)
+    file_list = []
+    for host in range(hosts):
+        path = str(tmp_path / ("hist.1.log.host%d" % host))
+        file_list.append(path)
+        timestamp = 1600000000000
+        with open(path, "w") as hist_log:
+            for record in range(records):
+                # every thread starts logging at the same time, then intervals drift
+                timestamp += rng.choice([900, 1000, 1100, 2500]) if record else 1000
+                for direction in (0, 1):
+                    buckets = [0] * BUCKETS
+                    for _ in range(50):
+                        buckets[rng.randint(0, 600)] += rng.randint(0, 3)
+                    hist_log.write(
+                        "%d, %d, 4096, %s\n" % (timestamp, direction, ", ".join(map(str, buckets)))
+                    )
+    return file_list
+
+
+def read_csv(path):
+    with open(path) as csv_file:
+        return [[float(value) if value.strip() else None for value in line.split(", ")] for line in csv_file]
+
+
+@pytest.mark.parametrize("time_quantum", [1, 2])
+def test_numpy_engine_matches_pure_python(tmp_path, time_quantum):
+    """Test that the NumPy engine computes the same percentiles as the pure Python implementation."""
+
+    file_list = write_hist_logs(tmp_path)
+    python_csv, numpy_csv = str(tmp_path / "python.csv"), str(tmp_path / "numpy.csv")
+    fio_hist_parser.compute_percentiles_from_logs(
+        python_csv, file_list, log_hist_msec=1000, time_quantum=time_quantum
+    )
+    msec, samples, pctiles = fio_hist_parser.compute_percentiles_from_logs_numpy(
+        file_list, output_csv_file=numpy_csv, log_hist_msec=1000, time_quantum=time_quantum
+    )
+    expected = read_csv(python_csv)
+    assert len(expected) == len(read_csv(numpy_csv)) == len(msec)
+    for row, csv_row, t, n, p in zip(expected, read_csv(numpy_csv), msec, samples, pctiles):
+        assert csv_row == pytest.approx(row)
+        assert (t, int(n)) == (row[0], row[1])
+        if row[2] is None:
+            assert np.isnan(p).all()
+        else:
+            assert p == pytest.approx(row[2:])
+
+
+def test_numpy_engine_reports_invalid_logs(tmp_path):
+    """Test that invalid histogram logs raise the same errors as the pure Python parser."""
+
+    path = str(tmp_path / "bad.log")
+    with open(path, "w") as hist_log:
+        hist_log.write("100, 2, 4096, 1, 2, 3, 4\n")
+    with pytest.raises(fio_hist_parser.FioHistoLogExc, match="invalid I/O direction"):
+        fio_hist_parser.load_hist_file(path, 4, None)
+    with open(path, "w") as hist_log:
+        hist_log.write("100, 1, 4096, 1, 2, 3, 4, 5\n200, 1, 4096, 1, 2, 3\n")
+    with pytest.raises(fio_hist_parser.FioHistoLogExc, match="buckets per interval"):
+        fio_hist_parser.load_hist_file(path, 4, None)
+
+
+@pytest.mark.parametrize("time_quantum", [1, 2])
+def test_streaming_engine_matches_numpy_engine(tmp_path, time_quantum):
+    """Test that streaming the logs gives the same rows and CSV as loading them whole."""
+
+    file_list = write_hist_logs(tmp_path, hosts=4, records=40)
+    numpy_csv, streaming_csv = str(tmp_path / "numpy.csv"), str(tmp_path / "streaming.csv")
+    msec, samples, pctiles = fio_hist_parser.compute_percentiles_from_logs_numpy(
+        file_list, output_csv_file=numpy_csv, log_hist_msec=1000, time_quantum=time_quantum
+    )
+    rows = list(
+        fio_hist_parser.stream_percentiles_from_logs(
+            file_list,
+            output_csv_file=streaming_csv,
+            log_hist_msec=1000,
+            time_quantum=time_quantum,
+            chunk_lines=7,
+        )
+    )
+    assert len(rows) == len(msec)
+    for (t, n, p), expected_t, expected_n, expected_p in zip(rows, msec, samples, pctiles):
+        assert t == expected_t
+        assert n == pytest.approx(expected_n)
+        np.testing.assert_allclose(p, expected_p)
+    for row, expected in zip(read_csv(streaming_csv), read_csv(numpy_csv)):
+        assert [value is None for value in row] == [value is None for value in expected]
+        assert [value for value in row if value is not None] == pytest.approx(
+            [value for value in expected if value is not None]
+        )
+
+
+def test_hist_file_bounds(tmp_path):
+    """Test that the start and end times are read from the head and the tail of a log."""
+
+    file_list = write_hist_logs(tmp_path, hosts=1, records=30)
+    _, start_time, end_time = fio_hist_parser.parse_hist_file(file_list[0], BUCKETS, None)
+    assert fio_hist_parser.hist_file_bounds(file_list[0], None, tail_bytes=100) == (start_time, end_time)
+    _, start_time, _ = fio_hist_parser.parse_hist_file(file_list[0], BUCKETS, 1000)
+    with open(file_list[0], "a") as hist_log:
+        hist_log.write("\n\n")
+    assert fio_hist_parser.hist_file_bounds(file_list[0], 1000) == (start_time, end_time)
+
+
+def test_engines_split_directions(tmp_path):
+    """Test that reads and writes are aggregated separately by both engines."""
+
+    file_list = write_hist_logs(tmp_path)
+    wanted = [0.0, 50.0, 99.0, 99.9, 99.99, 100.0]
+    msec, samples, _ = fio_hist_parser.compute_percentiles_from_logs_numpy(
+        file_list, log_hist_msec=1000, pctiles_wanted=wanted
+    )
+    split_msec, split_samples, split_pctiles = fio_hist_parser.compute_percentiles_from_logs_numpy(
+        file_list, log_hist_msec=1000, pctiles_wanted=wanted, by_direction=True
+    )
+    assert split_samples.shape == (len(msec), 2)
+    assert split_pctiles.shape == (len(msec), 2, len(wanted))
+    np.testing.assert_array_equal(split_msec, msec)
+    np.testing.assert_allclose(split_samples.sum(axis=1), samples)
+
+    rows = list(
+        fio_hist_parser.stream_percentiles_from_logs(
+            file_list, log_hist_msec=1000, pctiles_wanted=wanted, by_direction=True
+        )
+    )
+    for (t, n, p), expected_t, expected_n, expected_p in zip(rows, split_msec, split_samples, split_pctiles):
+        assert t == expected_t
+        np.testing.assert_allclose(n, expected_n)
+        np.testing.assert_allclose(p, expected_p)
+
+
+def test_get_pctiles_array_matches_get_pctiles():
+    """Test that the vectorized percentiles match get_pctiles for any percentile list."""
+
+    rng = np.random.RandomState(0)
+    histograms = rng.randint(0, 5, size=(6, BUCKETS)) * (rng.rand(6, BUCKETS) < 0.05)
+    histograms[2] = 0
+    wanted = [0.0, 25.0, 50.0, 90.0, 99.9, 99.99, 100.0]
+    bucket_times = fio_hist_parser.time_ranges(29, 64)
+    samples, pctiles = fio_hist_parser.get_pctiles_array(histograms, wanted, bucket_times)
+    for row, n, p in zip(histograms, samples, pctiles):
+        expected = fio_hist_parser.get_pctiles(row.tolist(), wanted, bucket_times)
+        assert n == row.sum()
+        if not expected:
+            assert np.isnan(p).all()
+        else:
+            assert p == pytest.approx([expected[w] for w in wanted])
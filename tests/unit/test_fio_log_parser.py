@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""Test functionality in the fio_log_parser module."""
+import numpy as np
+import pytest
+
+from snafu.fio_wrapper.fio_log_parser import (
+    DIRECTION,
+    TIME,
+    VALUE,
+    FioLogSummary,
+    FioLogWindows,
+    iter_fio_log,
+    log_chunk_ranges,
+    parse_fio_log_range,
+)
+
+
+def test_log_windows_span_chunks():
+    """Test that windows split across chunks are summarized once, like np.percentile over the window."""
+
+    rng = np.random.RandomState(1)
+    lines = 1000
+    columns = np.zeros((lines, 5), dtype=np.int64)
+    columns[:, TIME] = np.sort(rng.randint(0, 20000, size=lines))
+    columns[:, VALUE] = rng.randint(0, 1000, size=lines)
+    columns[:, DIRECTION] = rng.randint(0, 2, size=lines)
+    timestamps = columns[:, TIME] + 1600000000000
+
+    windows = FioLogWindows(1000, percentiles=(50, 99))
+    summaries = []
+    for begin in range(0, lines, 77):
+        end = begin + 77
+        summaries += windows.add(columns[begin:end], timestamps[begin:end])
+    summaries += windows.flush()
+
+    assert sum(summary["samples"] for summary in summaries) == lines
+    assert len({(s["timestamp"], s["data_direction"]) for s in summaries}) == len(summaries)
+    for summary in summaries:
+        selected = (timestamps // 1000 * 1000 == summary["timestamp"]) & (
+            columns[:, DIRECTION] == summary["data_direction"]
+        )
+        values = columns[selected, VALUE]
+        assert summary["samples"] == len(values)
+        assert (summary["min"], summary["max"]) == (values.min(), values.max())
+        assert summary["mean"] == pytest.approx(values.mean())
+        assert [summary["p50"], summary["p99"]] == pytest.approx(np.percentile(values, [50, 99]))
+
+
+def test_log_summary_is_close_to_numpy():
+    """Test that the bounded summary matches numpy exactly but for percentiles within 1/256 of the value."""
+
+    rng = np.random.RandomState(2)
+    lines = 5000
+    columns = np.zeros((lines, 5), dtype=np.int64)
+    columns[:, TIME] = np.arange(lines)
+    columns[:, VALUE] = rng.lognormal(12, 2, size=lines).astype(np.int64)
+    columns[:, DIRECTION] = rng.randint(0, 2, size=lines)
+    timestamps = columns[:, TIME] + 1600000000000
+
+    summary = FioLogSummary()
+    for chunk in np.array_split(np.arange(lines), 7):
+        summary.add(columns[chunk], timestamps[chunk])
+
+    summaries = list(summary.summaries())
+    assert [s["data_direction"] for s in summaries] == [0, 1]
+    for s in summaries:
+        values = columns[columns[:, DIRECTION] == s["data_direction"], VALUE]
+        assert s["samples"] == len(values)
+        assert (s["min"], s["max"]) == (values.min(), values.max())
+        assert s["mean"] == pytest.approx(values.mean())
+        assert s["stddev"] == pytest.approx(values.std())
+        expected = np.percentile(values, [50, 90, 95, 99])
+        assert [s["p50"], s["p90"], s["p95"], s["p99"]] == pytest.approx(expected, rel=1 / 256)
+
+
+def test_parse_fio_log_ranges_match_iter_fio_log(tmp_path):
+    """Test that byte ranges of whole lines parse to the same lines as reading the log in chunks."""
+
+    log_file_name = str(tmp_path / "fio_bw.1.log")
+    with open(log_file_name, "w") as log_file:
+        for i in range(500):
+            log_file.write("%d, %d, %d, 4096, %d\n" % (i * 10, i, i % 2, i * 4096))
+    ranges = log_chunk_ranges(log_file_name, chunk_bytes=100)
+    assert len(ranges) > 10
+    assert ranges[0][0] == 0 and ranges[-1][1] == (tmp_path / "fio_bw.1.log").stat().st_size
+    assert all(previous[1] == following[0] for previous, following in zip(ranges, ranges[1:]))
+    parsed = [parse_fio_log_range(log_file_name, 1000, start, end) for start, end in ranges]
+    ((columns, timestamps, dates),) = iter_fio_log(log_file_name, 1000)
+    assert np.array_equal(np.concatenate([chunk[0] for chunk in parsed]), columns)
+    assert np.array_equal(np.concatenate([chunk[1] for chunk in parsed]), timestamps)
+    assert sum((chunk[2] for chunk in parsed), []) == dates
+
+    open(log_file_name, "w").close()
+    assert log_chunk_ranges(log_file_name) == [(0, 0)]
+    assert len(parse_fio_log_range(log_file_name, 1000, 0, 0)[0]) == 0
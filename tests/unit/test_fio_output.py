@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""Test functionality in the fio_output module."""
+import io
+import json
+
+from snafu.fio_wrapper.fio_output import clean_fio_output, iter_json_blocks, read_fio_result
+
+
+def test_iter_json_blocks():
+    """Test that every pretty printed JSON object is yielded once complete, skipping other lines."""
+
+    first = json.dumps({"timestamp": 1, "client_stats": [{"jobname": "a", "read": {}}]}, indent=4)
+    second = json.dumps({"timestamp": 2, "nested": {"a": "}"}}, indent=4)
+    lines = ["fio: warning\n"] + [
+        line + "\n" for line in (first + "\n" + "host: connected\n" + second).split("\n")
+    ]
+    lines.append('{"compact": true}\n')
+    blocks = list(iter_json_blocks(lines))
+    assert [document for document, _ in blocks] == [json.loads(first), json.loads(second), {"compact": True}]
+    assert blocks[0][1] == first + "\n"
+
+
+def test_clean_fio_output(tmp_path):
+    """Test that lines printed before the JSON output are removed in place."""
+
+    path = str(tmp_path / "fio-result.json")
+    with open(path, "w") as output:
+        output.write('fio: something\nhostname<a>: "not json"\n{\n  "a": {"b": 1}\n}\n')
+    clean_fio_output(path)
+    with open(path) as output:
+        assert json.load(output) == {"a": {"b": 1}}
+
+
+def test_read_fio_result():
+    """Test that headers are read first and client_stats entries are decoded one at a time."""
+
+    result = {
+        "fio version": "fio-3.27",
+        "timestamp": 1600000000,
+        "global options": {"bs": "4k"},
+        "client_stats": [
+            {"jobname": "job", "hostname": "host%d" % i, "read": {"iops": 1.5 * i}} for i in range(5)
+        ],
+        "disk_util": [],
+    }
+    for text in (json.dumps(result, indent=4), json.dumps(result)):
+        headers, client_stats = read_fio_result(io.StringIO(text), chunk_size=7)
+        assert headers == {key: result[key] for key in ("fio version", "timestamp", "global options")}
+        assert list(client_stats) == result["client_stats"]
+
+    headers, client_stats = read_fio_result(io.StringIO('{"timestamp": 12345}'), chunk_size=3)
+    assert headers == {"timestamp": 12345}
+    assert list(client_stats) == []
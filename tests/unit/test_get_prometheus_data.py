@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""Test functionality in the get_prometheus_data module."""
+import inspect
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from snafu.utils.get_prometheus_data import (
+    MAX_POINTS_PER_QUERY,
+    get_prometheus_data,
+    plan_query_ranges,
+    rollup_series,
+    stitch_series,
+)
+from snafu.utils.prom_cache import PromQueryCache
+
+FIO_LABELS = "prometheus_labels/fio_included_labels.json"
+ACTION = {
+    "uuid": "abc",
+    "user": "snafu",
+    "cluster_name": "mycluster",
+    "test_config": {},
+    "starttime": "1600000000",
+    "endtime": "1600000600",
+    "sample": 1,
+    "tool": "fio",
+}
+
+
+def test_get_all_metrics_runs_queries_concurrently_in_order(monkeypatch):
+    """Test that queries overlap up to the parallelism limit and documents keep the include file order."""
+
+    monkeypatch.setenv("prom_token", "token")
+    monkeypatch.setenv("prom_url", "https://prometheus:9090")
+    monkeypatch.setenv("prom_parallelism", "3")
+    prometheus = get_prometheus_data(ACTION)
+    assert prometheus.pc._session.get_adapter(prometheus.url)._pool_maxsize == 3
+    lock = threading.Lock()
+    running = []
+    concurrency = []
+
+    def custom_query_range(query, start, end, step, params):
+        with lock:
+            running.append(query)
+            concurrency.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.remove(query)
+        if "node_memory" in query:
+            raise RuntimeError("query failed")
+        return [{"metric": {"__name__": query}, "values": [[1600000000, "1"], [1600000030, "NaN"]]}]
+
+    monkeypatch.setattr(prometheus.pc, "custom_query_range", custom_query_range)
+    documents = [dict(document) for document, _ in prometheus.get_all_metrics()]
+    assert max(concurrency) == 3
+
+    metric_names = []
+    for document in documents:
+        if not metric_names or metric_names[-1] != document["metric_name"]:
+            metric_names.append(document["metric_name"])
+    with open(os.path.join(os.path.dirname(inspect.getfile(get_prometheus_data)), FIO_LABELS)) as labels:
+        included = json.load(labels)["data"]
+    assert metric_names == [name for name, item in included.items() if "node_memory" not in item["query"]]
+    assert len(documents) == 2 * len(metric_names)
+    assert [document["value"] for document in documents[:2]] == [1.0, 0]
+    assert documents[0]["uuid"] == "abc"
+
+
+def test_plan_query_ranges():
+    """Test that the step follows the point budget and oversized windows are split at step boundaries."""
+
+    assert plan_query_ranges(0, 600) == (30, [(0, 600)])
+    # 10 days at 30s would be 28800 points per series
+    step, ranges = plan_query_ranges(0, 864000, target_points=10000)
+    assert (step, ranges) == (87, [(0, 864000)])
+    step, ranges = plan_query_ranges(0, 864000, fixed_step="30")
+    assert step == 30
+    assert ranges == [(0, 329970), (329970, 659940), (659940, 864000)]
+    assert all((end - start) // step + 1 <= MAX_POINTS_PER_QUERY for start, end in ranges)
+    # a chosen step is split the same way when the point budget is above the limit of a query
+    step, ranges = plan_query_ranges(0, 864000, target_points=25000)
+    assert step == 35
+    assert ranges == [(0, 384965), (384965, 769930), (769930, 864000)]
+    assert all((end - start) // step + 1 <= MAX_POINTS_PER_QUERY for start, end in ranges)
+    assert plan_query_ranges(100, 100) == (30, [(100, 100)])
+
+
+def test_stitch_series_drops_duplicate_timestamps():
+    """Test that series of consecutive sub-ranges are concatenated with shared timestamps kept once."""
+
+    responses = [
+        [{"metric": {"a": "1"}, "values": [[0, "1"], [30, "2"]]}],
+        [
+            {"metric": {"a": "2"}, "values": [[30, "5"]]},
+            {"metric": {"a": "1"}, "values": [[30, "2"], [60, "3"]]},
+        ],
+    ]
+    assert stitch_series(responses) == [
+        {"metric": {"a": "1"}, "values": [[0, "1"], [30, "2"], [60, "3"]]},
+        {"metric": {"a": "2"}, "values": [[30, "5"]]},
+    ]
+
+
+def test_get_all_metrics_stitches_sub_ranges(monkeypatch):
+    """Test that each query is split in sub-ranges whose series are stitched without duplicates."""
+
+    monkeypatch.setenv("prom_token", "token")
+    monkeypatch.setenv("prom_url", "https://prometheus:9090")
+    monkeypatch.setenv("prom_step", "30")
+    prometheus = get_prometheus_data(dict(ACTION, endtime=str(1600000000 + 864000)))
+    assert len(prometheus.ranges) == 3
+
+    def custom_query_range(query, start, end, step, params):
+        assert step == "30s"
+        start, end = int(start.timestamp()), int(end.timestamp())
+        return [{"metric": {"__name__": "up"}, "values": [[start, "1"], [end, "1"]]}]
+
+    monkeypatch.setattr(prometheus.pc, "custom_query_range", custom_query_range)
+    documents = [dict(document) for document, _ in prometheus.get_all_metrics()]
+    first_metric = [
+        document for document in documents if document["metric_name"] == documents[0]["metric_name"]
+    ]
+    assert len(first_metric) == 4
+    assert len({document["Date"] for document in first_metric}) == 4
+
+
+def test_get_all_metrics_reads_cached_results(tmp_path, monkeypatch):
+    """Test that a sample window processed again is read from the cache without querying prometheus."""
+
+    monkeypatch.setenv("prom_token", "token")
+    monkeypatch.setenv("prom_url", "https://prometheus:9090")
+    cache = PromQueryCache(str(tmp_path))
+    queries = []
+
+    def custom_query_range(query, start, end, step, params):
+        queries.append(query)
+        return [{"metric": {"__name__": "up"}, "values": [[1600000000, "1"]]}]
+
+    documents = []
+    for _ in range(2):
+        prometheus = get_prometheus_data(ACTION, cache=cache)
+        monkeypatch.setattr(prometheus.pc, "custom_query_range", custom_query_range)
+        documents.append([dict(document) for document, _ in prometheus.get_all_metrics()])
+    assert documents[0] == documents[1]
+    assert len(queries) == cache.misses == cache.hits > 0
+
+
+def test_rollup_series():
+    """Test the summary of a series, non finite values are left out."""
+
+    summary = rollup_series([[0, "1"], [30, "3"], [60, "NaN"], [90, "5"], [120, "+Inf"]])
+    assert summary == {
+        "samples": 3,
+        "timestamp_start": 0,
+        "timestamp_end": 90000,
+        "min": 1.0,
+        "max": 5.0,
+        "mean": 3.0,
+        "p50": 3.0,
+        "p95": 4.8,
+        "p99": pytest.approx(4.96),
+        "integral": 60 + 240,
+    }
+    assert rollup_series([[0, "NaN"]])["mean"] is None
+
+
+def test_get_all_metrics_rollup(monkeypatch):
+    """Test that rollup mode indexes one summary per series and raw points only when asked to."""
+
+    monkeypatch.setenv("prom_token", "token")
+    monkeypatch.setenv("prom_url", "https://prometheus:9090")
+    monkeypatch.setenv("prom_rollup", "true")
+
+    def custom_query_range(query, start, end, step, params):
+        return [
+            {"metric": {"__name__": "up", "node": node}, "values": [[1600000000, "1"], [1600000030, "2"]]}
+            for node in ("a", "b")
+        ]
+
+    for raw_points, indices in (
+        ("false", ["prometheus_rollup"] * 2),
+        ("true", ["prometheus_rollup", "prometheus_data", "prometheus_data"] * 2),
+    ):
+        monkeypatch.setenv("prom_raw_points", raw_points)
+        prometheus = get_prometheus_data(ACTION)
+        monkeypatch.setattr(prometheus.pc, "custom_query_range", custom_query_range)
+        documents = list(prometheus.get_all_metrics())
+        first_metric = documents[0][0]["metric_name"]
+        assert [index for document, index in documents if document["metric_name"] == first_metric] == indices
+    rollup = dict(documents[0][0])
+    assert rollup["metric"] == {"name": "up", "node": "a"}
+    assert (rollup["samples"], rollup["mean"], rollup["integral"], rollup["step"]) == (2, 1.5, 45.0, 30)
+    assert rollup["Date"] == "2020-09-13T12:26:40.000000Z"
+    assert rollup["uuid"] == "abc"
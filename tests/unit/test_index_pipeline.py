@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Test functionality in the index_pipeline module."""
+import os
+import threading
+
+import pytest
+
+import snafu.utils.index_pipeline
+
+
+def fake_bulk_factory(received, gate=None):
+    """Return a streaming_bulk replacement recording documents, optionally waiting on a gate first."""
+
+    def fake_streaming_bulk(es, actions, parallel=False):
+        if gate is not None:
+            gate.wait()
+        for action in actions:
+            received.append(action)
+        return 0, 1, len(received), 0, 0, 0
+
+    return fake_streaming_bulk
+
+
+def test_pipeline_delivers_every_document(monkeypatch):
+    """Test that all documents put on the pipeline reach the bulk indexer."""
+
+    received = []
+    monkeypatch.setattr(snafu.utils.index_pipeline, "streaming_bulk", fake_bulk_factory(received))
+    pipeline = snafu.utils.index_pipeline.IndexingPipeline(None, queue_depth=10)
+    pipeline.start()
+    pipeline.feed({"_id": str(i)} for i in range(100))
+    result = pipeline.close()
+
+    assert result[2] == 100
+    assert sorted(int(doc["_id"]) for doc in received) == list(range(100))
+    assert pipeline.stats["produced"] == 100
+
+
+def test_pipeline_spills_instead_of_blocking(monkeypatch, tmp_path):
+    """Test that a stalled indexer causes documents to be spilled to disk rather than blocking."""
+
+    received = []
+    gate = threading.Event()
+    monkeypatch.setattr(snafu.utils.index_pipeline, "streaming_bulk", fake_bulk_factory(received, gate))
+    pipeline = snafu.utils.index_pipeline.IndexingPipeline(None, queue_depth=5, spill_dir=str(tmp_path))
+    pipeline.start()
+    # the indexer is blocked on the gate, so this would hang forever without spilling
+    pipeline.feed({"_id": str(i), "value": i} for i in range(50))
+    assert pipeline.stats["spilled"] == 45
+    assert pipeline.stats["max_queue_depth"] == 5
+
+    gate.set()
+    pipeline.close()
+    assert sorted(doc["value"] for doc in received) == list(range(50))
+    # spill segments are removed once they have been indexed
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_pipeline_surfaces_indexer_errors(monkeypatch):
+    """Test that an exception raised by the indexer is raised again on close."""
+
+    def broken_streaming_bulk(es, actions, parallel=False):
+        raise ValueError("boom")
+
+    monkeypatch.setattr(snafu.utils.index_pipeline, "streaming_bulk", broken_streaming_bulk)
+    pipeline = snafu.utils.index_pipeline.IndexingPipeline(None, queue_depth=5)
+    pipeline.start()
+    with pytest.raises(RuntimeError):
+        pipeline.feed({"_id": str(i)} for i in range(50))
+        pipeline.close()
+
+
+def test_pipeline_surfaces_errors_after_the_last_document(monkeypatch):
+    """Test that close returns when the indexer fails after consuming the end of the stream."""
+
+    received = []
+
+    def failing_streaming_bulk(es, actions, parallel=False):
+        received.extend(actions)
+        raise ValueError("boom")
+
+    monkeypatch.setattr(snafu.utils.index_pipeline, "streaming_bulk", failing_streaming_bulk)
+    pipeline = snafu.utils.index_pipeline.IndexingPipeline(None, queue_depth=5)
+    pipeline.start()
+    pipeline.feed({"_id": str(i)} for i in range(3))
+    with pytest.raises(RuntimeError) as excinfo:
+        pipeline.close()
+    assert isinstance(excinfo.value.__cause__, ValueError)
+    assert len(received) == 3
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""Test functionality in the prom_cache module."""
+import os
+
+from snafu.utils.prom_cache import PromQueryCache
+
+KEY = ("https://prometheus:9090", "up", 1600000000, 1600000600, "30s")
+RESULT = [{"metric": {"__name__": "up"}, "values": [[1600000000, "1"]]}]
+
+
+def test_prom_cache_round_trip(tmp_path):
+    """Test that results are found by their key, in this run and in the next ones."""
+
+    cache = PromQueryCache(str(tmp_path))
+    assert cache.get(KEY) is None
+    cache.put(KEY, RESULT)
+    assert cache.get(KEY) == RESULT
+    assert cache.get(KEY[:3] + (1600000601, "30s")) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert PromQueryCache(str(tmp_path)).get(KEY) == RESULT
+
+
+def test_prom_cache_evicts_least_recently_used(tmp_path):
+    """Test that the least recently used entries are removed to stay within the disk budget."""
+
+    cache = PromQueryCache(str(tmp_path))
+    keys = [KEY[:2] + (start, start + 600, "30s") for start in range(3)]
+    for key in keys:
+        cache.put(key, RESULT * 20)
+    entry_size = os.path.getsize(os.path.join(str(tmp_path), os.listdir(str(tmp_path))[0]))
+    cache.max_bytes = 2 * entry_size + entry_size // 2
+    cache.get(keys[0])
+    cache.put(KEY, RESULT * 20)
+    assert len(os.listdir(str(tmp_path))) == 2
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[2]) is None
+    assert cache.get(keys[0]) == RESULT * 20
+
+
+def test_prom_cache_package(tmp_path):
+    """Test that only the entries used by the run are packaged, as a cache directory."""
+
+    PromQueryCache(str(tmp_path / "cache")).put(KEY[:2] + (0, 600, "30s"), RESULT)
+    cache = PromQueryCache(str(tmp_path / "cache"))
+    cache.put(KEY, RESULT)
+    package = str(tmp_path / "run.archive.prom-cache")
+    assert cache.package(package) == 1
+    packaged = PromQueryCache(package)
+    assert packaged.get(KEY) == RESULT
+    assert len(os.listdir(package)) == 1
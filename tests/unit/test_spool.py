@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Test functionality in the spool module."""
+import json
+import os
+
+from snafu.utils import py_es_bulk
+from snafu.utils.spool import DEAD_LETTER_FILE, Spool
+
+
+def make_action(_id, status=201):
+    return {"_index": "test", "_op_type": "create", "_id": str(_id), "_source": {"status": status}}
+
+
+def test_uncommitted_documents_survive_a_restart(tmp_path):
+    """Test that only documents which were never committed are replayed by a new spool instance."""
+
+    spool = Spool(str(tmp_path), segment_bytes=200)
+    for i in range(10):
+        spool.record(make_action(i))
+    for i in range(0, 10, 2):
+        spool.commit(str(i))
+    # simulate a crash, the spool is never closed
+    replay = Spool(str(tmp_path))
+    assert sorted(int(doc["_id"]) for doc in replay.uncommitted()) == [1, 3, 5, 7, 9]
+
+
+def test_committed_segments_are_removed(tmp_path):
+    """Test that segments are deleted once every document in them has been committed."""
+
+    spool = Spool(str(tmp_path), segment_bytes=200)
+    for i in range(10):
+        spool.record(make_action(i))
+    for i in range(10):
+        spool.commit(str(i))
+    spool.close()
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_replayed_documents_are_committed(tmp_path):
+    """Test that replaying a spool commits the documents and empties the spool."""
+
+    spool = Spool(str(tmp_path), segment_bytes=200)
+    for i in range(10):
+        spool.record(make_action(i))
+    spool.close()
+
+    replay = Spool(str(tmp_path))
+    for doc in replay.uncommitted():
+        # replaying must not record the document a second time
+        replay.record(doc)
+        replay.commit(doc["_id"])
+    replay.close()
+    assert list(Spool(str(tmp_path)).uncommitted()) == []
+
+
+def test_dead_letter_and_disk_budget(tmp_path):
+    """Test that 400s go to the dead-letter segment and the disk budget is honoured."""
+
+    spool = Spool(str(tmp_path), max_bytes=300)
+    for i in range(10):
+        spool.record(make_action(i))
+    assert spool.counts["recorded"] < 10
+    assert spool.counts["unspooled"] == 10 - spool.counts["recorded"]
+
+    spool.dead_letter(make_action(0), {"status": 400, "error": "mapper_parsing_exception"})
+    with open(os.path.join(str(tmp_path), DEAD_LETTER_FILE)) as dead_letter_file:
+        dead = [json.loads(line) for line in dead_letter_file]
+    assert [d["action"]["_id"] for d in dead] == ["0"]
+    assert "0" not in [doc["_id"] for doc in Spool(str(tmp_path)).uncommitted()]
+
+
+def test_streaming_bulk_commits_acknowledged_documents(monkeypatch, tmp_path):
+    """Test that streaming_bulk records every document and commits acknowledged and duplicate ones."""
+
+    def fake_helper(es, actions, **kwargs):
+        for action in actions:
+            status = action["_source"]["status"]
+            yield status == 201, {"create": {"_id": action["_id"], "status": status}}
+
+    monkeypatch.setattr(py_es_bulk.helpers, "streaming_bulk", fake_helper)
+    spool = Spool(str(tmp_path))
+    statuses = [201, 201, 409, 400]
+    _, _, successes, duplicates, failures, _ = py_es_bulk.streaming_bulk(
+        None, (make_action(i, status) for i, status in enumerate(statuses)), spool=spool
+    )
+    assert (successes, duplicates, failures) == (2, 1, 1)
+    assert spool.counts["recorded"] == 4
+    assert spool.counts["committed"] == 4
+    assert spool.counts["dead_letter"] == 1
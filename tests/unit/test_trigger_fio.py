@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""Test functionality in the trigger_fio module."""
+import inspect
+import itertools
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pytest
+
+from snafu.fio_wrapper.fio_analyzer import Fio_Analyzer
+from snafu.fio_wrapper.fio_clat_bins import pop_clat_histograms
+from snafu.fio_wrapper.trigger_fio import _trigger_fio
+from snafu.utils.archive import ArchiveOnly
+
+JOB_OPTIONS = {
+    "write_bw_log": "fio",
+    "write_iops_log": "fio",
+    "write_lat_log": "fio",
+    "numjobs": "2",
+    "filename_format": r"f.\$jobnum.\$filenum",
+}
+
+
+def make_trigger(tmp_path, **kwargs):
+    trigger = _trigger_fio(
+        fio_jobs=["job"],
+        cluster_name="mycluster",
+        working_dir=str(tmp_path),
+        fio_jobs_dict={"global": {"numjobs": "1"}, "job": JOB_OPTIONS},
+        host_file=None,
+        user="snafu",
+        uuid="abc",
+        sample=1,
+        fio_analyzer_obj=None,
+        **kwargs,
+    )
+    trigger.hosts = ["host1"]
+    trigger.fio_version = "fio-3.27"
+    return trigger
+
+
+def write_logs(tmp_path, lines):
+    for log in ("bw", "iops", "lat", "clat", "slat"):
+        for numjob in (1, 2):
+            with open(os.path.join(str(tmp_path), "fio_%s.%d.log.host1" % (log, numjob)), "w") as log_file:
+                for i in range(lines):
+                    log_file.write("%d, %d, %d, 4096, %d\n" % (i * 1000, 100 + i, i % 2, i * 4096))
+
+
+def test_log_payload_streams_documents(tmp_path):
+    """Test that log documents are yielded as log files are read, with the same fields as before."""
+
+    write_logs(tmp_path, 3)
+    trigger = make_trigger(tmp_path, log_progress=2)
+    documents = trigger._log_payload(str(tmp_path), {"host1": 1600000000000}, "job", None)
+    assert inspect.isgenerator(documents)
+
+    first, index = next(documents)
+    assert index == "log"
+    assert dict(first) == {
+        "uuid": "abc",
+        "user": "snafu",
+        "host": "host1",
+        "cluster_name": "mycluster",
+        "job_number": 1,
+        "fio-version": "fio-3.27",
+        "job_options": JOB_OPTIONS,
+        "job_name": "job",
+        "log_file": os.path.join(str(tmp_path), "fio_bw.1.log.host1"),
+        "sample": 1,
+        "log_name": "bw",
+        "timestamp": 1600000000000,
+        "date": "2020-09-13T12:26:40.000000Z",
+        "bandwidth": 100,
+        "data_direction": "read",
+        "block_size": 4096,
+        "offset": 0,
+        "global_options": {"numjobs": "1"},
+    }
+    indices = [index] + [index for _, index in documents]
+    # 5 logs, 2 jobs, 3 lines and a summary per direction
+    assert indices.count("log") == 30
+    assert indices.count("log-summary") == 20
+
+
+def test_log_payload_summaries_and_malformed_lines(tmp_path):
+    """Test that log-summary documents are computed per direction and incomplete lines are skipped."""
+
+    write_logs(tmp_path, 101)
+    with open(os.path.join(str(tmp_path), "fio_lat.1.log.host1"), "a") as log_file:
+        log_file.write("\n101000, 7, 0, 4096\n")
+    trigger = make_trigger(tmp_path)
+    summaries = [
+        document
+        for document, index in trigger._log_payload(str(tmp_path), {"host1": 1600000000000}, "job", None)
+        if index == "log-summary" and document["log_name"] == "lat" and document["job_number"] == 1
+    ]
+    assert [s["data_direction"] for s in summaries] == ["read", "write"]
+    read = summaries[0]
+    # values of even lines, 100, 102, ... 200
+    assert read["samples"] == 51
+    assert read["metric"] == "latency"
+    assert (read["min"], read["max"], read["mean"], read["p50"]) == (100, 200, 150.0, 150.0)
+    assert read["timestamp_start"] == 1600000000000
+    assert read["date"] == "2020-09-13T12:26:40.000000Z"
+
+
+def test_log_payload_workers_keep_serial_order(tmp_path):
+    """Test that parsing log files in worker processes yields the same documents in the same order."""
+
+    write_logs(tmp_path, 50)
+    start = {"host1": 1600000000000}
+    serial = make_trigger(tmp_path)._log_payload(str(tmp_path), start, "job", None)
+    parallel = make_trigger(tmp_path, workers=3)._log_payload(str(tmp_path), start, "job", None)
+    assert [(dict(d), i) for d, i in parallel] == [(dict(d), i) for d, i in serial]
+
+
+def test_histogram_payload_splits_directions(tmp_path):
+    """Test that clat_hist documents carry their data direction and the requested percentiles."""
+
+    trigger = make_trigger(tmp_path, histogram_percentiles=[0.0, 50.0, 99.9, 99.99, 100.0])
+    nan = float("nan")
+    rows = [
+        (1000, np.array([10.0, 0.0]), np.array([[1.0, 2.0, 3.0, 4.0, 5.0], [nan] * 5])),
+        (2000, np.array([10.0, 20.0]), np.array([[1.0, 2.0, 3.0, 4.0, 5.0], [6.0, 7.0, 8.0, 9.0, 10.0]])),
+    ]
+    documents = list(trigger._histogram_payload(rows, 1600000000000, "job"))
+    assert [(doc["timestamp"], doc["data_direction"]) for doc in documents] == [
+        (1600000001000, "read"),
+        (1600000002000, "read"),
+        (1600000002000, "write"),
+    ]
+    assert documents[2]["date"] == "2020-09-13T12:26:42.000000Z"
+    assert documents[2]["number_samples_histogram"] == 20
+    assert {key: documents[2][key] for key in ("min", "median", "p99_9", "p99_99", "max")} == {
+        "min": 6.0,
+        "median": 7.0,
+        "p99_9": 8.0,
+        "p99_99": 9.0,
+        "max": 10.0,
+    }
+    assert documents[2]["global_options"] == {"numjobs": "1"}
+
+
+def test_merged_latency_payload(tmp_path):
+    """Test that merged-latency documents are emitted per fio job and direction and for all jobs."""
+
+    trigger = make_trigger(tmp_path, histogram_percentiles=[50.0, 99.0, 100.0])
+    stats = [
+        {"jobname": "a", "read": {"clat_ns": {"bins": {"1000": 90, "5000": 10}}}},
+        {"jobname": "a", "read": {"clat_ns": {"bins": {"2000": 50, "9000": 50}}}},
+        {"jobname": "b", "write": {"clat_ns": {"bins": {"3000": 10}}}},
+    ]
+    documents = list(trigger._merged_latency_payload(pop_clat_histograms(stats), 1600000000, "job"))
+    assert [(doc["fio_jobname"], doc["data_direction"]) for doc in documents] == [
+        ("a", "read"),
+        ("b", "write"),
+        ("All jobs", "read"),
+        ("All jobs", "write"),
+    ]
+    assert {key: documents[0][key] for key in ("clients", "samples", "median", "p99", "max", "unit")} == {
+        "clients": 2,
+        "samples": 200,
+        "median": 2000,
+        "p99": 9000,
+        "max": 9000,
+        "unit": "ns",
+    }
+    assert documents[0]["timestamp_end"] == 1600000000000
+    assert documents[3]["samples"] == 10
+
+
+def fake_fio(tmp_path, blocks, sleep=0):
+    """Write a fio executable printing JSON status blocks, as with --status-interval."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    script = bin_dir / "fio"
+    output = "fio: client warning\n" + "".join(json.dumps(block, indent=2) + "\n" for block in blocks)
+    script.write_text(
+        "#!%s\nimport sys, time\nsys.stdout.write(%r)\nsys.stdout.flush()\ntime.sleep(%d)\n"
+        % (sys.executable, output, sleep)
+    )
+    script.chmod(0o755)
+    return str(bin_dir)
+
+
+def status_block(timestamp, iops):
+    return {
+        "fio version": "fio-3.27",
+        "timestamp": timestamp,
+        "client_stats": [
+            {
+                "jobname": "job",
+                "hostname": "host1",
+                "read": {"iops": iops, "bw": 4 * iops, "lat_ns": {"mean": 10}},
+            },
+            {"jobname": "All clients", "read": {"iops": iops}},
+        ],
+    }
+
+
+def test_run_fiod_status_yields_interim_documents(tmp_path, monkeypatch):
+    """Test that status blocks are indexed as interim documents and the last one is the result."""
+
+    blocks = [status_block(1600000000, 10), status_block(1600000001, 20), status_block(1600000002, 30)]
+    monkeypatch.setenv("PATH", fake_fio(tmp_path, blocks) + os.pathsep + os.environ["PATH"])
+    trigger = make_trigger(tmp_path, status_interval=1)
+    trigger.host_file = "hosts"
+    output_file = str(tmp_path / "fio-result.json")
+    run = trigger._run_fiod_status("fiojob", str(tmp_path), output_file, "job")
+    documents = []
+    try:
+        while True:
+            documents.append(next(run))
+    except StopIteration as stop:
+        assert stop.value[2] == 0
+    assert [(document["timestamp"], document["read"]["iops"], index) for document, index in documents] == [
+        (1600000000000, 10, "interim"),
+        (1600000001000, 20, "interim"),
+    ]
+    assert documents[0][0]["hostname"] == "host1"
+    assert documents[0][0]["date"] == "2020-09-13T12:26:40.000000Z"
+    with open(output_file) as output:
+        assert json.load(output) == blocks[-1]
+
+
+def test_run_fiod_status_terminates_fio_when_closed(tmp_path, monkeypatch):
+    """Test that fio is stopped when interim documents are no longer consumed."""
+
+    blocks = [status_block(1600000000, 10), status_block(1600000001, 20)]
+    monkeypatch.setenv("PATH", fake_fio(tmp_path, blocks, sleep=60) + os.pathsep + os.environ["PATH"])
+    trigger = make_trigger(tmp_path, status_interval=1)
+    trigger.host_file = "hosts"
+    run = trigger._run_fiod_status("fiojob", str(tmp_path), str(tmp_path / "fio-result.json"), "job")
+    document, index = next(run)
+    assert index == "interim"
+    start = time.time()
+    run.close()
+    assert time.time() - start < 30
+
+
+def test_log_payload_rolls_up_windows(tmp_path):
+    """Test that log lines are rolled up per window and direction, raw lines being archive-only."""
+
+    write_logs(tmp_path, 10)
+    trigger = make_trigger(tmp_path, log_window_ms=4000, raw_logs_archive_only=True)
+    documents = list(trigger._log_payload(str(tmp_path), {"host1": 1600000000000}, "job", None))
+    raw = [index for _, index in documents if index == "log"]
+    assert len(raw) == 100 and all(isinstance(index, ArchiveOnly) for index in raw)
+    rollups = [
+        document
+        for document, index in documents
+        if index == "log-rollup" and document["log_name"] == "lat" and document["job_number"] == 1
+    ]
+    # lines at 0, 1000 ... 9000 ms, windows of 4 lines starting at 0, 4000 and 8000 ms
+    assert [(r["timestamp"], r["data_direction"], r["samples"]) for r in rollups] == [
+        (1600000000000, "read", 2),
+        (1600000000000, "write", 2),
+        (1600000004000, "read", 2),
+        (1600000004000, "write", 2),
+        (1600000008000, "read", 1),
+        (1600000008000, "write", 1),
+    ]
+    # read values of the second window are 104 and 106
+    assert {key: rollups[2][key] for key in ("min", "max", "mean", "p50", "p90")} == {
+        "min": 104,
+        "max": 106,
+        "mean": 105.0,
+        "p50": 105.0,
+        "p90": 105.8,
+    }
+    assert rollups[2]["metric"] == "latency"
+    assert rollups[2]["window_ms"] == 4000
+    assert rollups[2]["date"] == "2020-09-13T12:26:44.000000Z"
+
+
+def test_pipelined_jobs_overlap_fio_with_documents(tmp_path, monkeypatch):
+    """Test that the next fio run starts before the documents of a job are produced, in job order."""
+
+    monkeypatch.setenv("PATH", fake_fio(tmp_path, []) + os.pathsep + os.environ["PATH"])
+    (tmp_path / "hosts").write_text("host1\n")
+    trigger = make_trigger(tmp_path, pipeline_jobs=True)
+    trigger.fio_jobs = ["job", "job2"]
+    trigger.fio_jobs_dict["job2"] = JOB_OPTIONS
+    trigger.host_file = str(tmp_path / "hosts")
+    events = []
+    start_fiod = trigger._start_fiod
+
+    def record_start(fiojob_file, output_dir, fio_output_file):
+        events.append("start " + os.path.basename(output_dir))
+        return start_fiod(fiojob_file, output_dir, fio_output_file)
+
+    def record_documents(job, job_dir, fio_output_file, rc, sample_starttime, sample_endtime):
+        assert rc == 0
+        events.append("documents " + job)
+        yield {"job": job}, "results"
+
+    monkeypatch.setattr(trigger, "_start_fiod", record_start)
+    monkeypatch.setattr(trigger, "_job_documents", record_documents)
+    assert [document["job"] for document, _ in trigger.emit_actions()] == ["job", "job2"]
+    assert events == ["start job", "start job2", "documents job", "documents job2"]
+    assert os.path.exists(str(tmp_path / "job2" / "fio-stdout.log"))
+
+
+def test_stream_results_documents_match_json_load(tmp_path):
+    """Test that results decoded one client at a time give the same documents as loading the file."""
+
+    result = status_block(1600000000, 10)
+    result["client_stats"][0].update(
+        {"job options": {"rw": "read", "bs": "4k"}, "read": {"iops": 10, "clat_ns": {"bins": {"1000": 4}}}}
+    )
+    result["client_stats"].insert(1, dict(result["client_stats"][0], hostname="host2"))
+    fio_output_file = str(tmp_path / "fio-result.json")
+    documents = {}
+    for stream_results in (False, True):
+        with open(fio_output_file, "w") as output:
+            json.dump(result, output, indent=2)
+        trigger = make_trigger(tmp_path, stream_results=stream_results, json_plus=True)
+        trigger.fio_analyzer_obj = Fio_Analyzer("abc", "snafu", "mycluster")
+        run = trigger._job_documents("job", str(tmp_path), fio_output_file, 0, "0", "1")
+        # the log files of the job come next
+        documents[stream_results] = list(itertools.islice(run, 5))
+        assert list(trigger.fio_analyzer_obj.groups) == [("read", "4k")]
+    assert documents[True] == documents[False]
+    assert [index for _, index in documents[True]] == ["results"] * 3 + ["merged-latency"] * 2
+    assert "bins" not in documents[True][0][0]["fio"]["read"]["clat_ns"]
+    assert documents[True][3][0]["samples"] == 8
+
+
+def test_log_payload_workers_report_missing_log_file_in_order(tmp_path):
+    """Test that a missing log file stops the run once the documents of the previous files are yielded."""
+
+    write_logs(tmp_path, 3)
+    os.remove(str(tmp_path / "fio_iops.1.log.host1"))
+    start = {"host1": 1600000000000}
+    documents = make_trigger(tmp_path, workers=3)._log_payload(str(tmp_path), start, "job", None)
+    log_files = []
+    with pytest.raises(SystemExit):
+        for document, _ in documents:
+            if document["log_file"] not in log_files:
+                log_files.append(document["log_file"])
+    assert [os.path.basename(log_file) for log_file in log_files] == [
+        "fio_bw.1.log.host1",
+        "fio_bw.2.log.host1",
+    ]
+
+
+def test_pipelined_jobs_end_time_is_fio_exit(tmp_path, monkeypatch):
+    """Test that a pipelined job ends when its fio exits, not after the documents of the previous job."""
+
+    monkeypatch.setenv("PATH", fake_fio(tmp_path, []) + os.pathsep + os.environ["PATH"])
+    (tmp_path / "hosts").write_text("host1\n")
+    trigger = make_trigger(tmp_path, pipeline_jobs=True)
+    trigger.fio_jobs = ["job", "job2"]
+    trigger.fio_jobs_dict["job2"] = JOB_OPTIONS
+    trigger.host_file = str(tmp_path / "hosts")
+    end_times = {}
+
+    def slow_documents(job, job_dir, fio_output_file, rc, sample_starttime, sample_endtime):
+        end_times[job] = (int(sample_endtime), int(time.time()))
+        if job == "job":
+            # post-processing of the first job outlasts the fio run of the second one
+            time.sleep(1.2)
+        yield {"job": job}, "results"
+
+    monkeypatch.setattr(trigger, "_job_documents", slow_documents)
+    assert [document["job"] for document, _ in trigger.emit_actions()] == ["job", "job2"]
+    sample_endtime, consumed = end_times["job2"]
+    assert sample_endtime < consumed